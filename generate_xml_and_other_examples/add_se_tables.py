@@ -2,6 +2,8 @@ from lxml import etree as et
 import lxml.etree
 import uuid
 
+import aggregation_formulas
+
 # Please change the information here when running the script for each new project/survey
 
 # this is the xml with social explorer tables
@@ -15,46 +17,86 @@ CED_tables_abbreviation = 'SE'
 new_xml_file_name = r'D:/Projects/CEDMetadata/CED2001 - Copy.xml'
 new_org_abbreviation = 'CED2001'
 
+# set to True to derive GUIDs of copied tables and variables from new project and their names instead of random ones,
+# running the script again then gives the same GUIDs
+deterministic_guids = False
+
+# xml with SE tables whose GUIDs should be kept for tables and variables with the same name (e.g. previous version of
+# the new xml), set to None to create new GUIDs
+reuse_guids_xml_file_name = None
 
-def get_previous_xml_formulas():
+
+def get_existing_se_guids():
     """
-    Get formulas other than 'ADD' aggregation method
-    Here is added median, weighted average, Rate, Division of SUms
-    If you want to add additional agg.methods such as Percent and similar, you'll need to add it in the formula loop
-    :return: formula_dict Dict with formulas for each se tables other than 'ADD'
+    Read GUIDs of SE tables and variables from reuse_guids_xml_file_name
+    :return: Dictionary with (table name, variable name) as a key and GUID as a value, variable name is '' for tables
     """
+    existing_guids = {}
+    if not reuse_guids_xml_file_name:
+        return existing_guids
 
-    old_formula_dict = {}
-
-    for var in tree.xpath("//SurveyDatasets/SurveyDataset[@abbreviation='" +
-                          CED_tables_abbreviation+"']/tables/table/variable"):
-        reverse_dict = {val: key for key, val in all_guid.items()}
-        split_vars = var.attrib['AggregationStr'].split('|')
-        if var.attrib['AggregationStr'].startswith('Median') and var.attrib['AggregationStr'].split('|')[2] != '':
-            old_formula_dict.setdefault(var.attrib['name'], [split_vars[0]+'|' +
-                                                             split_vars[1]+'|' +
-                                                             reverse_dict[split_vars[2]]+'|' +
-                                                             split_vars[3]+'|' +
-                                                             split_vars[4]+'|' +
-                                                             split_vars[5]])
-        elif var.attrib['AggregationStr'].startswith('DivisionOfSums') and\
-                var.attrib['AggregationStr'].split('|')[1] != '':
-            old_formula_dict.setdefault(var.attrib['name'], [split_vars[0]+'|' +
-                                                             reverse_dict[split_vars[1]]+'|' +
-                                                             reverse_dict[split_vars[2]]])
-        elif var.attrib['AggregationStr'].startswith('WeightedAvg') and\
-                var.attrib['AggregationStr'].split('|')[1] != '':
-            old_formula_dict.setdefault(var.attrib['name'], [split_vars[0]+'|' +
-                                                             reverse_dict[split_vars[1]]])
+    reuse_tree = lxml.etree.parse(reuse_guids_xml_file_name)
+    for se_table in reuse_tree.xpath("//SurveyDatasets/SurveyDataset[@abbreviation='" +
+                                     CED_tables_abbreviation+"']/tables/table"):
+        existing_guids[(se_table.attrib['name'], '')] = se_table.attrib['GUID']
+        for se_var in se_table.iterfind('variable'):
+            existing_guids[(se_table.attrib['name'], se_var.attrib['name'])] = se_var.attrib['GUID']
+    return existing_guids
 
-        elif var.attrib['AggregationStr'].startswith('Rate') and\
-                var.attrib['AggregationStr'].split('|')[1] != '':
-            old_formula_dict.setdefault(var.attrib['name'], [split_vars[0]+'|' +
-                                                             reverse_dict[split_vars[1]]+'|' +
-                                                             reverse_dict[split_vars[2]]+'|' +
-                                                             split_vars[3]])
 
-    return old_formula_dict
+def new_guid(table_name, variable_name=''):
+    """
+    Get GUID for copied SE table or variable, see deterministic_guids and reuse_guids_xml_file_name
+    :param table_name: Name of the table
+    :param variable_name: Name of the variable, leave empty for table
+    :return: GUID as string
+    """
+    if (table_name, variable_name) in existing_se_guids:
+        return existing_se_guids[(table_name, variable_name)]
+    if deterministic_guids:
+        # same keys as in latest_processing_scripts/create_metadata_file.py
+        namespace = uuid.uuid5(uuid.NAMESPACE_URL, 'CEDMetadata/' + new_org_abbreviation)
+        key = 'SurveyDataset:' + CED_tables_abbreviation + '/table:' + table_name
+        if variable_name:
+            key += '/variable:' + variable_name
+        return str(uuid.uuid5(namespace, key))
+    return str(uuid.uuid4())
+
+
+def get_guid_index(doc):
+    """
+    Index tables and variables of all survey datasets once, so remapping steps don't have to run XPath and build
+    dictionaries again for every variable
+    :param doc: Parsed metadata file
+    :return: Dictionary with name -> GUID ('guid'), GUID -> name ('name'), tables element of SE dataset ('se_tables')
+    and list of SE variables ('se_variables')
+    """
+    variable_guid = {}
+    table_guid = {}
+    index = {'se_tables': None, 'se_variables': []}
+    in_se = False
+    for element in doc.getroot().iter('GeoSurveyDataset', 'SurveyDataset', 'tables', 'table', 'variable'):
+        if element.tag == 'GeoSurveyDataset':
+            # geography tables are not part of formulas
+            in_se = None
+        elif element.tag == 'SurveyDataset':
+            in_se = element.attrib['abbreviation'] == CED_tables_abbreviation
+        elif in_se is None:
+            continue
+        elif element.tag == 'tables':
+            if in_se and index['se_tables'] is None:
+                index['se_tables'] = element
+        elif element.tag == 'table':
+            table_guid[element.attrib['name']] = element.attrib['GUID']
+        else:
+            variable_guid[element.attrib['name']] = element.attrib['GUID']
+            if in_se:
+                index['se_variables'].append(element)
+
+    # table names win over variable names
+    index['guid'] = {**variable_guid, **table_guid}
+    index['name'] = {val: key for key, val in index['guid'].items()}
+    return index
 
 
 def get_se_vars():
@@ -63,20 +105,18 @@ def get_se_vars():
     :return: tables with the new variables (new GUIDS and replaced abbreviations
     """
 
-    previous_xml_tables = tree.xpath("//SurveyDatasets/SurveyDataset[@abbreviation='" +
-                                     CED_tables_abbreviation+"']/tables")[0]
+    previous_xml_tables = old_index['se_tables']
 
     new_table_guid_redistribute = {}
 
     for previous_table in previous_xml_tables:
-        previous_table.attrib['GUID'] = str(uuid.uuid4())
+        previous_table.attrib['GUID'] = new_guid(previous_table.attrib['name'])
         new_table_guid_redistribute[previous_table.attrib['name']] = previous_table.attrib['GUID']
 
     new_variable_guid_redistribute = {}
 
-    for var in tree.xpath("//SurveyDatasets/SurveyDataset[@abbreviation='" +
-                          CED_tables_abbreviation+"']/tables/table/variable"):
-        var.attrib['GUID'] = str(uuid.uuid4())
+    for var in old_index['se_variables']:
+        var.attrib['GUID'] = new_guid(var.getparent().attrib['name'], var.attrib['name'])
         new_variable_guid_redistribute[var.attrib['name']] = var.attrib['GUID']
         if old_org_abbreviation in var.attrib['FormulaFunctionBodyCSharp']:
             var.attrib['FormulaFunctionBodyCSharp'] = var.attrib['FormulaFunctionBodyCSharp'].replace(
@@ -88,52 +128,19 @@ def get_se_vars():
 
 
 def get_new_formulas():
-    for var in tree.xpath("//SurveyDatasets/SurveyDataset[@abbreviation='" +
-                          CED_tables_abbreviation+"']/tables/table/variable"):
-        if var.attrib['AggregationStr'] != 'Add' and var.attrib['AggregationStr'] != 'None':
-            if var.attrib['name'] in formula_dict:
-                var.attrib['AggregationStr'] = formula_dict[var.attrib['name']][0]
-        if old_org_abbreviation in var.attrib['AggregationStr']:
-            var.attrib['AggregationStr'] = var.attrib['AggregationStr'].replace(
-                old_org_abbreviation, new_org_abbreviation)
+    """
+    Point formulas of copied SE variables to tables and variables of the new project in one pass. GUID from the old
+    project is translated to name, old project abbreviation in the name is replaced with the new one and the name is
+    translated to GUID in the new project. Every kind registered in aggregation_formulas.py is remapped.
+    :return: tables with the new formulas
+    """
+    def map_guid(guid):
+        return all_new_guid_se_org[old_index['name'][guid].replace(old_org_abbreviation, new_org_abbreviation)]
+
+    def map_text(text):
+        return text.replace(old_org_abbreviation, new_org_abbreviation)
 
-    var_name_list = []
-    for var_name in tree.xpath("//SurveyDatasets/SurveyDataset/tables/table/variable"):
-        var_name_list.append(var_name.attrib['name'])
-
-    new_formula_dict = {}
-    for var in tree.xpath("//SurveyDatasets/SurveyDataset[@abbreviation='"
-                          + CED_tables_abbreviation+"']/tables/table/variable"):
-        split_vars = var.attrib['AggregationStr'].split('|')
-        if var.attrib['AggregationStr'].startswith('Median') and var.attrib['AggregationStr'].split('|')[2] != '':
-            new_formula_dict.setdefault(var.attrib['name'], [split_vars[0]+'|' +
-                                                             split_vars[1]+'|' +
-                                                             all_new_guid_se_org[split_vars[2]]+'|' +
-                                                             split_vars[3]+'|' +
-                                                             split_vars[4]+'|' +
-                                                             split_vars[5]])
-        elif var.attrib['AggregationStr'].startswith('DivisionOfSums') and\
-                var.attrib['AggregationStr'].split('|')[1] != '':
-            new_formula_dict.setdefault(var.attrib['name'], [split_vars[0]+'|' +
-                                                             all_new_guid_se_org[split_vars[1]]+'|' +
-                                                             all_new_guid_se_org[split_vars[2]]])
-        elif var.attrib['AggregationStr'].startswith('WeightedAvg') and\
-                var.attrib['AggregationStr'].split('|')[1] != '':
-            new_formula_dict.setdefault(var.attrib['name'], [split_vars[0]+'|' +
-                                                             reverse_dict[split_vars[1]]])
-
-        elif var.attrib['AggregationStr'].startswith('Rate') and\
-                var.attrib['AggregationStr'].split('|')[1] != '':
-            new_formula_dict.setdefault(var.attrib['name'], [split_vars[0]+'|' +
-                                                             all_new_guid_se_org[split_vars[1]]+'|' +
-                                                             all_new_guid_se_org[split_vars[2]]+'|' +
-                                                             split_vars[3]])
-
-    for var in tree.xpath("//SurveyDatasets/SurveyDataset[@abbreviation='" +
-                          CED_tables_abbreviation+"']/tables/table/variable"):
-        if var.attrib['AggregationStr'] != 'Add' and var.attrib['AggregationStr'] != 'None':
-            if var.attrib['name'] in new_formula_dict:
-                var.attrib['AggregationStr'] = new_formula_dict[var.attrib['name']][0]
+    aggregation_formulas.remap_formulas(old_index['se_variables'], map_guid, map_text)
 
     return tables
 
@@ -144,7 +151,7 @@ def get_new_xml():
     :return: tables_new
     """
 
-    tables_new = new_tree.xpath("SurveyDatasets/SurveyDataset[@abbreviation='"+CED_tables_abbreviation+"']/tables")
+    tables_new = new_index['se_tables']
 
     return tables_new
 
@@ -156,49 +163,39 @@ def copy_to_new_xml():
     """
     se_vars_by_table = get_new_formulas()
     new_xml_se_vars_by_table = get_new_xml()
-    new_xml_se_vars_by_table[0].extend(se_vars_by_table)
+    new_xml_se_vars_by_table.extend(se_vars_by_table)
 
     new_tree.write(new_xml_file_name)
 
 
-if __name__ == "__main__":
+def main():
+    """
+    Copy SE tables with formulas from old_xml_file_name to new_xml_file_name, see settings at the top of the script
+    :return:
+    """
+    global tree, new_tree, old_index, new_index, existing_se_guids, tables, all_new_guid_se_org
 
     parser_old = lxml.etree.XMLParser(strip_cdata=False)
     tree = lxml.etree.parse(old_xml_file_name, parser_old)
-    input_old_xml = tree.getroot()
 
     parser_new = lxml.etree.XMLParser(strip_cdata=False)
     new_tree = lxml.etree.parse(new_xml_file_name, parser_new)
-    root_new = new_tree.getroot()
-
-    all_new_variables = new_tree.xpath("//SurveyDatasets/SurveyDataset/tables/table/variable")
-    all_new_tables = new_tree.xpath("//SurveyDatasets/SurveyDataset/tables/table")
-
-    all_old_variables = tree.xpath("//SurveyDatasets/SurveyDataset/tables/table/variable")
-    all_old_tables = tree.xpath("//SurveyDatasets/SurveyDataset/tables/table")
-
-    variable_guid = {}
-    for variable in all_old_variables:
-        variable_guid[variable.attrib['name']] = variable.attrib['GUID']
 
-    table_guid = {}
-    for table in all_old_tables:
-        table_guid[table.attrib['name']] = table.attrib['GUID']
-
-    all_guid = {**variable_guid, **table_guid}
-
-    new_variable_guid = {}
-    for variable in all_new_variables:
-        new_variable_guid[variable.attrib['name']] = variable.attrib['GUID']
-
-    new_table_guid = {}
-    for table in all_new_tables:
-        new_table_guid[table.attrib['name']] = table.attrib['GUID']
+    # GUIDs of old index are the ones from the file, get_se_vars changes them only in the document
+    old_index = get_guid_index(tree)
+    new_index = get_guid_index(new_tree)
+    for file_name, index in [(old_xml_file_name, old_index), (new_xml_file_name, new_index)]:
+        if index['se_tables'] is None:
+            raise ValueError(file_name + ' has no ' + CED_tables_abbreviation + ' survey dataset')
+    all_new_guid = new_index['guid']
 
-    all_new_guid = {**new_variable_guid, **new_table_guid}
+    existing_se_guids = get_existing_se_guids()
 
     # in order for some function to debug, you'll need to call it here
     tables, all_new_table_guid = get_se_vars()
     all_new_guid_se_org = {**all_new_table_guid, **all_new_guid}
-    formula_dict = get_previous_xml_formulas()
     copy_to_new_xml()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Parsed AggregationStr of variables, e.g. Rate|<numerator GUID>|<denominator GUID>|100000.
+Every kind of aggregation is registered with the types of its operands, so formulas are parsed and written in one
+place and GUIDs of all variables of a survey can be remapped in one pass.
+
+Operand types:
+    guid    - GUID of a table or a variable, can be empty
+    number  - constant e.g. 100000
+    text    - anything else e.g. interpolation method of Median, it's kept as it is
+
+Kinds that are not registered are kept as text so they are written back unchanged.
+"""
+import collections
+
+# kind -> types of operands after the kind
+aggregation_kinds = collections.OrderedDict()
+
+Operand = collections.namedtuple('Operand', ['type', 'value'])
+
+
+def register_aggregation_kind(kind, operand_types):
+    """
+    Register kind of aggregation
+    :param kind: Name of the kind, the first part of AggregationStr
+    :param operand_types: List of operand types ('guid', 'number' or 'text')
+    :return:
+    """
+    aggregation_kinds[kind] = list(operand_types)
+
+
+register_aggregation_kind('Add', [])
+register_aggregation_kind('None', [])
+register_aggregation_kind('Rate', ['guid', 'guid', 'number'])  # numerator, denominator, multiplier
+register_aggregation_kind('Percent', ['guid', 'guid'])  # numerator, denominator
+register_aggregation_kind('DivisionOfSums', ['guid', 'guid'])  # numerator, denominator
+register_aggregation_kind('WeightedAvg', ['guid'])  # weight
+register_aggregation_kind('Median', ['text', 'guid', 'text', 'number', 'number'])  # method, table, table name, ...
+
+
+class AggregationFormula:
+    """
+    AggregationStr split into kind and typed operands
+    """
+    __slots__ = ('kind', 'operands')
+
+    def __init__(self, kind, operands=()):
+        self.kind = kind
+        self.operands = list(operands)
+
+    @classmethod
+    def parse(cls, aggregation_str):
+        """
+        :param aggregation_str: AggregationStr attribute of variable
+        :return: AggregationFormula
+        """
+        parts = aggregation_str.split('|')
+        operand_types = aggregation_kinds.get(parts[0], [])
+        return cls(parts[0], [
+            Operand(operand_types[i] if i < len(operand_types) else 'text', value)
+            for i, value in enumerate(parts[1:])
+        ])
+
+    def __str__(self):
+        return '|'.join([self.kind] + [operand.value for operand in self.operands])
+
+    def __repr__(self):
+        return 'AggregationFormula({!r}, {!r})'.format(self.kind, self.operands)
+
+    def __eq__(self, other):
+        return isinstance(other, AggregationFormula) and str(self) == str(other)
+
+    def get_references(self):
+        """
+        :return: List of GUIDs the formula refers to, empty operands are skipped
+        """
+        return [operand.value for operand in self.operands if operand.type == 'guid' and operand.value]
+
+    def get_constants(self):
+        """
+        :return: List of number operands as floats, empty operands are None
+        """
+        return [float(i.value) if i.value else None for i in self.operands if i.type == 'number']
+
+    def remap(self, map_guid, map_text=None):
+        """
+        Get the same formula with other GUIDs
+        :param map_guid: Function that gets GUID and returns the new one, it's not called for empty operands
+        :param map_text: Function applied to text operands, they are kept as they are if not set
+        :return: New AggregationFormula
+        """
+        operands = []
+        for operand in self.operands:
+            if operand.type == 'guid' and operand.value:
+                operand = operand._replace(value=map_guid(operand.value))
+            elif operand.type == 'text' and map_text is not None:
+                operand = operand._replace(value=map_text(operand.value))
+            operands.append(operand)
+        return AggregationFormula(self.kind, operands)
+
+
+def remap_formulas(variables, map_guid, map_text=None):
+    """
+    Remap GUIDs in AggregationStr of all variables, variables without references are not changed
+    :param variables: List of variable elements
+    :param map_guid: Function that gets GUID and returns the new one, see AggregationFormula.remap
+    :param map_text: Function applied to text operands, see AggregationFormula.remap
+    :return: Number of changed variables
+    """
+    changed = 0
+    for variable in variables:
+        formula = AggregationFormula.parse(variable.attrib['AggregationStr'])
+        if not formula.get_references():
+            continue
+        variable.attrib['AggregationStr'] = str(formula.remap(map_guid, map_text))
+        changed += 1
+    return changed
@@ -0,0 +1,304 @@
+"""
+Benchmark of metadata maintenance scripts over the metadata files in the repository.
+Every stage runs in its own process so peak RSS of one stage doesn't hide the others.
+
+Stages:
+    parse       - parse every file
+    format_fix  - format_fix.py logic for every template -> project pair from format_fix_manifest.csv
+    char_fix    - replace_chars from fix_spanish_characters.py
+    se_copy     - add_se_tables.py, SE tables of every project are copied to the next project of the same series
+    write       - write every file
+
+Files in the corpus are never changed, everything is written to a temporary directory.
+Results can be saved as a baseline (-b) and every next run is compared with it.
+
+python benchmark_corpus.py -d C:\\Users\\jgarcia\\Documents\\CEDMetadata --save-baseline
+"""
+import collections
+import glob
+import json
+import optparse
+import os
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree as et
+
+import add_se_tables
+import fix_spanish_characters
+import format_fix
+
+try:
+    import resource
+except ImportError:
+    # resource module is not available on Windows
+    resource = None
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+stage_names = ['parse', 'format_fix', 'char_fix', 'se_copy', 'write']
+
+
+def get_peak_rss_mb():
+    """
+    Get peak resident set size of current process
+    :return: Peak RSS in MB or None if it can't be measured on this platform
+    """
+    if resource is None:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        # peak working set on Windows
+        return getattr(psutil.Process().memory_info(), 'peak_wset', 0) / 1024 ** 2
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 1024 ** 2 if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+def parse_file(file_name):
+    parser = et.XMLParser(strip_cdata=False)
+    return et.parse(file_name, parser=parser)
+
+
+def get_series(file_name):
+    """
+    Get series of the project from its file name e.g. PC2018.xml > PC
+    :param file_name: Name of metadata file
+    :return: Series name
+    """
+    return re.sub(r'\d+$', '', os.path.splitext(os.path.basename(file_name))[0])
+
+
+def get_se_copy_pairs(corpus):
+    """
+    Pair every project having SE tables with the next project of the same series
+    :param corpus: Sorted list of metadata files
+    :return: List of (old file, new file) tuples
+    """
+    by_series = collections.defaultdict(list)
+    for file_name in corpus:
+        by_series[get_series(file_name)].append(file_name)
+
+    pairs = []
+    for files in by_series.values():
+        for old_file, new_file in zip(files, files[1:]):
+            se_tables = parse_file(old_file).xpath(
+                "SurveyDatasets/SurveyDataset[@abbreviation='" + add_se_tables.CED_tables_abbreviation +
+                "']/tables/table"
+            )
+            if se_tables:
+                pairs.append((old_file, new_file))
+    return pairs
+
+
+# every bench_ function gets list of metadata files and temporary directory for output and returns
+# number of processed files, their size in bytes, number of failed files and seconds spent
+def bench_parse(corpus, output_dir):
+    start = time.perf_counter()
+    for file_name in corpus:
+        parse_file(file_name)
+    return len(corpus), sum(os.path.getsize(i) for i in corpus), 0, time.perf_counter() - start
+
+
+def bench_format_fix(corpus, output_dir):
+    corpus_dir = os.path.dirname(corpus[0])
+    file_names = {os.path.basename(i).lower(): os.path.basename(i) for i in corpus}
+    manifest = format_fix.read_manifest(os.path.join(script_dir, 'format_fix_manifest.csv'))
+
+    start = time.perf_counter()
+    files, size = 0, 0
+    for template, projects in manifest.items():
+        template_file = format_fix.find_file(corpus_dir, template, file_names)
+        if template_file is None or os.path.basename(template_file).lower() not in file_names:
+            continue
+        template_lookup = format_fix.get_template_lookup(template_file)
+        for project in projects:
+            file_to_fix = format_fix.find_file(corpus_dir, project, file_names)
+            if file_to_fix is None or os.path.basename(file_to_fix).lower() not in file_names:
+                continue
+            format_fix.patch_document(template_lookup, parse_file(file_to_fix).getroot())
+            files += 1
+            size += os.path.getsize(file_to_fix)
+    return files, size, 0, time.perf_counter() - start
+
+
+def bench_char_fix(corpus, output_dir):
+    chars_to_replace = {'Ã³': 'ó', 'Ã¡': 'á', 'Ã±': 'ñ', 'Ãº': 'ú', 'Ã©': 'é'}
+    start = time.perf_counter()
+    failed = 0
+    for file_name in corpus:
+        try:
+            fix_spanish_characters.replace_chars(parse_file(file_name), chars_to_replace)
+        except KeyError:
+            # some projects have tables or variables without labels
+            failed += 1
+    return len(corpus), sum(os.path.getsize(i) for i in corpus), failed, time.perf_counter() - start
+
+
+def bench_se_copy(corpus, output_dir):
+    # looking for SE tables is not part of this stage
+    pairs = get_se_copy_pairs(corpus)
+    start = time.perf_counter()
+    failed = 0
+    for old_file, new_file in pairs:
+        add_se_tables.old_xml_file_name = old_file
+        add_se_tables.old_org_abbreviation = parse_file(old_file).getroot().attrib['name']
+        add_se_tables.new_xml_file_name = os.path.join(output_dir, os.path.basename(new_file))
+        add_se_tables.new_org_abbreviation = parse_file(new_file).getroot().attrib['name']
+        shutil.copyfile(new_file, add_se_tables.new_xml_file_name)
+        try:
+            add_se_tables.main()
+        except (KeyError, IndexError, NameError, ValueError):
+            # e.g. SE tables refer to variables which don't exist in the project
+            failed += 1
+    seconds = time.perf_counter() - start
+    return len(pairs), sum(os.path.getsize(i) + os.path.getsize(j) for i, j in pairs), failed, seconds
+
+
+def bench_write(corpus, output_dir):
+    seconds = 0
+    for file_name in corpus:
+        # parsing is not part of this stage
+        doc = parse_file(file_name)
+        start = time.perf_counter()
+        doc.write(os.path.join(output_dir, os.path.basename(file_name)), pretty_print=True)
+        seconds += time.perf_counter() - start
+    return len(corpus), sum(os.path.getsize(i) for i in corpus), 0, seconds
+
+
+stage_functions = {
+    'parse': bench_parse,
+    'format_fix': bench_format_fix,
+    'char_fix': bench_char_fix,
+    'se_copy': bench_se_copy,
+    'write': bench_write,
+}
+
+
+def run_stage(stage, corpus):
+    """
+    Run one stage over the corpus, runs in worker process
+    :param stage: Name of the stage
+    :param corpus: List of metadata files
+    :return: Dictionary with files, MB, seconds, failed count and peak RSS of the stage
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        files, size, failed, seconds = stage_functions[stage](corpus, output_dir)
+    return {
+        'files': files,
+        'mb': size / 1024 ** 2,
+        'seconds': seconds,
+        'failed': failed,
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
+
+
+def run_benchmark(corpus, stages, repeat=1):
+    """
+    Run stages over the corpus, every stage in a new process
+    :param corpus: List of metadata files
+    :param stages: List of stage names
+    :param repeat: Number of runs of each stage, the fastest run is kept
+    :return: Ordered dictionary with stage name as a key and result of run_stage as a value
+    """
+    results = collections.OrderedDict()
+    for stage in stages:
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_stage, stage, corpus).result()
+            if stage not in results or result['seconds'] < results[stage]['seconds']:
+                results[stage] = result
+    return results
+
+
+def format_change(value, baseline_value):
+    if baseline_value is None or value is None or not baseline_value:
+        return ''
+    return '{:+.1f}%'.format((value - baseline_value) / baseline_value * 100)
+
+
+def print_results(results, baseline=None):
+    """
+    Print throughput and peak RSS for each stage, compared with baseline if there is one
+    :param results: Result of run_benchmark
+    :param baseline: Results loaded from baseline file
+    :return:
+    """
+    baseline = baseline or {}
+    print('{:<12} {:>6} {:>8} {:>9} {:>9} {:>9} {:>10} {:>7}  {}'.format(
+        'Stage', 'Files', 'MB', 'Seconds', 'Files/s', 'MB/s', 'Peak RSS', 'Failed', 'vs. baseline (s / RSS)',
+    ))
+    for stage, result in results.items():
+        seconds = max(result['seconds'], 1e-9)
+        stage_baseline = baseline.get(stage, {})
+        print('{:<12} {:>6} {:>8.1f} {:>9.3f} {:>9.1f} {:>9.1f} {:>10} {:>7}  {} {}'.format(
+            stage, result['files'], result['mb'], result['seconds'], result['files'] / seconds,
+            result['mb'] / seconds,
+            'n/a' if result['peak_rss_mb'] is None else '{:.1f} MB'.format(result['peak_rss_mb']),
+            result['failed'],
+            format_change(result['seconds'], stage_baseline.get('seconds')),
+            format_change(result['peak_rss_mb'], stage_baseline.get('peak_rss_mb')),
+        ))
+
+
+def menu():
+    """
+    Display menu and pass command line parameters.
+    :return: Options object with values from cmd
+    """
+    parser = optparse.OptionParser()
+    parser.add_option(
+        '-d', '--corpus-dir', dest='corpusDir', default=os.path.dirname(script_dir),
+        help='Directory with metadata files, defaults to repository root', metavar='corpusDir',
+    )
+    parser.add_option(
+        '-p', '--pattern', dest='pattern', default='*.xml',
+        help='Pattern of metadata files in corpus directory', metavar='pattern',
+    )
+    parser.add_option(
+        '-s', '--stage', dest='stages', action='append', default=[],
+        help='Stage to run ({}), can be repeated, all stages are run if not set'.format(', '.join(stage_names)),
+        metavar='stage',
+    )
+    parser.add_option(
+        '-n', '--repeat', dest='repeat', type='int', default=1,
+        help='Number of runs of each stage, the fastest one is reported', metavar='repeat',
+    )
+    parser.add_option(
+        '-b', '--baseline', dest='baseline', default=os.path.join(script_dir, 'benchmark_baseline.json'),
+        help='Baseline file to compare results with', metavar='baseline',
+    )
+    parser.add_option(
+        '--save-baseline', dest='saveBaseline', action='store_true', default=False,
+        help='Save results of this run as the new baseline',
+    )
+    (options, args) = parser.parse_args()
+    unknown_stages = set(options.stages) - set(stage_names)
+    if unknown_stages:
+        parser.error('Unknown stages: ' + ', '.join(sorted(unknown_stages)))
+    return options
+
+
+if __name__ == '__main__':
+    opt = menu()
+    corpus_files = sorted(glob.glob(os.path.join(os.path.abspath(opt.corpusDir), opt.pattern)))
+    if not corpus_files:
+        print('Error: No metadata files found!')
+    else:
+        baseline_results = None
+        if os.path.isfile(opt.baseline):
+            with open(opt.baseline, 'r', encoding='utf-8') as f:
+                baseline_results = json.load(f)
+
+        print(f'Benchmarking {len(corpus_files)} files from {opt.corpusDir}')
+        benchmark_results = run_benchmark(corpus_files, opt.stages or stage_names, opt.repeat)
+        print_results(benchmark_results, baseline_results)
+
+        if opt.saveBaseline:
+            with open(opt.baseline, 'w', encoding='utf-8') as f:
+                json.dump(benchmark_results, f, indent=4)
+            print(f'Baseline saved to {opt.baseline}')
@@ -7,6 +7,23 @@ from lxml import etree as et
 from lxml.builder import ElementMaker
 import uuid
 
+# set to True to get the same GUIDs every time the example is generated
+deterministic_guids = False
+
+
+def new_guid(*path):
+    """
+    Create GUID for element, random by default. When deterministic_guids is set it is derived from the project and
+    element path, the same way as in latest_processing_scripts/create_metadata_file.py
+    :param path: Pairs of (element tag, identifying attribute value), empty for survey element
+    :return: GUID as string
+    """
+    if not deterministic_guids:
+        return str(uuid.uuid4())
+    namespace = uuid.uuid5(uuid.NAMESPACE_URL, 'CEDMetadata/CED')
+    key = '/'.join(tag + ':' + value for tag, value in path) if path else 'survey'
+    return str(uuid.uuid5(namespace, key))
+
 
 def get_geotype():
     """
@@ -22,7 +39,7 @@ def get_geotype():
 
     for sumlev in [['SL010', 'Nation', '2', '2', '0'], ['SL040', 'Province', '4', '2', '1']]:
         result.append(e.geoType(e.Visible('true'),
-                                GUID=str(uuid.uuid4()),
+                                GUID=new_guid(('geoType', sumlev[0])),
                                 Name=sumlev[0],
                                 Label=sumlev[1],
                                 QLabel=sumlev[1],
@@ -41,9 +58,10 @@ def get_geotype():
     return result
 
 
-def get_variables():
+def get_variables(table_name):
     """
     Get variables for original tables
+    :param table_name: Name of the table that variables belong to
     :return:
     """
     result = []
@@ -53,7 +71,7 @@ def get_variables():
 
     for v in variables:
         result.append(e.variable(  # repeated for as many times as there are variables
-            GUID=str(uuid.uuid4()),
+            GUID=new_guid(('SurveyDataset', 'ORG'), ('table', table_name), ('variable', v[0])),
             UVID='',
             BracketSourceVarGUID='',
             BracketFromVal='0',
@@ -102,8 +120,8 @@ def get_tables():
                         TableTitle="",
                         TableUniverse=""
                     ),
-                    *get_variables(),
-                    GUID=str(uuid.uuid4()),
+                    *get_variables(t[0]),
+                    GUID=new_guid(('SurveyDataset', 'ORG'), ('table', t[0])),
                     VariablesAreExclusive='false',
                     DollarYear='0',
                     PercentBaseMin='1',
@@ -135,7 +153,7 @@ def get_geo_id_variables():
 
     for i in [['SL010', 'Nation', '2', '2', '0'], ['SL040', 'Province', '4', '2', '1']]:
         result.append(e.variable(
-            GUID=str(uuid.uuid4()),
+            GUID=new_guid(('SurveyDataset', 'Geo'), ('table', 'G001'), ('variable', i[1])),
             UVID='',
             BracketSourceVarGUID='',
             BracketFromVal='0',
@@ -179,7 +197,7 @@ def get_geo_id_tables():
                 TableUniverse=''
             ),
             *get_geo_id_variables(),
-            GUID=str(uuid.uuid4()),
+            GUID=new_guid(('SurveyDataset', 'Geo'), ('table', 'G001')),
             VariablesAreExclusive="false",
             notes="",
             PrivateNotes="",
@@ -244,7 +262,7 @@ def create_metadata_xml():
 
             ),
             *get_geo_id_tables(),
-            GUID=str(uuid.uuid4()),
+            GUID=new_guid(('SurveyDataset', 'Geo')),
             SurveyDatasetTreeNodeExpanded='true',
             TablesTreeNodeExpanded='true',
             IterationsTreeNodeExpanded='false',
@@ -279,7 +297,7 @@ def create_metadata_xml():
                 e.tables(et.Comment("Insert SE tables here !!!"),
 
                          ),
-                GUID=str(uuid.uuid4()),
+                GUID=new_guid(('SurveyDataset', 'SE')),
                 SurveyDatasetTreeNodeExpanded='true',
                 TablesTreeNodeExpanded='true',
                 IterationsTreeNodeExpanded='false',
@@ -311,7 +329,7 @@ def create_metadata_xml():
 
                 ),
                 *get_tables(),
-                GUID=str(uuid.uuid4()),
+                GUID=new_guid(('SurveyDataset', 'ORG')),
                 SurveyDatasetTreeNodeExpanded='true',
                 TablesTreeNodeExpanded='true',
                 IterationsTreeNodeExpanded='false',
@@ -328,7 +346,7 @@ def create_metadata_xml():
                 'CED'  # project_name
             )
         ),
-        GUID=str(uuid.uuid4()),
+        GUID=new_guid(),
         Visible='true',
         GeoTypeTreeNodeExpanded='true',
         GeoCorrespondenceTreeNodeExpanded='false',
@@ -0,0 +1,283 @@
+"""
+This is used to fix variable formatting between projects of the same series.
+Every project gets survey display name, table and variable properties of its template project,
+e.g. PC2005-PC2019 are fixed using PC2018 as a template.
+
+Template -> project pairs are listed in format_fix_manifest.csv (series,template,project).
+Each template is parsed only once and its projects are fixed in parallel.
+
+python format_fix.py -s PC -s SEPE -d C:\\Users\\jgarcia\\Documents\\CEDMetadata
+"""
+import collections
+import csv
+import optparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree as et
+
+# attributes copied from template tables
+fix_scope_tables = [
+    "VariablesAreExclusive",
+    "notes",
+    "PrivateNotes",
+    "TableMapInfo",
+    "DollarYear",
+    "PercentBaseMin",
+    "title",
+    "titleWrapped",
+    "titleShort",
+    "universe",
+    "Visible",
+    "VisibleInMaps",
+    "TreeNodeCollapsed",
+    "DocSectionLinks",
+    "DataCategories",
+    "ProductTags",
+    "FilterRuleName",
+    "CategoryPriorityOrder",
+    "PaletteType",
+    "PaletteInverse",
+    "PaletteName",
+    "ShowOnFirstPageOfCategoryListing",
+    "DbTableSuffix",
+    "source",
+    "DefaultColumnCaption",
+    "samplingInfo",
+]
+
+# attributes copied from template variables
+fix_scope_variables = [
+    'indent',
+    'dataType',
+    'dataTypeLength',
+    'formatting',
+    'aggMethod',
+    'AggregationStr',
+    'customFormatStr',
+    'suppType',
+    'SuppField',
+    'suppFlags',
+    'BubbleSizeHint',
+    'FR',  # filter rule
+    'PN',  # palette
+    'PT',  #
+    'label',
+    'qLabel',
+]
+
+
+def iter_org_elements(root):
+    """
+    Walk the document once and yield tables and variables of ORG survey dataset.
+    Survey datasets are not nested so it is enough to remember which one was seen last.
+    :param root: Survey element
+    :return: Generator of table and variable elements
+    """
+    in_org = False
+    for element in root.iter('GeoSurveyDataset', 'SurveyDataset', 'table', 'variable'):
+        if element.tag in ('GeoSurveyDataset', 'SurveyDataset'):
+            in_org = element.attrib.get('abbreviation') == 'ORG'
+        elif in_org:
+            yield element
+
+
+def get_template_lookup(template_file):
+    """
+    Parse template and take everything needed for fixing other projects from it,
+    tables and variables are matched by last three characters of their name
+    :param template_file: file to use as a template
+    :return: Dictionary with survey display name, year and lookups for tables and variables
+    """
+    root = et.parse(template_file).getroot()
+    template_lookup = {
+        'DisplayName': root.attrib['DisplayName'],
+        'year': root.attrib['year'],
+        'table': {},
+        'variable': {},
+    }
+    fix_scope = {'table': fix_scope_tables, 'variable': fix_scope_variables}
+
+    for element in iter_org_elements(root):
+        template_lookup[element.tag][element.attrib['name'][-3:]] = {
+            fix: element.attrib[fix] for fix in fix_scope[element.tag] if fix in element.attrib
+        }
+    return template_lookup
+
+
+def get_display_name(template_lookup, survey_name):
+    """
+    Get display name for the project from display name of the template
+    :param template_lookup: Result of get_template_lookup
+    :param survey_name: Name of the project to fix
+    :return: Display name
+    """
+    original_survey_year = template_lookup['year']
+
+    # this assumes that survey naming is following convention prefix+survey year e.g. EVR2011,PC2018 etc.
+    new_survey_year = survey_name[-4:]
+
+    if original_survey_year in template_lookup['DisplayName']:
+        return template_lookup['DisplayName'].replace(original_survey_year, new_survey_year)
+    return template_lookup['DisplayName'] + ' ' + new_survey_year
+
+
+def patch_attributes(element, values):
+    """
+    Set attributes that differ from the template
+    :param element: Element to fix
+    :param values: Dictionary of attribute name -> template value
+    :return: Number of changed attributes
+    """
+    changed = 0
+    attrib = element.attrib
+    for fix, value in values.items():
+        if attrib.get(fix) != value:
+            attrib[fix] = value
+            changed += 1
+    return changed
+
+
+def patch_document(template_lookup, root):
+    """
+    Fix title, tables and variables of the project in one walk over the document
+    :param template_lookup: Result of get_template_lookup
+    :param root: Survey element of the project to fix
+    :return: Dictionary with number of changed attributes for title, tables and variables
+    """
+    changes = {
+        'title': patch_attributes(root, {'DisplayName': get_display_name(template_lookup, root.attrib['name'])}),
+        'table': 0,
+        'variable': 0,
+    }
+
+    for element in iter_org_elements(root):
+        try:
+            values = template_lookup[element.tag][element.attrib['name'][-3:]]
+        except KeyError:
+            continue
+        changes[element.tag] += patch_attributes(element, values)
+    return changes
+
+
+def fix_file(template_lookup, file_to_fix):
+    """
+    Fix one project, runs in worker process. File is written only if something has changed.
+    :param template_lookup: Result of get_template_lookup
+    :param file_to_fix: file to be checked and fixed
+    :return: file_to_fix and dictionary with number of changed attributes
+    """
+    parser = et.XMLParser(strip_cdata=False)
+    doc_to_fix = et.parse(file_to_fix, parser=parser)
+
+    changes = patch_document(template_lookup, doc_to_fix.getroot())
+
+    if any(changes.values()):
+        doc_to_fix.write(file_to_fix, pretty_print=True)
+    return file_to_fix, changes
+
+
+def read_manifest(manifest_file, series=None):
+    """
+    Read template -> project pairs
+    :param manifest_file: csv file with series, template and project columns
+    :param series: List of series to take, all series are taken if empty
+    :return: Ordered dictionary with template as a key and list of projects as a value, templates are in order of
+    appearance in manifest
+    """
+    templates = collections.OrderedDict()
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        for line in csv.DictReader(f):
+            if series and line['series'] not in series:
+                continue
+            projects = templates.setdefault(line['template'], [])
+            if line['project'] not in projects:
+                projects.append(line['project'])
+    return templates
+
+
+def find_file(working_dir, file_name, file_names):
+    """
+    Get full path of a project file, names in manifest come from Windows so case is ignored if exact name doesn't exist
+    :param working_dir: Directory with metadata files
+    :param file_name: File name from manifest
+    :param file_names: Dictionary of lowercase file name -> file name in working_dir
+    :return: Full path or None if file doesn't exist
+    """
+    if os.path.isfile(os.path.join(working_dir, file_name)):
+        return os.path.join(working_dir, file_name)
+    if file_name.lower() in file_names:
+        return os.path.join(working_dir, file_names[file_name.lower()])
+    return None
+
+
+def main(manifest_file, working_dir, series=None, workers=None):
+    """
+    Function to run them all
+    :param manifest_file: csv file with series, template and project columns
+    :param working_dir: Directory with metadata files
+    :param series: List of series to fix, all series from manifest are fixed if empty
+    :param workers: Number of worker processes, defaults to number of CPUs
+    :return:
+    """
+    file_names = {i.lower(): i for i in os.listdir(working_dir)}
+
+    # templates are processed one after another because template of one series can be fixed by another one
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for template, projects in read_manifest(manifest_file, series).items():
+            template_file = find_file(working_dir, template, file_names)
+            if template_file is None:
+                print(f'Template {template} does not exist, skipping its projects!')
+                continue
+
+            print(f'Reading template {template}')
+            template_lookup = get_template_lookup(template_file)
+
+            files_to_fix = []
+            for project in projects:
+                file_to_fix = find_file(working_dir, project, file_names)
+                if file_to_fix is None:
+                    print(f'{project} does not exist, skipping ...')
+                    continue
+                files_to_fix.append(file_to_fix)
+
+            for fixed_file, changes in executor.map(
+                fix_file, [template_lookup] * len(files_to_fix), files_to_fix,
+            ):
+                print(
+                    f"Done {os.path.basename(fixed_file)}, changed attributes - title: {changes['title']}, "
+                    f"tables: {changes['table']}, variables: {changes['variable']}"
+                )
+
+
+def menu():
+    """
+    Display menu and pass command line parameters.
+    :return: Options object with values from cmd
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = optparse.OptionParser(usage="%prog [-s SERIES ...] [-d DIR] [-m MANIFEST] [-w WORKERS]")
+    parser.add_option(
+        '-m', '--manifest', dest='manifest', default=os.path.join(script_dir, 'format_fix_manifest.csv'),
+        help='csv file with series,template,project columns', metavar='manifest',
+    )
+    parser.add_option(
+        '-d', '--working-dir', dest='workingDir', default=os.path.dirname(script_dir),
+        help='Directory with metadata files, defaults to repository root', metavar='workingDir',
+    )
+    parser.add_option(
+        '-s', '--series', dest='series', action='append', default=[],
+        help='Series from manifest to fix (e.g. PC), can be repeated, all series are fixed if not set',
+        metavar='series',
+    )
+    parser.add_option(
+        '-w', '--workers', dest='workers', type='int',
+        help='Number of worker processes, defaults to number of CPUs', metavar='workers',
+    )
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+    opt = menu()
+    main(opt.manifest, opt.workingDir, opt.series, opt.workers)
@@ -0,0 +1,293 @@
+"""
+Searchable index of tables and variables of all metadata files in the repository.
+Files are parsed in parallel into a SQLite database, labels and titles are indexed with FTS5 so search ignores case
+and accents (poblacion finds Población). Next runs parse only files whose modification time or size has changed
+and whose content hash is different, files that no longer exist are removed from the index.
+
+python index_corpus.py -q "nacidos extranjero"
+python index_corpus.py -q "poblacion" -s PC2018 -s PC2019
+python index_corpus.py -g 5C1D0B0E-...
+python index_corpus.py -n PC2018_006_CED_V65
+"""
+import glob
+import hashlib
+import optparse
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree as et
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+schema = [
+    'CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, mtime REAL, size INTEGER, sha1 TEXT, survey TEXT)',
+    # one row for every table (variable_name is '') and every variable, label is title for tables
+    'CREATE TABLE IF NOT EXISTS elements (id INTEGER PRIMARY KEY, file TEXT, survey TEXT, dataset TEXT, '
+    'table_name TEXT, variable_name TEXT, guid TEXT, label TEXT)',
+    'CREATE INDEX IF NOT EXISTS elements_file ON elements (file)',
+    'CREATE INDEX IF NOT EXISTS elements_guid ON elements (guid)',
+    'CREATE INDEX IF NOT EXISTS elements_table_name ON elements (table_name)',
+    'CREATE INDEX IF NOT EXISTS elements_variable_name ON elements (variable_name)',
+    "CREATE VIRTUAL TABLE IF NOT EXISTS elements_fts USING fts5(label, content='elements', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+]
+
+
+def get_file_hash(file_path):
+    """
+    Get sha1 of file content
+    :param file_path: Full path to the file
+    :return: Hex digest
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def parse_file(file_path):
+    """
+    Read tables and variables of all survey datasets of one metadata file, runs in worker process
+    :param file_path: Full path to metadata file
+    :return: file_path, survey name, sha1 of the file and list of (dataset, table, variable, GUID, label) tuples
+    """
+    root = et.parse(file_path, et.XMLParser(strip_cdata=False, huge_tree=True)).getroot()
+    rows = []
+    dataset = ''
+    table_name = ''
+    for element in root.iter('GeoSurveyDataset', 'SurveyDataset', 'table', 'variable'):
+        attrib = element.attrib
+        if element.tag in ('GeoSurveyDataset', 'SurveyDataset'):
+            dataset = attrib.get('abbreviation', '')
+        elif element.tag == 'table':
+            table_name = attrib.get('name', '')
+            rows.append((dataset, table_name, '', attrib.get('GUID', ''), attrib.get('title', '')))
+        else:
+            rows.append((dataset, table_name, attrib.get('name', ''), attrib.get('GUID', ''), attrib.get('label', '')))
+    return file_path, root.attrib.get('name', ''), get_file_hash(file_path), rows
+
+
+def open_index(index_path):
+    """
+    Open index database and create its tables if they don't exist
+    :param index_path: Full path to SQLite file
+    :return: Connection
+    """
+    conn = sqlite3.connect(index_path)
+    for statement in schema:
+        conn.execute(statement)
+    return conn
+
+
+def remove_file(conn, file_name):
+    """
+    Remove tables and variables of one file from index
+    :param conn: Index connection
+    :param file_name: File name as stored in index
+    :return:
+    """
+    # rows of external content FTS table are removed with their old values
+    conn.execute(
+        "INSERT INTO elements_fts (elements_fts, rowid, label) SELECT 'delete', id, label FROM elements WHERE file = ?",
+        (file_name,),
+    )
+    conn.execute('DELETE FROM elements WHERE file = ?', (file_name,))
+    conn.execute('DELETE FROM files WHERE file = ?', (file_name,))
+
+
+def get_files_to_parse(conn, corpus):
+    """
+    Compare files with the index, size and modification time are checked first and content hash only if they differ
+    :param conn: Index connection
+    :param corpus: List of full paths to metadata files
+    :return: List of files to parse and list of file names to remove from index
+    """
+    indexed = {row[0]: row[1:] for row in conn.execute('SELECT file, mtime, size, sha1 FROM files')}
+    files_to_parse = []
+    for file_path in corpus:
+        file_name = os.path.basename(file_path)
+        stat = os.stat(file_path)
+        if file_name in indexed:
+            mtime, size, sha1 = indexed[file_name]
+            if mtime == stat.st_mtime and size == stat.st_size:
+                continue
+            if size == stat.st_size and sha1 == get_file_hash(file_path):
+                # file was only touched, e.g. checked out again
+                conn.execute('UPDATE files SET mtime = ? WHERE file = ?', (stat.st_mtime, file_name))
+                continue
+        files_to_parse.append(file_path)
+
+    corpus_names = {os.path.basename(i) for i in corpus}
+    files_to_remove = [i for i in indexed if i not in corpus_names]
+    return files_to_parse, files_to_remove
+
+
+def update_index(conn, corpus, workers=None):
+    """
+    Bring index up to date with the corpus
+    :param conn: Index connection
+    :param corpus: List of full paths to metadata files
+    :param workers: Number of worker processes, defaults to number of CPUs
+    :return: Number of parsed, removed and failed files
+    """
+    files_to_parse, files_to_remove = get_files_to_parse(conn, corpus)
+    for file_name in files_to_remove:
+        remove_file(conn, file_name)
+
+    failed = 0
+    if files_to_parse:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(parse_file, i) for i in files_to_parse]
+            for future in futures:
+                try:
+                    file_path, survey, sha1, rows = future.result()
+                except et.XMLSyntaxError as ex:
+                    print('Skipping file that is not valid xml:', ex)
+                    failed += 1
+                    continue
+                file_name = os.path.basename(file_path)
+                stat = os.stat(file_path)
+                remove_file(conn, file_name)
+                conn.execute(
+                    'INSERT INTO files (file, mtime, size, sha1, survey) VALUES (?, ?, ?, ?, ?)',
+                    (file_name, stat.st_mtime, stat.st_size, sha1, survey),
+                )
+                # new rows get ids after the last one so they can be added to FTS table in one statement
+                first_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM elements').fetchone()[0]
+                conn.executemany(
+                    'INSERT INTO elements (file, survey, dataset, table_name, variable_name, guid, label) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(file_name, survey) + row for row in rows],
+                )
+                conn.execute(
+                    'INSERT INTO elements_fts (rowid, label) SELECT id, label FROM elements WHERE id >= ?',
+                    (first_id,),
+                )
+    conn.commit()
+    return len(files_to_parse) - failed, len(files_to_remove), failed
+
+
+def get_match_query(text):
+    """
+    Turn search text into FTS5 query where every word must be found, words are quoted so characters like '-' or '('
+    are not taken as FTS5 syntax, last word is a prefix
+    :param text: Search text
+    :return: FTS5 query
+    """
+    words = ['"' + word.replace('"', '""') + '"' for word in text.split()]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def search(conn, text=None, guid=None, name=None, surveys=None, limit=50):
+    """
+    Find tables and variables
+    :param conn: Index connection
+    :param text: Words to find in labels and titles, accents and case are ignored
+    :param guid: GUID of table or variable
+    :param name: Name of table or variable
+    :param surveys: List of surveys to search in, all surveys if empty
+    :param limit: Maximum number of results
+    :return: List of (file, survey, dataset, table, variable, GUID, label) tuples, best matches first when text is set
+    """
+    # file is selected too, copies of the same survey in different files have the same rows otherwise
+    query = 'SELECT file, survey, dataset, table_name, variable_name, guid, label FROM elements'
+    conditions = []
+    params = []
+    order = ['survey', 'file', 'dataset', 'table_name', 'variable_name']
+    if text:
+        query += (
+            ' JOIN (SELECT rowid, rank FROM elements_fts WHERE elements_fts MATCH ?) AS matches '
+            'ON matches.rowid = elements.id'
+        )
+        params.append(get_match_query(text))
+        # better matches first
+        order.insert(0, 'matches.rank')
+    if guid:
+        conditions.append('guid = ?')
+        params.append(guid)
+    if name:
+        conditions.append('(table_name = ? OR variable_name = ?)')
+        params += [name, name]
+    if surveys:
+        conditions.append('survey IN (' + ', '.join('?' * len(surveys)) + ')')
+        params += surveys
+
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY ' + ', '.join(order) + ' LIMIT ?'
+    return conn.execute(query, params + [limit]).fetchall()
+
+
+def menu():
+    """
+    Display menu and pass command line parameters.
+    :return: Options object with values from cmd
+    """
+    parser = optparse.OptionParser()
+    parser.add_option(
+        '-d', '--corpus-dir', dest='corpusDir', default=os.path.dirname(script_dir),
+        help='Directory with metadata files, defaults to repository root', metavar='corpusDir',
+    )
+    parser.add_option(
+        '-p', '--pattern', dest='pattern', default='*.xml',
+        help='Pattern of metadata files in corpus directory', metavar='pattern',
+    )
+    parser.add_option(
+        '-i', '--index', dest='index', default=os.path.join(script_dir, 'corpus_index.sqlite'),
+        help='SQLite file with the index', metavar='index',
+    )
+    parser.add_option(
+        '-w', '--workers', dest='workers', type='int',
+        help='Number of worker processes, defaults to number of CPUs', metavar='workers',
+    )
+    parser.add_option(
+        '-u', '--skip-update', dest='skipUpdate', action='store_true', default=False,
+        help="Search the index as it is, don't check corpus for changed files",
+    )
+    parser.add_option(
+        '-q', '--query', dest='query',
+        help='Words to find in variable labels and table titles, accents and case are ignored', metavar='query',
+    )
+    parser.add_option(
+        '-g', '--guid', dest='guid', help='Find table or variable by GUID', metavar='guid',
+    )
+    parser.add_option(
+        '-n', '--name', dest='name', help='Find table or variable by name', metavar='name',
+    )
+    parser.add_option(
+        '-s', '--survey', dest='surveys', action='append', default=[],
+        help='Search only in this survey (e.g. PC2018), can be repeated', metavar='survey',
+    )
+    parser.add_option(
+        '-l', '--limit', dest='limit', type='int', default=50,
+        help='Maximum number of results', metavar='limit',
+    )
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+    opt = menu()
+    index_conn = open_index(opt.index)
+
+    if not opt.skipUpdate:
+        start = time.perf_counter()
+        corpus_files = sorted(glob.glob(os.path.join(os.path.abspath(opt.corpusDir), opt.pattern)))
+        parsed, removed, failed_files = update_index(index_conn, corpus_files, opt.workers)
+        print(
+            f'Index updated in {time.perf_counter() - start:.2f}s, files: {len(corpus_files)}, parsed: {parsed}, '
+            f'removed: {removed}, failed: {failed_files}'
+        )
+
+    if opt.query or opt.guid or opt.name:
+        start = time.perf_counter()
+        results = search(index_conn, opt.query, opt.guid, opt.name, opt.surveys, opt.limit)
+        for result in results:
+            print('{:<28} {:<16} {:<6} {:<24} {:<28} {}  {}'.format(*result))
+        print(f'Found {len(results)} results in {(time.perf_counter() - start) * 1000:.1f}ms')
+    index_conn.close()
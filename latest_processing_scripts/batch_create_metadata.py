@@ -0,0 +1,198 @@
+"""
+This script will generate metadata files for many projects at once.
+Every config file is processed by create_metadata_file.py logic in a separate worker process.
+"""
+import glob
+import optparse
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import create_metadata_file
+
+
+def get_config_files(config_locations):
+    """
+    Get list of config files from directories and glob patterns
+    :param config_locations: List of directories (all .yml files in them are used) or glob patterns
+    :return: Sorted list of full paths to config files
+    """
+    config_files = set()
+    for location in config_locations:
+        if os.path.isdir(location):
+            location = os.path.join(location, '*.yml')
+        config_files.update(os.path.abspath(i) for i in glob.glob(location))
+    return sorted(config_files)
+
+
+def get_snapshot_path(snapshot_directory, config_file):
+    """
+    Snapshot for a project is named after its config file e.g. configs/PC2018.yml > snapshots/PC2018.json.gz
+    :param snapshot_directory: Directory with snapshots, if not set no snapshot is used
+    :param config_file: Full path to config file
+    :return: Full path to snapshot file or None
+    """
+    if not snapshot_directory:
+        return None
+    config_name = os.path.splitext(os.path.basename(config_file))[0]
+    return os.path.join(snapshot_directory, config_name + '.json.gz')
+
+
+def process_project(config_file, from_snapshot=None, save_snapshot=None, stream_xml=False, deterministic_guids=False,
+                    reuse_guids=False, incremental=False, from_csv=False, profile_columns=False):
+    """
+    Generate metadata file for one project, runs in worker process
+    :param config_file: Full path to config file
+    :param from_snapshot: Full path to catalog snapshot to use instead of database
+    :param save_snapshot: Full path where catalog snapshot should be saved
+    :param stream_xml: Write metadata file incrementally instead of building it in memory
+    :param deterministic_guids: Derive GUIDs from project id and element names
+    :param reuse_guids: Keep GUIDs from the existing output file of the project
+    :param incremental: Rebuild only changed tables of the existing output file of the project
+    :param from_csv: Read tables and columns from data files of the project instead of database
+    :param profile_columns: Set data type and formatting of variables from their values
+    :return: Dictionary with result of the run
+    """
+    start = time.perf_counter()
+    result = {'config': config_file, 'ok': False, 'error': '', 'tables': 0, 'variables': 0}
+    try:
+        reuse_guids_from = None
+        if reuse_guids:
+            config = create_metadata_file.get_config(config_file)
+            reuse_guids_from = config['outputDirectory'] + config['metadataFileName']
+        summary = create_metadata_file.run(
+            config_file, from_snapshot=from_snapshot, save_snapshot=save_snapshot, stream_xml=stream_xml,
+            deterministic_guids=deterministic_guids, reuse_guids_from=reuse_guids_from, incremental=incremental,
+            from_csv=from_csv, profile_columns=profile_columns,
+        )
+        if summary is None:
+            result['error'] = 'Config file is not valid'
+        else:
+            result.update(summary)
+            result['ok'] = True
+    # create_metadata_file exits on errors in input data, it shouldn't stop other projects
+    except (Exception, SystemExit) as ex:
+        result['error'] = repr(ex)
+        traceback.print_exc()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def print_summary(results, total_seconds):
+    """
+    Print wall time and status for each project and totals
+    :param results: List of results from process_project
+    :param total_seconds: Duration of the whole batch
+    :return:
+    """
+    print()
+    print('{:<50} {:>8} {:>8} {:>10}  {}'.format('Config', 'Tables', 'Vars', 'Seconds', 'Status'))
+    for result in sorted(results, key=lambda x: x['config']):
+        print('{:<50} {:>8} {:>8} {:>10.2f}  {}'.format(
+            os.path.basename(result['config']), result['tables'], result['variables'], result['seconds'],
+            'OK' if result['ok'] else 'FAILED: ' + result['error'],
+        ))
+    failed = [i for i in results if not i['ok']]
+    print(
+        "Projects: {}, failed: {}, wall time: {:.2f}s, sum of project times: {:.2f}s".format(
+            len(results), len(failed), total_seconds, sum(i['seconds'] for i in results),
+        ),
+    )
+
+
+def run_batch(config_files, workers=None, from_snapshots=None, save_snapshots=None, stream_xml=False,
+              deterministic_guids=False, reuse_guids=False, incremental=False, from_csv=False, profile_columns=False):
+    """
+    Generate metadata files for all config files in parallel
+    :param config_files: List of full paths to config files
+    :param workers: Number of worker processes, defaults to number of CPUs
+    :param from_snapshots: Directory with catalog snapshots to use instead of database
+    :param save_snapshots: Directory where catalog snapshots should be saved
+    :param stream_xml: Write metadata files incrementally instead of building them in memory
+    :param deterministic_guids: Derive GUIDs from project id and element names
+    :param reuse_guids: Keep GUIDs from the existing output file of every project
+    :param incremental: Rebuild only changed tables of the existing output file of every project
+    :param from_csv: Read tables and columns from data files of every project instead of database
+    :param profile_columns: Set data type and formatting of variables from their values
+    :return: List of results from process_project
+    """
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                process_project, config_file,
+                get_snapshot_path(from_snapshots, config_file), get_snapshot_path(save_snapshots, config_file),
+                stream_xml, deterministic_guids, reuse_guids, incremental, from_csv, profile_columns,
+            ) for config_file in config_files
+        ]
+        for future in as_completed(futures):
+            results.append(future.result())
+    print_summary(results, time.perf_counter() - start)
+    return results
+
+
+def menu():
+    """
+    Display menu and pass command line parameters.
+    :return: Options object and list of config directories/patterns from cmd
+    """
+    usage = "%prog [options] CONFIG_DIR_OR_GLOB [CONFIG_DIR_OR_GLOB ...]"
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option(
+        '-w', '--workers', dest='workers', type='int',
+        help='Number of worker processes, defaults to number of CPUs', metavar='workers',
+    )
+    parser.add_option(
+        '-f', '--from-snapshots', dest='fromSnapshots',
+        help='Directory with catalog snapshots (CONFIG_NAME.json.gz) to use instead of database',
+        metavar='fromSnapshots',
+    )
+    parser.add_option(
+        '-s', '--save-snapshots', dest='saveSnapshots',
+        help='Directory where catalog snapshots (CONFIG_NAME.json.gz) should be saved', metavar='saveSnapshots',
+    )
+    parser.add_option(
+        '-x', '--stream-xml', dest='streamXml', action='store_true', default=False,
+        help='Write metadata files incrementally, use it for projects with thousands of tables',
+    )
+    parser.add_option(
+        '-g', '--deterministic-guids', dest='deterministicGuids', action='store_true', default=False,
+        help='Derive GUIDs from project id and element names so regenerated files have the same GUIDs',
+    )
+    parser.add_option(
+        '-r', '--reuse-guids', dest='reuseGuids', action='store_true', default=False,
+        help='Keep GUIDs from existing output file of every project for matching elements',
+    )
+    parser.add_option(
+        '-i', '--incremental', dest='incremental', action='store_true', default=False,
+        help='Rebuild only new and changed tables of existing output file of every project',
+    )
+    parser.add_option(
+        '-d', '--from-csv', dest='fromCsv', action='store_true', default=False,
+        help='Generate metadata from data files in sourceDirectory of every project instead of database',
+    )
+    parser.add_option(
+        '-t', '--profile-columns', dest='profileColumns', action='store_true', default=False,
+        help='Set dataType, dataTypeLength and formatting of variables from their values, all rows are read',
+    )
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('At least one config directory or glob pattern is required!')
+    return options, args
+
+
+if __name__ == '__main__':
+    opt, locations = menu()
+    configs = get_config_files(locations)
+    if not configs:
+        print("Error: No config files found!")
+    else:
+        batch_results = run_batch(
+            configs, opt.workers, opt.fromSnapshots, opt.saveSnapshots, opt.streamXml, opt.deterministicGuids,
+            opt.reuseGuids, opt.incremental, opt.fromCsv, opt.profileColumns,
+        )
+        if any(not i['ok'] for i in batch_results):
+            sys.exit(1)
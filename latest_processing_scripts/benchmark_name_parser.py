@@ -0,0 +1,124 @@
+"""
+Micro-benchmark of table and column name parsing on a synthetic catalog.
+Compares old slicing (list of '_' positions built with enumerate for every name) with parse_table_name and
+parse_variable_name from create_metadata_file.py.
+
+python benchmark_name_parser.py -c 100000
+"""
+import optparse
+import time
+
+import create_metadata_file
+
+
+def get_synthetic_catalog(columns, project_id='PC2018', sumlevs=('SL010', 'SL030', 'SL040', 'SL050'),
+                          columns_per_table=100):
+    """
+    Create catalog with the same shape as catalog['columns'], every table exists on every sumlev
+    :param columns: Number of columns in catalog
+    :param project_id: Project id used in table and column names
+    :param sumlevs: Sumlevs of the project
+    :param columns_per_table: Number of columns in every table
+    :return: Dictionary with table name as a key and list of column names as a value
+    """
+    catalog = {}
+    tables = max(columns // (columns_per_table * len(sumlevs)), 1)
+    for sumlev in sumlevs:
+        for table in range(1, tables + 1):
+            table_seq = str(table).zfill(3)
+            catalog[project_id + '_' + sumlev + '_' + table_seq] = [
+                project_id + '_' + table_seq + '_CED_V' + str(variable) for variable in range(columns_per_table)
+            ]
+    return catalog
+
+
+def parse_with_slicing(catalog):
+    """
+    Old way of parsing, as it was done in get_tables_from_db, get_variables and iter_tables
+    """
+    result = []
+    for table_name, variables in catalog.items():
+        cut_pos = [i for i, el in enumerate(table_name) if el == '_']
+        meta_table_name = table_name[:cut_pos[0]] + '_' + table_name[cut_pos[-1] + 1:]
+        table_suffix = table_name.split('_')[-1]
+        for variable in variables:
+            if len([index for index, chr in enumerate(variable) if chr == '_']) == 0:
+                continue
+            pos = [index for index, chr in enumerate(variable) if chr == '_'][1] + 1
+            result.append((meta_table_name, table_suffix, variable[pos:]))
+    return result
+
+
+def parse_with_parser(catalog):
+    """
+    Same as parse_with_slicing but with parse_table_name and parse_variable_name
+    """
+    result = []
+    for table_name, variables in catalog.items():
+        table = create_metadata_file.parse_table_name(table_name)
+        for variable in variables:
+            var_suffix = create_metadata_file.parse_variable_name(variable).var_suffix
+            if var_suffix is None:
+                continue
+            result.append((table.meta_table_name, table.table_seq, var_suffix))
+    return result
+
+
+def time_function(function, catalog, repeat):
+    """
+    Run function on catalog repeat times
+    :param function: parse_with_slicing or parse_with_parser
+    :param catalog: Result of get_synthetic_catalog
+    :param repeat: Number of runs
+    :return: Result of the function and the fastest time of repeat runs
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(catalog)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return result, best
+
+
+def menu():
+    """
+    Display menu and pass command line parameters.
+    :return: Options object with values from cmd
+    """
+    parser = optparse.OptionParser()
+    parser.add_option(
+        '-c', '--columns', dest='columns', type='int', default=100000,
+        help='Number of columns in synthetic catalog', metavar='columns',
+    )
+    parser.add_option(
+        '-n', '--repeat', dest='repeat', type='int', default=5,
+        help='Number of runs, the fastest one is reported', metavar='repeat',
+    )
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+    opt = menu()
+    synthetic_catalog = get_synthetic_catalog(opt.columns)
+    print(
+        'Tables:', len(synthetic_catalog),
+        'columns:', sum(len(i) for i in synthetic_catalog.values()),
+    )
+
+    old_result, old_seconds = time_function(parse_with_slicing, synthetic_catalog, opt.repeat)
+
+    # first run fills the cache, same column names exist on every sumlev so cache is used even in the first run
+    create_metadata_file.parse_table_name.cache_clear()
+    create_metadata_file.parse_variable_name.cache_clear()
+    cold_result, cold_seconds = time_function(parse_with_parser, synthetic_catalog, 1)
+    warm_result, warm_seconds = time_function(parse_with_parser, synthetic_catalog, opt.repeat)
+
+    if old_result != cold_result or old_result != warm_result:
+        print('Error: Parser and slicing give different results!')
+    print('{:<20} {:>10.3f}s'.format('Slicing', old_seconds))
+    print('{:<20} {:>10.3f}s {:>6.1f}x'.format('Parser (cold cache)', cold_seconds, old_seconds / cold_seconds))
+    print('{:<20} {:>10.3f}s {:>6.1f}x'.format('Parser (warm cache)', warm_seconds, old_seconds / warm_seconds))
+    print(create_metadata_file.parse_variable_name.cache_info())
@@ -0,0 +1,97 @@
+"""
+Scaling benchmark of table deduplication across sumlevs.
+Compares old list based duplication check from iter_tables with TableRegistry from create_metadata_file.py.
+
+python benchmark_table_registry.py -t 1000 -t 10000 -t 100000
+"""
+import optparse
+import time
+
+import create_metadata_file
+
+
+def get_synthetic_table_names(tables, project_id='PC2018', sumlevs=('SL010', 'SL030', 'SL040', 'SL050')):
+    """
+    Create sorted database table names, every table exists on every sumlev
+    :param tables: Number of database tables
+    :param project_id: Project id used in table names
+    :param sumlevs: Sumlevs of the project
+    :return: Sorted list of table names
+    """
+    table_seqs = max(tables // len(sumlevs), 1)
+    return sorted(
+        project_id + '_' + sumlev + '_' + str(table_seq).zfill(6)
+        for sumlev in sumlevs for table_seq in range(1, table_seqs + 1)
+    )
+
+
+def deduplicate_with_list(table_names):
+    """
+    Old way of deduplication, as it was done in iter_tables
+    """
+    duplication_check_list = []
+    result = []
+    for k in table_names:
+        cut_pos = [i for i, el in enumerate(k) if el == '_']
+        if (k[:cut_pos[0]] + k[cut_pos[-1] + 1:]) in duplication_check_list:
+            continue
+        duplication_check_list.append(k[:cut_pos[0]] + k[cut_pos[-1] + 1:])
+        result.append(k[:cut_pos[0]] + '_' + k[cut_pos[-1] + 1:])
+    return result
+
+
+def deduplicate_with_registry(table_names):
+    """
+    Same as deduplicate_with_list but with TableRegistry
+    """
+    table_registry = create_metadata_file.TableRegistry({})
+    for k in table_names:
+        table_registry.add(k)
+    return [i.meta_table_name for i in table_registry]
+
+
+def time_function(function, table_names):
+    """
+    :param function: deduplicate_with_list or deduplicate_with_registry
+    :param table_names: Result of get_synthetic_table_names
+    :return: Result of the function and seconds spent
+    """
+    create_metadata_file.parse_table_name.cache_clear()
+    start = time.perf_counter()
+    result = function(table_names)
+    return result, time.perf_counter() - start
+
+
+def menu():
+    """
+    Display menu and pass command line parameters.
+    :return: Options object with values from cmd
+    """
+    parser = optparse.OptionParser()
+    parser.add_option(
+        '-t', '--tables', dest='tables', type='int', action='append', default=[],
+        help='Number of database tables, can be repeated, defaults to 1000, 10000 and 100000', metavar='tables',
+    )
+    parser.add_option(
+        '-l', '--list-limit', dest='listLimit', type='int', default=100000,
+        help='Old list based check is skipped for more tables than this, it is quadratic', metavar='listLimit',
+    )
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+    opt = menu()
+    print('{:>10} {:>12} {:>12} {:>10}'.format('Tables', 'List', 'Registry', 'Speedup'))
+    for table_count in opt.tables or [1000, 10000, 100000]:
+        synthetic_table_names = get_synthetic_table_names(table_count)
+        registry_result, registry_seconds = time_function(deduplicate_with_registry, synthetic_table_names)
+        if table_count > opt.listLimit:
+            print('{:>10} {:>12} {:>11.3f}s {:>10}'.format(table_count, 'skipped', registry_seconds, ''))
+            continue
+        list_result, list_seconds = time_function(deduplicate_with_list, synthetic_table_names)
+        if list_result != registry_result:
+            print('Error: List and registry give different results!')
+        print('{:>10} {:>11.3f}s {:>11.3f}s {:>9.1f}x'.format(
+            table_count, list_seconds, registry_seconds, list_seconds / registry_seconds,
+        ))
@@ -3,12 +3,22 @@ This script will generate metadata file
 v2.9 CED EDITION
 """
 import collections  # used for dictionary sorting
+import contextlib
 import csv
 import datetime  # used for validation
+import functools
+import gc
+import gzip
+import hashlib
+import json
 import optparse
 import os
+import pickle
 import sys
+import time
+import tracemalloc
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from sys import argv
 
 import pymssql
@@ -18,33 +28,391 @@ from lxml import etree as et
 from lxml.builder import ElementMaker
 
 
-def get_table_fipses(table_fips, geo_level_info):
+GeoLevel = collections.namedtuple(
+    'GeoLevel', ['sumlev', 'name', 'fips_length', 'partial_fips_length', 'indent', 'acronym'],
+)
+
+
+class GeoHierarchy:
     """
-    This will create a string with list of FIPS columns (SL050_FIPS, SL040_FIPS, etc.) based on nesting information
-    (DB Conn. Info) to be used as primary keys.
-    :param table_fips: Fips code for the geo that table is on e.g. for county level table it's FIPS_SL050
-    :param geo_level_info: GeoInfo from config file
-    :return: String with list of FIPS columns
-    """
-    # this list should always return just one element, if not then sumlevs are not unique
-    low_fips_pos = [
-        i for i, k in enumerate(
-            geo_level_info,
-        ) if k[0] == table_fips.replace('_FIPS', '')
-    ][0]
-    full_fips_list = [table_fips]
-    for i in reversed(range(low_fips_pos)):
-        # stop adding sumlevs if you find geo level with indent 0 or fips length of 0
-        if geo_level_info[i][4] == 0 or geo_level_info[i][2] == '0':
-            break
-        # if you find sumlev with same indent as previous or greater than wanted then skip it
-        if geo_level_info[i][4] == geo_level_info[i + 1][4] or geo_level_info[i][4] >= geo_level_info[low_fips_pos][4]:
-            continue
+    Geo levels from geoLevelInfo (Geo_level, Geo_level_name, FIPS length, PARTIAL FIPS length, Indent) and their
+    nesting. Levels that every level is nested in are found once when hierarchy is created, so it should be created
+    once per run and used for all lookups. FIPS of a parent is the beginning of FIPS of its children.
+    """
+
+    def __init__(self, geo_level_info, geo_types_path=None):
+        """
+        :param geo_level_info: GeoInfo from config file
+        :param geo_types_path: Full path to all_geotypes_and_sumlev.csv, optional, it's needed only for
+        get_sumlevs_of_types
+        """
+        self.levels = collections.OrderedDict()
+        for i in geo_level_info:
+            self.levels[i[0]] = GeoLevel(i[0], i[1], int(i[2]), int(i[3]), int(i[4]), create_acronym(i[1]))
+        self.positions = {sumlev: position for position, sumlev in enumerate(self.levels)}
+
+        levels = list(self.levels.values())
+        # sumlev -> sumlevs it is nested in, from the top one
+        self.ancestors = {}
+        for position, level in enumerate(levels):
+            ancestors = []
+            for i in reversed(range(position)):
+                # levels before geo level with fips length of 0 are not nested, indent of 0 doesn't stop nesting
+                if levels[i].fips_length == 0:
+                    break
+                # if you find sumlev with same indent as previous or greater than wanted then skip it
+                if levels[i].indent == levels[i + 1].indent or levels[i].indent >= level.indent:
+                    continue
+                ancestors.append(levels[i].sumlev)
+            self.ancestors[level.sumlev] = tuple(reversed(ancestors))
+        # list of FIPS columns (SL010_FIPS, SL040_FIPS, etc.) used as primary keys of tables
+        self.primary_keys = {
+            sumlev: ','.join(i + '_FIPS' for i in ancestors + (sumlev,)) for sumlev, ancestors in self.ancestors.items()
+        }
+
+        # geo type (TYPE column) -> sumlevs
+        self.sumlevs_by_type = collections.defaultdict(set)
+        if geo_types_path:
+            with open_csv_file(geo_types_path) as f:
+                for line in csv.DictReader(f):
+                    self.sumlevs_by_type[line['TYPE']].add(line['SUMLEV'])
+
+    def get_ancestors(self, sumlev):
+        """
+        :param sumlev: Sumlev e.g. SL050
+        :return: Tuple of sumlevs that sumlev is nested in, from the top one e.g. ('SL010', 'SL030', 'SL040')
+        """
+        return self.ancestors[sumlev]
+
+    def get_primary_key(self, sumlev):
+        """
+        :param sumlev: Sumlev e.g. SL050
+        :return: String with FIPS columns of ancestors and the sumlev e.g. SL010_FIPS,SL030_FIPS,SL040_FIPS,SL050_FIPS
+        """
+        return self.primary_keys[sumlev]
+
+    def get_sumlevs_of_types(self, geo_types):
+        """
+        :param geo_types: Geo types from all_geotypes_and_sumlev.csv e.g. ['NATION', 'MUNICIPIO']
+        :return: List of their sumlevs ordered as in geoLevelInfo, sumlevs that are not in it are the last
+        """
+        sumlevs = set()
+        for geo_type in geo_types:
+            sumlevs.update(self.sumlevs_by_type[geo_type])
+        return sorted(sumlevs, key=lambda x: (self.positions.get(x, len(self.positions)), x))
+
+    def __getitem__(self, sumlev):
+        return self.levels[sumlev]
+
+    def __contains__(self, sumlev):
+        return sumlev in self.levels
+
+    def __iter__(self):
+        return iter(self.levels.values())
+
+    def __len__(self):
+        return len(self.levels)
+
+
+# connections opened during a run, shared by all functions that read from database, keyed by connection parameters
+_connection_pool = {}
+# used for timing report, connection setup should be paid only once per run
+connection_stats = {'opened': 0, 'reused': 0, 'setup_seconds': 0.0}
+
+
+def open_db_connection(server, dbname, user, password, trusted_connection):
+    """
+    Open new connection to the database, use get_db_connection instead unless you really need separate connection
+    :param server: Server name
+    :param dbname: Database name
+    :param user: username for sql server
+    :param password: password for sql server
+    :param trusted_connection: flag if server credentials are needed
+    :return: Connection object
+    """
+    if trusted_connection:
+        conn = pyodbc.connect(
+            "Driver={SQL Server};Server=" + server + ";Trusted_Connection=yes;database=" + dbname,
+        )
+    else:
+        conn = pymssql.connect(
+            host=server, database=dbname,
+            user=user, password=password,
+        )
+    return conn
+
+
+def get_db_connection(server, dbname, user, password, trusted_connection):
+    """
+    Get connection from the pool, connection is created only first time it is requested for given parameters
+    :param server: Server name
+    :param dbname: Database name
+    :param user: username for sql server
+    :param password: password for sql server
+    :param trusted_connection: flag if server credentials are needed
+    :return: Connection object
+    """
+    key = (server, dbname, user, bool(trusted_connection))
+    if key in _connection_pool:
+        connection_stats['reused'] += 1
+        return _connection_pool[key]
+
+    start = time.perf_counter()
+    conn = open_db_connection(server, dbname, user, password, trusted_connection)
+    connection_stats['setup_seconds'] += time.perf_counter() - start
+    connection_stats['opened'] += 1
+    _connection_pool[key] = conn
+    return conn
+
+
+def close_db_connections():
+    """
+    Close all pooled connections, should be called once at the end of the run
+    :return:
+    """
+    connections = list(_connection_pool.values())
+    # pool is emptied first so broken connection is not left in it if closing fails
+    _connection_pool.clear()
+    for conn in connections:
+        with contextlib.suppress(pyodbc.Error, pymssql.Error):
+            conn.close()
+
+
+def print_connection_report(total_seconds):
+    """
+    Print how much time was spent on connecting to the database compared to the whole run
+    :param total_seconds: Duration of the whole run
+    :return:
+    """
+    print(
+        "Connections opened: {opened}, reused: {reused}, connection setup: {setup:.3f}s of {total:.3f}s total".format(
+            opened=connection_stats['opened'], reused=connection_stats['reused'],
+            setup=connection_stats['setup_seconds'], total=total_seconds,
+        ),
+    )
+
+
+# used by --profile, time and memory of every stage of a run and database queries by function that made them
+profile_state = {
+    'enabled': False, 'stack': [], 'stages': collections.OrderedDict(), 'queries': collections.OrderedDict(),
+}
+
+
+def start_profiling():
+    """
+    Start recording stages and queries, memory is traced from now on so everything runs slower
+    :return:
+    """
+    profile_state.update({
+        'enabled': True, 'stack': [], 'stages': collections.OrderedDict(), 'queries': collections.OrderedDict(),
+    })
+    tracemalloc.start()
+
+
+@contextlib.contextmanager
+def profile_stage(name):
+    """
+    Record time and peak memory of a stage, time of stages nested in it is not counted in its time.
+    Same stage can be entered many times (e.g. once for every table), its values are summed up.
+    :param name: Stage name
+    :return:
+    """
+    if not profile_state['enabled']:
+        yield
+        return
+
+    stack = profile_state['stack']
+    if stack:
+        # peak of the parent up to now, peak is measured from scratch for the nested stage
+        stack[-1]['peak'] = max(stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    frame = {'name': name, 'start': time.perf_counter(), 'nested_seconds': 0.0, 'peak': 0}
+    stack.append(frame)
+    try:
+        yield
+    finally:
+        stack.pop()
+        seconds = time.perf_counter() - frame['start']
+        peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1]['nested_seconds'] += seconds
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        stage = profile_state['stages'].setdefault(name, {'seconds': 0.0, 'calls': 0, 'peak_memory_mb': 0.0})
+        stage['seconds'] += seconds - frame['nested_seconds']
+        stage['calls'] += 1
+        stage['peak_memory_mb'] = max(stage['peak_memory_mb'], peak / 1024 ** 2)
+
+
+def profile_iter(iterable, name):
+    """
+    Record time of producing items of a generator as a stage, e.g. tables are constructed while file is written
+    :param iterable: Iterable to profile
+    :param name: Stage name
+    :return: Generator with the same items
+    """
+    iterator = iter(iterable)
+    while True:
+        with profile_stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class ProfiledCursor:
+    """
+    Database cursor that counts queries and fetched rows for the function that executed the query
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._function = None
+
+    def execute(self, *args, **kwargs):
+        self._function = sys._getframe(1).f_code.co_name
+        queries = profile_state['queries'].setdefault(self._function, {'queries': 0, 'rows': 0, 'seconds': 0.0})
+        start = time.perf_counter()
+        result = self._cursor.execute(*args, **kwargs)
+        queries['queries'] += 1
+        queries['seconds'] += time.perf_counter() - start
+        return result
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        queries = profile_state['queries'][self._function]
+        queries['rows'] += len(rows)
+        queries['seconds'] += time.perf_counter() - start
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def get_cursor(conn):
+    """
+    :param conn: Database connection
+    :return: Cursor, when profiling its queries are counted
+    """
+    if profile_state['enabled']:
+        return ProfiledCursor(conn.cursor())
+    return conn.cursor()
+
+
+def write_profile_report(report_path, total_seconds):
+    """
+    Stop profiling, print stages and queries and save them as json
+    :param report_path: Full path to json report
+    :param total_seconds: Duration of the whole run
+    :return:
+    """
+    report = {
+        'total_seconds': total_seconds,
+        'stages': profile_state['stages'],
+        'queries': profile_state['queries'],
+        'connections': dict(connection_stats),
+    }
+    tracemalloc.stop()
+    profile_state['enabled'] = False
+
+    print('{:<25} {:>10} {:>8} {:>14}'.format('Stage', 'Seconds', 'Calls', 'Peak memory'))
+    for name, stage in report['stages'].items():
+        print('{:<25} {:>10.3f} {:>8} {:>11.1f} MB'.format(
+            name, stage['seconds'], stage['calls'], stage['peak_memory_mb'],
+        ))
+    print('{:<25} {:>10} {:>8} {:>14}'.format('Queries by function', 'Seconds', 'Queries', 'Rows'))
+    for name, queries in report['queries'].items():
+        print('{:<25} {:>10.3f} {:>8} {:>14}'.format(name, queries['seconds'], queries['queries'], queries['rows']))
+    print('Total: {:.3f}s'.format(total_seconds))
 
-        full_fips_list.append(geo_level_info[i][0] + '_FIPS')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print("Profile report saved to: ", report_path)
 
-    full_fips_list = ','.join(list(reversed(full_fips_list)))
-    return full_fips_list
+
+# settings for GUID generation, they are set for every run by configure_guids
+guid_settings = {'namespace': None, 'existing': {}}
+
+# attribute that identifies element among its siblings, used to build GUID keys
+guid_key_attributes = {
+    'geoType': 'Name',
+    'GeoSurveyDataset': 'abbreviation',
+    'SurveyDataset': 'abbreviation',
+    'dataset': 'GeoTypeName',
+    'table': 'name',
+    'variable': 'name',
+}
+
+
+def get_guid_key(*path):
+    """
+    Create key that identifies element in metadata file e.g. SurveyDataset:ORG/table:PC2018_005
+    :param path: Pairs of (element tag, identifying attribute value) from outermost to the element
+    :return: String key
+    """
+    return '/'.join(tag + ':' + value for tag, value in path)
+
+
+def get_guids_from_xml(xml_file):
+    """
+    Read GUIDs of all elements from existing metadata file
+    :param xml_file: Full path to metadata file
+    :return: Dictionary with GUID key (see get_guid_key) as a key and GUID as a value
+    """
+    guids = {}
+    survey = et.parse(xml_file).getroot()
+    if 'GUID' in survey.attrib:
+        guids['survey'] = survey.attrib['GUID']
+
+    def collect(element, path):
+        for child in element:
+            if not isinstance(child.tag, str):
+                continue  # comments
+            child_path = path
+            if child.tag in guid_key_attributes:
+                # GeoSurveyDataset is identified the same way as other SurveyDatasets
+                tag = 'SurveyDataset' if child.tag == 'GeoSurveyDataset' else child.tag
+                child_path = path + [(tag, child.attrib.get(guid_key_attributes[child.tag], ''))]
+                if 'GUID' in child.attrib:
+                    guids[get_guid_key(*child_path)] = child.attrib['GUID']
+            collect(child, child_path)
+
+    collect(survey, [])
+    return guids
+
+
+def configure_guids(project_id, deterministic=False, existing_xml=None):
+    """
+    Set how GUIDs are created in this run. By default they are random, in deterministic mode they are derived from
+    project id and element path so regenerating a project gives the same GUIDs. GUIDs from existing metadata file are
+    used for elements that exist in it.
+    :param project_id: Project id
+    :param deterministic: Flag if GUIDs should be derived from project id and element path
+    :param existing_xml: Full path to metadata file with GUIDs that should be kept
+    :return:
+    """
+    guid_settings['namespace'] = uuid.uuid5(uuid.NAMESPACE_URL, 'CEDMetadata/' + project_id) if deterministic else None
+    guid_settings['existing'] = {}
+    if existing_xml:
+        if os.path.isfile(existing_xml):
+            guid_settings['existing'] = get_guids_from_xml(existing_xml)
+        else:
+            print("Warning: File for GUID reuse doesn't exist, new GUIDs will be created:", existing_xml)
+
+
+def new_guid(*path):
+    """
+    Get GUID for element, see configure_guids
+    :param path: Pairs of (element tag, identifying attribute value), empty for survey element
+    :return: GUID as string
+    """
+    key = get_guid_key(*path) if path else 'survey'
+    if key in guid_settings['existing']:
+        return guid_settings['existing'][key]
+    if guid_settings['namespace'] is not None:
+        return str(uuid.uuid5(guid_settings['namespace'], key))
+    return str(uuid.uuid4())
 
 
 def get_config(config_file):
@@ -82,42 +450,141 @@ def create_acronym(full_string):
     return acronym
 
 
-def get_table_metadata_from_db(server, dbname, user, password, project_year, trusted_connection, file_names_list_path):
+class DbName:
+    """
+    Parts of table or column name from database. Table names look like PC2018_SL050_005 (project, sumlev, table
+    sequence) and column names like PC2018_005_CED_V63 (project, table sequence, variable suffix), parts that don't
+    exist in a name are None.
+    """
+    __slots__ = ('name', 'project', 'sumlev', 'table_seq', 'var_suffix')
+
+    def __init__(self, name, project, sumlev=None, table_seq=None, var_suffix=None):
+        self.name = name
+        self.project = project
+        self.sumlev = sumlev
+        self.table_seq = table_seq
+        self.var_suffix = var_suffix
+
+    @property
+    def meta_table_name(self):
+        """
+        Table Id in metadata file e.g. PC2018_005, same table from all sumlevs has the same Id
+        """
+        return self.project + '_' + self.table_seq
+
+    def __repr__(self):
+        return 'DbName({!r}, project={!r}, sumlev={!r}, table_seq={!r}, var_suffix={!r})'.format(
+            self.name, self.project, self.sumlev, self.table_seq, self.var_suffix,
+        )
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_table_name(table_name):
+    """
+    Split table name from database, table sequence is always the part after the last '_' e.g. LEIP1912_SL040_PRES_001
+    :param table_name: Table name e.g. PC2018_SL050_005
+    :return: DbName
+    """
+    parts = table_name.split('_')
+    if len(parts) == 1:
+        return DbName(table_name, table_name, table_seq='')
+    return DbName(table_name, parts[0], parts[1] if len(parts) > 2 else None, parts[-1])
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_variable_name(variable_name):
     """
-    Get table descriptions from table_names table in database, make it prettier and return it as a dictionary
+    Split column name from database, variable suffix (everything after project and table sequence) is the key in
+    variable descriptions
+    :param variable_name: Column name e.g. PC2018_005_CED_V63
+    :return: DbName, var_suffix is None for system columns like SL010_FIPS
+    """
+    parts = variable_name.split('_', 2)
+    if len(parts) < 3:
+        return DbName(variable_name, parts[0], table_seq=parts[1] if len(parts) == 2 else None)
+    return DbName(variable_name, parts[0], table_seq=parts[1], var_suffix=parts[2])
+
+
+class TableRegistry:
+    """
+    Tables of the project in the order they are added. Same table exists on every sumlev (PC2018_SL040_005,
+    PC2018_SL050_005, ...) but it's only registered once, under its metadata name (PC2018_005).
+    """
+
+    def __init__(self, table_titles):
+        """
+        :param table_titles: Dictionary with table suffix as a key and table title as a value, see get_table_metadata
+        """
+        self.table_titles = table_titles
+        # metadata table name -> DbName of the first database table with that name
+        self.tables = collections.OrderedDict()
+
+    def add(self, db_table_name):
+        """
+        Register database table
+        :param db_table_name: Table name from database e.g. PC2018_SL050_005
+        :return: DbName of the table or None if table with the same metadata name is already registered
+        """
+        table_name = parse_table_name(db_table_name)
+        if table_name.meta_table_name in self.tables:
+            return None
+        self.tables[table_name.meta_table_name] = table_name
+        return table_name
+
+    def get_title(self, table_name):
+        """
+        :param table_name: DbName of the table
+        :return: Title from table_names or None if table suffix doesn't exist there
+        """
+        return self.table_titles.get(table_name.table_seq)
+
+    def __iter__(self):
+        return iter(self.tables.values())
+
+    def __len__(self):
+        return len(self.tables)
+
+
+def get_table_names_from_db(server, dbname, user, password, trusted_connection, conn=None):
+    """
+    Get content of table_names table in database
     :param server: Server address
     :param dbname: Database names
     :param user: username for sql server
     :param password: password for sql server
-    :param project_year: project year for which the data is relevant
     :param trusted_connection: flag if server credentials are needed
-    :return: Dictionary of metadata tables
+    :param conn: Connection to use, if not provided pooled connection is used
+    :return: List of table_names rows
     """
-    # extensions to remove from input file e.g. Sex_by_Age.csv > Sex_by_Age
-    extension = ['.txt', '.csv', '.tsv']
-    meta_table_dictionary = {}
-
-    if trusted_connection:
-        conn = pyodbc.connect(
-            "Driver={SQL Server};Server=localhost\SQLEXPRESS;Trusted_Connection=yes;database=" + dbname,
-        )
-    else:
-        conn = pymssql.connect(
-            host=r'DESKTOP-EI4DQJ3\SQLEXPRESS', database=dbname,
-            user=user, password=password,
-        )
+    if conn is None:
+        conn = get_db_connection(server, dbname, user, password, trusted_connection)
 
-    cursor = conn.cursor()
+    cursor = get_cursor(conn)
     cursor.execute(
         'SELECT * FROM table_names ',
     )
-    table_names = cursor.fetchall()
+    table_names = [list(row) for row in cursor.fetchall()]
 
     # exit if table_names table empty
     if len(table_names) == 0:
         print("Error: Table names does not exist in database!")
         sys.exit()
 
+    return table_names
+
+
+def get_table_metadata(table_names, file_names_list_path):
+    """
+    Get table descriptions from table_names rows, make it prettier and return it as a dictionary
+    :param table_names: Rows of table_names table in database
+    :param file_names_list_path: Full path to the files list with descriptive table names, if blank tables are
+    named after their files
+    :return: Dictionary of metadata tables
+    """
+    # extensions to remove from input file e.g. Sex_by_Age.csv > Sex_by_Age
+    extension = ['.txt', '.csv', '.tsv']
+    meta_table_dictionary = {}
+
     meta_data = []
     for ext in extension:
         for el in table_names:
@@ -127,6 +594,10 @@ def get_table_metadata_from_db(server, dbname, user, password, project_year, tru
                     [el[0], el[1]],
                 )
 
+    if not file_names_list_path:
+        # same as in get_csv_file_names, without files list every file is used and its name is the title
+        return {i[1]: os.path.splitext(i[0])[0] for i in meta_data}
+
     metadata_from_file = {}
     try:
         with open(file_names_list_path, 'r') as f:
@@ -174,7 +645,58 @@ def check_data_type(datum):
         )  # if nothing then string
 
 
-def get_tables_from_db(server, dbname, project_year, user, password, trustedConnection):
+def get_attrib_type(data_type):
+    """
+    Translate data type from information_schema to type code that pymssql reports in cursor.description
+    (1 - string, 2 - binary, 3 - number, 4 - datetime, 5 - decimal)
+    :param data_type: DATA_TYPE value from information_schema.columns
+    :return: Type code
+    """
+    if data_type is None:
+        return None
+    if 'char' in data_type or data_type in ['text', 'ntext', 'uniqueidentifier', 'xml']:
+        return 1
+    elif 'binary' in data_type or data_type in ['image', 'timestamp']:
+        return 2
+    elif data_type in ['int', 'bigint', 'smallint', 'tinyint', 'bit', 'float', 'real']:
+        return 3
+    elif 'date' in data_type or data_type == 'time':
+        return 4
+    elif data_type in ['decimal', 'numeric', 'money', 'smallmoney']:
+        return 5
+    return None
+
+
+def get_columns_from_catalog(cursor, table_list, project_year):
+    """
+    Get columns of all project tables with a single information_schema query instead of reading every table.
+    Row count of the tables doesn't affect this query.
+    :param cursor: Database cursor
+    :param table_list: List of tables for which columns are needed
+    :param project_year: project year for which the data is relevant
+    :return: Dictionary with table name as a key and list of (name, var_type, attrib_type) tuples as a value
+    """
+    cursor.execute(
+        "SELECT TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, DATA_TYPE FROM information_schema.columns WHERE "
+        "TABLE_NAME like '%" + str(project_year) + "%'",
+    )
+    columns_by_table = {i: [] for i in table_list}
+    for table_name, column_name, ordinal_position, data_type in cursor.fetchall():
+        # catalog can contain tables that are filtered out from table list e.g. table_names
+        if table_name in columns_by_table:
+            columns_by_table[table_name].append((ordinal_position, column_name, data_type))
+
+    dict_tables_and_vars = {}
+    for table_name, columns in columns_by_table.items():
+        dict_tables_and_vars[table_name] = [
+            (column_name, check_data_type(data_type), get_attrib_type(data_type))
+            for ordinal_position, column_name, data_type in sorted(columns)
+        ]
+    return dict_tables_and_vars
+
+
+def get_tables_from_db(server, dbname, project_year, user, password, trustedConnection, conn=None,
+                       column_discovery='catalog'):
     """
     Get list of tables from db, make it unique on metadata level and return it as a dictionary
     :param server: server name
@@ -183,62 +705,161 @@ def get_tables_from_db(server, dbname, project_year, user, password, trustedConn
     :param user: username for sql server
     :param password: username for sql server
     :param trustedConnection: flag if server credentials are needed
-    :return: list of tables in database
+    :param conn: Connection to use, if not provided pooled connection is used
+    :param column_discovery: 'catalog' to read all columns in one information_schema query, 'query' to read them
+    from each table separately (old behaviour)
+    :return: Dictionary with columns of every table and dictionary with modify date of every table
     """
 
-    if trustedConnection:
-        # for trusted connection
-        conn = pyodbc.connect(
-            "Driver={SQL Server};Server=localhost\SQLEXPRESS;Trusted_Connection=yes;database=" + dbname,
-        )
-    else:
-        conn = pymssql.connect(
-            host=r'DESKTOP-EI4DQJ3\SQLEXPRESS', database=dbname,
-            user=user, password=password,
-        )
+    if conn is None:
+        conn = get_db_connection(server, dbname, user, password, trustedConnection)
 
-    cursor = conn.cursor()
+    cursor = get_cursor(conn)
 
     cursor.execute(
-        "SELECT name FROM sys.objects WHERE type_desc = 'USER_TABLE' AND name <> 'table_names' and left("
+        "SELECT name, modify_date FROM sys.objects WHERE type_desc = 'USER_TABLE' AND name <> 'table_names' and left("
         "name,1) <> '_' and name like '%" +
         str(project_year) + "%' AND name <> 'sysdiagrams' ORDER BY "
                             "modify_date",
     )
 
-    table_list = [str(*i) for i in cursor.fetchall() if i != 'table_names']
+    tables_rows = cursor.fetchall()
+    table_list = [str(i[0]) for i in tables_rows]
+    # used by incremental mode to find tables that were loaded again
+    modify_dates = {str(i[0]): str(i[1]) for i in tables_rows}
     dict_tables_and_vars = {}
-    cursor = conn.cursor()
-    for i in table_list:
-        sqlTab = 'SELECT * FROM ' + i
-
-        sql = "select DATA_TYPE from information_schema.columns where TABLE_NAME = '" + i + "'"
-        cursor.execute(sql)
-        list_of_types = cursor.fetchall()
-        var_types = [check_data_type(datum[0]) for datum in list_of_types]
-        cursor.execute(sqlTab)
-        dict_tables_and_vars[i] = [j[0] for j in cursor.description]
-        attrib_type = [j[1] for j in cursor.description]
-        dict_tables_and_vars[i] = list(
-            zip(dict_tables_and_vars[i], var_types, attrib_type),
-        )
-    conn.close()
-
-    dict_tables_and_vars_unique = {}
-    for key, value in dict_tables_and_vars.items():
-        values = []
-        pos_t = [i for i, k in enumerate(key) if k == '_'][1] + 1
-        for v in value:
-            # skip system required names
-            if len([j for j, l in enumerate(v[0]) if l == '_']) < 3:
+    cursor = get_cursor(conn)
+    if column_discovery == 'catalog':
+        dict_tables_and_vars = get_columns_from_catalog(cursor, table_list, project_year)
+    else:
+        for i in table_list:
+            sqlTab = 'SELECT * FROM ' + i
+
+            sql = "select DATA_TYPE from information_schema.columns where TABLE_NAME = '" + i + "'"
+            cursor.execute(sql)
+            list_of_types = cursor.fetchall()
+            var_types = [check_data_type(datum[0]) for datum in list_of_types]
+            cursor.execute(sqlTab)
+            dict_tables_and_vars[i] = [j[0] for j in cursor.description]
+            # pyodbc reports python types in cursor.description, type codes are taken from DATA_TYPE for both drivers
+            attrib_type = [get_attrib_type(datum[0]) for datum in list_of_types]
+            dict_tables_and_vars[i] = list(
+                zip(dict_tables_and_vars[i], var_types, attrib_type),
+            )
+
+    return dict_tables_and_vars, modify_dates
+
+
+def is_data_column(column_name):
+    """
+    Check if column is a variable and not one of the geography columns R adds to every table
+    :param column_name: Column name e.g. PC2018_005_CED_V63 or SL010_FIPS
+    :return: True for variables
+    """
+    removal_vars = [
+        'NAME', 'SUMLEV', 'v1', 'Geo_level',
+        'QName', 'TYPE', 'Geo', 'FIPS', 'Geo_orig',
+    ]
+    return (
+        column_name not in removal_vars and '_NAME' not in column_name and 'FIPS' not in column_name and
+        column_name != 'V1'
+    )
+
+
+def new_column_profile(kind):
+    """
+    Empty profile of column values
+    :param kind: 'int', 'float' or 'text'
+    :return: Dictionary with number of rows and non null values, min and max value, number of decimal places (0, 1 or
+    2 for 2 and more), max string length and ratio of null values
+    """
+    return {
+        'kind': kind, 'rows': 0, 'count': 0, 'min': None, 'max': None, 'decimals': 0, 'max_length': 0,
+        'null_ratio': 1.0,
+    }
+
+
+def merge_column_profile(profiles, column_name, profile):
+    """
+    Add profile of one part of column (one table or one chunk of file) to profile of the whole column. Same column
+    exists in the table of every sumlev.
+    :param profiles: Dictionary with column name as a key and profile as a value, it's updated
+    :param column_name: Column name
+    :param profile: Profile of the part, see new_column_profile
+    :return:
+    """
+    if column_name not in profiles:
+        profiles[column_name] = dict(profile)
+        return
+    merged = profiles[column_name]
+    kinds = ['int', 'float', 'text']
+    merged['kind'] = kinds[max(kinds.index(merged['kind']), kinds.index(profile['kind']))]
+    merged['rows'] += profile['rows']
+    merged['count'] += profile['count']
+    for key, function in [('min', min), ('max', max)]:
+        values = [i for i in (merged[key], profile[key]) if i is not None]
+        merged[key] = function(values) if values else None
+    merged['decimals'] = max(merged['decimals'], profile['decimals'])
+    merged['max_length'] = max(merged['max_length'], profile['max_length'])
+    merged['null_ratio'] = 1 - merged['count'] / merged['rows'] if merged['rows'] else 1.0
+
+
+def get_column_profiles_from_db(columns, server, dbname, user, password, trusted_connection, conn=None):
+    """
+    Profile values of all variables with aggregates computed by database, one query for each table
+    :param columns: Dictionary with table name as a key and list of (name, var_type, attrib_type) as a value
+    :param server: Server name
+    :param dbname: Database name
+    :param user: Username for server
+    :param password: Password for server
+    :param trusted_connection: flag if server credentials are needed
+    :param conn: Connection to use, if not provided pooled connection is used
+    :return: Dictionary with column name as a key and profile as a value, see new_column_profile
+    """
+    if conn is None:
+        conn = get_db_connection(server, dbname, user, password, trusted_connection)
+
+    profiles = {}
+    cursor = get_cursor(conn)
+    for table_name, table_columns in columns.items():
+        aggregates = ['COUNT(*)']
+        profiled_columns = []
+        for column_name, var_type, attrib_type in table_columns:
+            if not is_data_column(column_name):
                 continue
-            pos_v = [j for j, l in enumerate(v[0]) if l == '_'][2] + 1
-            # print(key[pos_t:])
-            # print(v[0][pos_v:])
-            values.append([v[0][pos_v:], v[1]])
-        dict_tables_and_vars_unique[key[pos_t:]] = values
+            column = '[' + column_name + ']'
+            if var_type in (2, 3) or attrib_type in (3, 5):
+                profiled_columns.append((column_name, 'int' if var_type == 3 else 'float'))
+                aggregates += [
+                    'COUNT(' + column + ')', 'MIN(' + column + ')', 'MAX(' + column + ')',
+                    'MAX(CASE WHEN ' + column + ' <> ROUND(' + column + ', 1) THEN 2 WHEN ' + column + ' <> ROUND(' +
+                    column + ', 0) THEN 1 ELSE 0 END)',
+                ]
+            elif var_type == 1:
+                profiled_columns.append((column_name, 'text'))
+                aggregates += ['COUNT(' + column + ')', 'MAX(LEN(' + column + '))']
+        if not profiled_columns:
+            continue
 
-    return dict_tables_and_vars
+        cursor.execute('SELECT ' + ', '.join(aggregates) + ' FROM [' + table_name + ']')
+        row = list(cursor.fetchall()[0])
+        rows = row.pop(0)
+        for column_name, kind in profiled_columns:
+            profile = new_column_profile(kind)
+            profile['rows'] = rows
+            if kind == 'text':
+                profile['count'], max_length = row.pop(0), row.pop(0)
+                profile['max_length'] = max_length or 0
+            else:
+                profile['count'], min_value, max_value, decimals = row[:4]
+                del row[:4]
+                # decimal and money columns come as Decimal which can't be saved to snapshot
+                profile['min'] = None if min_value is None else float(min_value)
+                profile['max'] = None if max_value is None else float(max_value)
+                profile['decimals'] = decimals or 0
+            profile['null_ratio'] = 1 - profile['count'] / rows if rows else 1.0
+            merge_column_profile(profiles, column_name, profile)
+    return profiles
 
 
 def get_variable_descriptions_from_file(variable_description_location):
@@ -265,175 +886,650 @@ def get_variable_descriptions_from_file(variable_description_location):
     return file_content_dict
 
 
+def get_variable_description_files(variable_description_location):
+    """
+    :param variable_description_location: Full path to the file or folder with files
+    :return: Sorted list of full paths to variable description files
+    """
+    if os.path.isfile(variable_description_location):
+        return [variable_description_location]
+    return sorted(
+        os.path.join(variable_description_location, i) for i in os.listdir(variable_description_location)
+        if os.path.isfile(os.path.join(variable_description_location, i))
+    )
+
+
 def get_variable_descriptions_from_directory(variable_description_location):
     """
-    In case folder is provided, take a list of its files and read it vor variable description
+    In case folder is provided, take a list of its files and read it vor variable description, files are read
+    concurrently and merged in order of their names
     :param variable_description_location: Full path to the folder with files
     :return: Dictionary with variable id as key and its description as a value
     """
-    os.chdir(variable_description_location)
-    file_list = os.listdir()
     file_content_dict = {}
-    for fileName in file_list:
-        file_content_dict.update(get_variable_descriptions_from_file(fileName))
+    with ThreadPoolExecutor() as executor:
+        for file_content in executor.map(
+                get_variable_descriptions_from_file, get_variable_description_files(variable_description_location),
+        ):
+            file_content_dict.update(file_content)
     return file_content_dict
 
 
-def get_geotype(geo_level_info):  # number of geo types
+def validate_variable_descriptions(variable_description):
+    """
+    Check if there is proper number of columns in variable descriptions and that it is the same in all of them,
+    exit if it's not
+    :param variable_description: Dictionary with variable id as key and its description as a value
+    :return:
+    """
+    col_nrs = set(len(v) for v in variable_description.values())
+    if not col_nrs.issubset({1, 2}):
+        print('Number of columns in variable description file/s is not ok!')
+        sys.exit()
+    if len(col_nrs) > 1:
+        print('Number of columns changes in the file!?')
+        sys.exit()
+
+
+def get_file_hash(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_variable_description_cache_path(variable_description_location):
+    """
+    Default cache location is next to variable descriptions e.g. configs/variable_descriptions.txt.cache.pickle
+    :param variable_description_location: Full path to the file or folder with files
+    :return: Full path to cache file
+    """
+    return variable_description_location.rstrip('\\/') + '.cache.pickle'
+
+
+def is_variable_description_cache_valid(cached_files, description_files):
+    """
+    Cache is valid if the same files are used and none of them has changed. Content is compared only for files
+    with changed modification time (e.g. after checkout), files with different size are changed for sure. If content
+    is the same new modification time is set in cached_files, cache should be saved again so the file isn't hashed
+    on every run.
+    :param cached_files: List of files from cache with path, size, mtime and hash
+    :param description_files: List of full paths to current variable description files
+    :return: True if cache can be used
+    """
+    if [i['path'] for i in cached_files] != description_files:
+        return False
+    for cached_file in cached_files:
+        stat = os.stat(cached_file['path'])
+        if stat.st_size != cached_file['size']:
+            return False
+        if stat.st_mtime_ns != cached_file['mtime']:
+            if get_file_hash(cached_file['path']) != cached_file['hash']:
+                return False
+            cached_file['mtime'] = stat.st_mtime_ns
+    return True
+
+
+def save_cache(cache_path, cache, cache_name):
+    """
+    Save cache with pickle, run continues if it can't be saved
+    :param cache_path: Full path to cache file
+    :param cache: Cache dictionary
+    :param cache_name: Name of the cache for warning e.g. Variable description
+    :return:
+    """
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as ex:
+        print('Warning: {} cache can not be saved:'.format(cache_name), ex)
+
+
+def load_variable_descriptions(variable_description_location, cache_path=None):
+    """
+    Read and validate variable descriptions, parsed descriptions are cached so next runs with the same files don't
+    have to read them again
+    :param variable_description_location: Full path to the file or folder with files
+    :param cache_path: Full path to cache file, if not set cache is not used
+    :return: Dictionary with variable id as key and its description as a value
+    """
+    description_files = get_variable_description_files(variable_description_location)
+
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            # cache holds one small list per variable, garbage collector would only slow down loading them
+            gc.disable()
+            try:
+                with open(cache_path, 'rb') as f:
+                    cache = pickle.load(f)
+            finally:
+                gc.enable()
+            mtimes = [i.get('mtime') for i in cache.get('files', [])]
+            if cache.get('version') == 1 and is_variable_description_cache_valid(cache['files'], description_files):
+                print('Info: Variable descriptions loaded from cache', cache_path)
+                if mtimes != [i['mtime'] for i in cache['files']]:
+                    # files were only touched, new modification times are saved so they are not hashed again
+                    save_cache(cache_path, cache, 'Variable description')
+                return cache['variable_description']
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, KeyError):
+            print('Info: Variable description cache can not be read, descriptions will be read from files.')
+
+    if os.path.isfile(variable_description_location):
+        variable_description = get_variable_descriptions_from_file(variable_description_location)
+    else:
+        variable_description = get_variable_descriptions_from_directory(variable_description_location)
+    validate_variable_descriptions(variable_description)
+
+    if cache_path:
+        cache = {
+            'version': 1,
+            'files': [
+                {
+                    'path': i,
+                    'size': os.stat(i).st_size,
+                    'mtime': os.stat(i).st_mtime_ns,
+                    'hash': get_file_hash(i),
+                } for i in description_files
+            ],
+            'variable_description': variable_description,
+        }
+        save_cache(cache_path, cache, 'Variable description')
+    return variable_description
+
+
+def get_geotype(geo_hierarchy):  # number of geo types
     """
     Get list of geotypes in project
-    :param geo_level_info: List from config file
+    :param geo_hierarchy: GeoHierarchy of the project
     :return:
     """
     e = ElementMaker()
-    sum_levs = geo_level_info  # getGeoNesting(geoLevelInfoFilePath)
     plural_forms = {'County': 'Counties', 'State': 'States'}
-    for i in sum_levs:
-        if i[1] not in sum_levs:
-            plural_forms[i[1]] = i[1]
+    for level in geo_hierarchy:
+        if level.name not in geo_hierarchy:
+            plural_forms[level.name] = level.name
 
     # create names of relevant geos
-    relevant_geos = ','.join([create_acronym(i[1]) for i in sum_levs])
+    relevant_geos = ','.join([level.acronym for level in geo_hierarchy])
 
     result = []
 
-    for sumlev in sum_levs:
-        partial_fips_field = create_acronym(sumlev[1])
+    for level in geo_hierarchy:
         result.append(
             e.geoType(
                 e.Visible('true'),
-                GUID=str(uuid.uuid4()),
-                Name=sumlev[0],
-                Label=sumlev[1],
-                QLabel=sumlev[1],
+                GUID=new_guid(('geoType', level.sumlev)),
+                Name=level.sumlev,
+                Label=level.name,
+                QLabel=level.name,
                 RelevantGeoIDs='FIPS,NAME,QName,' + relevant_geos,
-                PluralName=plural_forms[sumlev[1]],
+                PluralName=plural_forms[level.name],
                 fullCoverage='true',
                 majorGeo='true',
                 # GeoAbrev = sumlev[0],#'us, nation', COMMENTED BECAUSE IN ACS 2011 EXAMPLE IT WAS
                 # MISSING!?
-                Indent=str(int(sumlev[4])),
-                Sumlev=sumlev[0].replace('SL', ''),
-                FipsCodeLength=sumlev[2],
+                Indent=str(level.indent),
+                Sumlev=level.sumlev.replace('SL', ''),
+                FipsCodeLength=str(level.fips_length),
                 FipsCodeFieldName='FIPS',
-                FipsCodePartialFieldName=partial_fips_field,
-                FipsCodePartialLength=str(sumlev[3]),
+                FipsCodePartialFieldName=level.acronym,
+                FipsCodePartialLength=str(level.partial_fips_length),
             ),
         )
     return result
 
 
-def get_datasets(connection_string, dbname, geo_level_info, project_id, user, password, server, trusted_connection):
+def get_dataset_descriptors(connection_string, dbname, geo_hierarchy, project_id, geo_id_suffixes):
     """
-    Get data sets for the project.
-    :param trusted_connection:
+    Get attributes of data sets for the project. This is plain data without GUIDs so it can be computed once per run
+    and used for every SurveyDataset.
     :param connection_string: Info from config file
     :param dbname: Info from config file
-    :param geo_level_info: Info from config file
+    :param geo_hierarchy: GeoHierarchy of the project
     :param project_id: Info from config file
-    :param user: Info from config file
-    :param password: Info from config file
-    :param server: Info from config file
+    :param geo_id_suffixes: Dictionary with suffix of the first table for every sumlev, from catalog
+    :return: List of dictionaries with data set attributes
+    """
+    result = []
+
+    for level in geo_hierarchy:
+        geo_id_suffix = geo_id_suffixes[level.sumlev]
+
+        # order of keys is order of attributes in metadata file
+        result.append(collections.OrderedDict([
+            ('GeoTypeName', level.sumlev),  # SL040
+            ('DbConnString', connection_string),
+            ('DbName', dbname),
+            # tablename e.g. 'LEIP1912_SL040_PRES_001'
+            ('GeoIdDbTableName', project_id + '_' + level.sumlev + geo_id_suffix),
+            ('IsCached', 'false'),
+            # tablename prefix e.g. 'LEIP1912_SL040_PRES_'
+            ('DbTableNamePrefix', project_id + '_' + level.sumlev + '_'),
+            ('DbPrimaryKey', geo_hierarchy.get_primary_key(level.sumlev)),  # this is fixed
+            ('DbCopyCount', '1'),
+        ]))
+    return result
+
+
+def get_datasets(dataset_descriptors, abbreviation):
+    """
+    Get data sets for the project, every call creates new elements with new GUIDs.
+    :param dataset_descriptors: List from get_dataset_descriptors
+    :param abbreviation: Abbreviation of SurveyDataset that data sets belong to
     :return: List of data sets
     """
     E = ElementMaker()
     result = []
+    for descriptor in dataset_descriptors:
+        result.append(E.dataset(
+            GUID=new_guid(('SurveyDataset', abbreviation), ('dataset', descriptor['GeoTypeName'])),
+            **descriptor
+        ))
+    return result
+
+
+def get_geo_id_suffixes(geo_level_info, dbname, user, password, server, project_id, trusted_connection, conn=None):
+    """
+    Find suffix of first table for every geography and return it together with preceding '_'. Tables are named
+    project_id + '_' + sumlev + ... so all sumlevs are read with one query grouped by the part after project id.
+
+    :param geo_level_info: GeoInfo from config file
+    :param dbname: Database name
+    :param user: Username
+    :param password: Password
+    :param server: Server name
+    :param project_id: Project id
+    :param conn: Connection to use, if not provided pooled connection is used
+    :return: Dictionary with sumlev as a key and suffix of the first table for that sumlev as a value
+    """
+    if conn is None:
+        conn = get_db_connection(server, dbname, user, password, trusted_connection)
+
+    # position of sumlev in table name, SUBSTRING and CHARINDEX are 1-based
+    sumlev_expression = "SUBSTRING(name, {0}, CHARINDEX('_', name + '_', {0}) - {0})".format(len(project_id) + 2)
+    cursor = get_cursor(conn)
+    cursor.execute(
+        "SELECT " + sumlev_expression + " AS sumlev, MIN(name) FROM sys.objects WHERE type_desc = 'USER_TABLE' and "
+        "name like '" + project_id + "[_]%' GROUP BY " + sumlev_expression,
+    )
+    first_tables = {row[0]: row[1] for row in cursor.fetchall()}
+
+    geo_id_suffixes = {}
+    for i in geo_level_info:
+        if i[0] not in first_tables:
+            # this is fix for sumlevels that doesn't exist in database, remove this after cancen is done
+            geo_id_suffixes[i[0]] = '_001'
+            continue
+        table_name = first_tables[i[0]]
+        geo_id_suffixes[i[0]] = table_name[table_name.rindex('_'):]
+    return geo_id_suffixes
+
+
+def get_catalog_from_db(server, dbname, user, password, project_year, project_id, geo_level_info, trusted_connection,
+                        column_discovery='catalog', conn=None, profile_columns=False):
+    """
+    Read everything that metadata generation needs from the database. Result is plain data so it can be saved as
+    a snapshot and metadata can be generated later without database.
+    :param server: Server name
+    :param dbname: Database name
+    :param user: Username for server
+    :param password: Password for server
+    :param project_year: Project year
+    :param project_id: Project id
+    :param geo_level_info: GeoInfo from config file
+    :param trusted_connection: flag if server credentials are needed
+    :param column_discovery: How columns are read from database, see get_tables_from_db
+    :param conn: Connection to use, if not provided pooled connection is used
+    :param profile_columns: Profile values of every variable, see get_column_profiles_from_db
+    :return: Dictionary with table_names rows, columns and modify date of every table, suffix of the first table for
+    every sumlev and profiles of variables if they are profiled
+    """
+    columns, modify_dates = get_tables_from_db(
+        server, dbname, project_year, user, password, trusted_connection, conn=conn,
+        column_discovery=column_discovery,
+    )
+    geo_id_suffixes = get_geo_id_suffixes(
+        geo_level_info, dbname, user, password, server, project_id, trusted_connection, conn=conn,
+    )
+
+    catalog = {
+        'version': 1,
+        'projectId': project_id,
+        'projectYear': project_year,
+        'dbName': dbname,
+        'table_names': get_table_names_from_db(server, dbname, user, password, trusted_connection, conn=conn),
+        # tables in the order they are listed in sys.objects
+        'columns': collections.OrderedDict(
+            (table, [list(column) for column in table_columns]) for table, table_columns in columns.items()
+        ),
+        'geo_id_suffixes': geo_id_suffixes,
+        # optional, snapshots created before it was added don't have it
+        'modify_dates': modify_dates,
+    }
+    if profile_columns:
+        # optional, only if run with profiling of columns
+        catalog['profiles'] = get_column_profiles_from_db(
+            columns, server, dbname, user, password, trusted_connection, conn=conn,
+        )
+    return catalog
+
+
+def save_catalog_snapshot(catalog, snapshot_path):
+    """
+    Save catalog to a compact json file, it will be gzipped if file name ends with .gz
+    :param catalog: Catalog from get_catalog_from_db
+    :param snapshot_path: Full path to the snapshot file
+    :return:
+    """
+    opener = gzip.open if snapshot_path.endswith('.gz') else open
+    with opener(snapshot_path, 'wt', encoding='utf-8') as f:
+        json.dump(catalog, f, ensure_ascii=False, separators=(',', ':'))
+    print("Catalog snapshot saved to: ", snapshot_path)
+
+
+def load_catalog_snapshot(snapshot_path):
+    """
+    Load catalog saved with save_catalog_snapshot
+    :param snapshot_path: Full path to the snapshot file
+    :return: Catalog dictionary
+    """
+    opener = gzip.open if snapshot_path.endswith('.gz') else open
+    with opener(snapshot_path, 'rt', encoding='utf-8') as f:
+        catalog = json.load(f, object_pairs_hook=collections.OrderedDict)
+    return catalog
+
+
+def open_csv_file(file_path):
+    """
+    Open csv file for reading, source data and config files are not always saved as utf-8
+    :param file_path: Full path to the file
+    :return: File object
+    """
+    return open(file_path, 'r', encoding='utf-8-sig', errors='replace', newline='')
+
+
+def get_csv_file_names(source_directory, file_names_list_path):
+    """
+    Get data files in the order they are numbered by process_to_db_new.r. As in R, every line of files list takes a
+    table number even if file doesn't exist in source directory.
+    :param source_directory: Directory with data files
+    :param file_names_list_path: Full path to the files list, if blank all files in source directory are used
+    :return: List of file names
+    """
+    if not file_names_list_path:
+        print("No fileNamesList file defined, looking for files in sourceDirectory!")
+        return sorted(os.listdir(source_directory))
+
+    with open_csv_file(file_names_list_path) as f:
+        return [line[0] for line in csv.reader(f, delimiter=',', quotechar='"') if line]
+
+
+def get_sumlevs_by_dataset(config_directory, geo_hierarchy):
+    """
+    Get sumlevs of every dataset id from geo_divisions_by_dataset_ID.txt
+    :param config_directory: Directory with geo_divisions_by_dataset_ID.txt
+    :param geo_hierarchy: GeoHierarchy with geo types from all_geotypes_and_sumlev.csv, sumlevs are ordered as in it
+    :return: Dictionary with dataset id as a key and list of sumlevs as a value
+    """
+    dataset_types = collections.defaultdict(set)
+    with open_csv_file(config_directory + 'geo_divisions_by_dataset_ID.txt') as f:
+        for line in csv.reader(f):
+            if len(line) < 2:
+                continue
+            dataset_types[line[0].strip()].add(line[1].strip())
+
+    return {
+        dataset_id: geo_hierarchy.get_sumlevs_of_types(geo_types) for dataset_id, geo_types in dataset_types.items()
+    }
+
+
+def get_csv_data_type(values):
+    """
+    Guess SQL Server data type of a column the way R read.csv and sqlSave do it
+    :param values: Sample of column values
+    :return: 'int', 'float' or 'varchar'
+    """
+    values = [i.strip() for i in values if i.strip() not in ('', 'NA')]
+    # R reads empty column as logical and writes it as text
+    if not values:
+        return 'varchar'
+    try:
+        # R reads numbers bigger than 32-bit integer as numeric
+        if all(abs(int(i)) <= 2147483647 for i in values):
+            return 'int'
+        return 'float'
+    except ValueError:
+        pass
+    try:
+        for i in values:
+            float(i)
+    except ValueError:
+        return 'varchar'
+    return 'float'
+
+
+def get_csv_columns(csv_path, sample_rows):
+    """
+    Read header and first rows of data file and get its data columns. Geography columns (SUMLEV, Geo and FIPS
+    columns) are removed as in process_to_db_new.r.
+    :param csv_path: Full path to data file
+    :param sample_rows: Number of rows used to guess data types
+    :return: List of (column name, data type) tuples
+    """
+    with open_csv_file(csv_path) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        sample = [row for _, row in zip(range(sample_rows), reader)]
+
+    columns = []
+    for position, column_name in enumerate(header):
+        if column_name in ('SUMLEV', 'Geo') or 'FIPS' in column_name:
+            continue
+        columns.append((column_name, get_csv_data_type([row[position] for row in sample if position < len(row)])))
+    return columns
 
-    sum_levs = geo_level_info
-    for i in sum_levs:
-        geo_id_suffix = get_geo_id_db_table_name(
-            i[0], dbname, user, password, server, project_id, trusted_connection,
-        )
 
-        result.append(E.dataset(
-            GUID=str(uuid.uuid4()),
-            GeoTypeName=i[0],  # SL040
-            DbConnString=connection_string,
-            DbName=dbname,
-            GeoIdDbTableName=project_id + \
-                             '_' + i[0] + geo_id_suffix,
-            # tablename e.g. 'LEIP1912_SL040_PRES_001'
-            IsCached='false',
-            DbTableNamePrefix=project_id + \
-                              '_' + i[0] + '_',
-            # tablename prefix e.g. 'LEIP1912_SL040_PRES_'
-            DbPrimaryKey=get_table_fipses(
-                i[0] + '_FIPS', geo_level_info,
-            ),  # this is fixed
-            DbCopyCount='1',
-        ))
-    return result
+def get_column_profiles_from_csv(csv_path, column_names, chunk_size=100000):
+    """
+    Profile values of data file columns, file is read in chunks and every column of a chunk is profiled with array
+    operations
+    :param csv_path: Full path to data file
+    :param column_names: Columns to profile
+    :param chunk_size: Number of rows in a chunk
+    :return: Dictionary with column name as a key and profile as a value, see new_column_profile
+    """
+    # pandas is needed only for profiling, so metadata can be created without it
+    import numpy as np
+    import pandas as pd
+
+    profiles = {}
+    chunks = pd.read_csv(
+        csv_path, usecols=column_names, dtype=str, keep_default_na=False, chunksize=chunk_size,
+        encoding='utf-8', encoding_errors='replace',
+    )
+    for chunk in chunks:
+        for column_name in column_names:
+            text = chunk[column_name].str.strip()
+            values = text[~text.isin(['', 'NA'])]
+            numbers = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+
+            if np.isnan(numbers).any():
+                profile = new_column_profile('text')
+            else:
+                profile = new_column_profile('float')
+                if len(numbers):
+                    profile['min'], profile['max'] = float(numbers.min()), float(numbers.max())
+                    if (numbers != np.round(numbers, 1)).any():
+                        profile['decimals'] = 2
+                    elif (numbers != np.round(numbers)).any():
+                        profile['decimals'] = 1
+                    elif profile['min'] >= -2147483648 and profile['max'] <= 2147483647:
+                        profile['kind'] = 'int'
+            if len(values):
+                profile['max_length'] = int(values.str.len().max())
+            profile['rows'] = len(text)
+            profile['count'] = len(numbers)
+            profile['null_ratio'] = 1 - profile['count'] / profile['rows'] if profile['rows'] else 1.0
+            merge_column_profile(profiles, column_name, profile)
+    return profiles
+
+
+def get_table_suffix(counter):
+    """
+    Table number as it is formatted by process_to_db_new.r e.g. 5 > 005
+    :param counter: Table number
+    :return: Table suffix
+    """
+    return str(counter).zfill(4 if len(str(counter)) > 3 else 3)
 
 
-def get_geo_id_db_table_name(sumlev, dbname, user, password, server, project_id, trusted_connection):
+def get_catalog_from_csv(source_directory, config_directory, file_names_list_path, project_id, project_year, dbname,
+                         geo_level_info, table_numbering_starts_from=1, max_table_width=200, sample_rows=1000,
+                         profile_columns=False):
     """
-    Find suffix of first table for specific geography and return it together with preceding '_'.
-
-    :param sumlev: Summary level for which it is necessary to find suffix
+    Create catalog from data files instead of database, tables and columns are named as process_to_db_new.r names
+    them when it loads the files. Only header and first sample_rows rows of every file are read.
+    :param source_directory: Directory with data files (sourceDirectory from config file)
+    :param config_directory: Directory with geo_divisions_by_dataset_ID.txt and all_geotypes_and_sumlev.csv
+    :param file_names_list_path: Full path to the files list, if blank all files in source directory are used
+    :param project_id: Project id
+    :param project_year: Project year
     :param dbname: Database name
-    :param user: Username
-    :param password: Password
-    :param server: Server name
-    :return: Suffix off the first geography for that table
+    :param geo_level_info: GeoInfo from config file
+    :param table_numbering_starts_from: Number of the first table (tableNumberingStartsFrom from config file)
+    :param max_table_width: Maximum number of data columns in a table (maxTableWidth from config file)
+    :param sample_rows: Number of rows used to guess data types
+    :param profile_columns: Read whole files and profile values of every variable, see get_column_profiles_from_csv
+    :return: Catalog dictionary, same as from get_catalog_from_db
     """
-    if trusted_connection:
-        conn = pyodbc.connect(
-            "Driver={SQL Server};Server=localhost\SQLEXPRESS;Trusted_Connection=yes;database=" + dbname,
-        )
-    else:
-        conn = pymssql.connect(
-            host=r'DESKTOP-EI4DQJ3\SQLEXPRESS', database=dbname,
-            user=user, password=password,
-        )
+    geo_hierarchy = GeoHierarchy(geo_level_info, config_directory + 'all_geotypes_and_sumlev.csv')
+    sumlevs_by_dataset = get_sumlevs_by_dataset(config_directory, geo_hierarchy)
+
+    # system columns that R adds to every table, they are not variables in metadata file
+    system_columns = []
+    for level in geo_hierarchy:
+        system_columns += [[level.sumlev + '_FIPS', 1, 1], [level.sumlev + '_NAME', 1, 1], [level.acronym, 1, 1]]
+    system_columns += [['FIPS', 1, 1], ['QName', 1, 1], ['Name', 1, 1]]
+
+    table_names = []
+    columns = {}
+    modify_dates = {}
+    profiles = {}
+    for counter, file_name in enumerate(
+            get_csv_file_names(source_directory, file_names_list_path), table_numbering_starts_from,
+    ):
+        csv_path = source_directory + file_name
+        if not os.path.isfile(csv_path):
+            print('File', file_name, 'does not exist, table number will be increased by one anyway!')
+            continue
 
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT TOP 1 name FROM sys.objects WHERE type_desc = 'USER_TABLE' AND name <> 'table_names' and left(name,"
-        "1) <> '_' and name like '%" + sumlev +
-        "%' and name like '" + project_id + "%' ORDER BY name",
-    )
-    table_name = cursor.fetchall()
-    if not table_name:  # this is fix for sumlevels that doesn't exist in database, remove this after cancen is done
-        return '_001'
-    table_name = table_name[0][0]
-    suffix_ind = [
-        index for index, element in enumerate(
-            table_name,
-        ) if element == '_'
-    ][-1]
-    suffix = table_name[suffix_ind:]
-    return suffix
+        dataset_id = file_name.split('_')[0]
+        if dataset_id not in sumlevs_by_dataset:
+            print("Error: No summary levels exist for dataset", dataset_id, "of", file_name,
+                  "check geo_divisions_by_dataset_ID.txt!")
+            sys.exit()
+
+        table_suffix = get_table_suffix(counter)
+        data_columns = []
+        db_column_names = {}
+        for column_name, data_type in get_csv_columns(csv_path, sample_rows):
+            db_column_names[column_name] = column_name
+            # columns that look like geography are not prefixed by R
+            if 'name' not in column_name.lower() and 'Geo' not in column_name:
+                db_column_names[column_name] = project_id + '_' + table_suffix + '_' + column_name
+            data_columns.append([db_column_names[column_name], check_data_type(data_type), get_attrib_type(data_type)])
+
+        if profile_columns:
+            file_profiles = get_column_profiles_from_csv(
+                csv_path, [i for i in db_column_names if is_data_column(db_column_names[i])],
+            )
+            for column_name, profile in file_profiles.items():
+                merge_column_profile(profiles, db_column_names[column_name], profile)
+
+        # wide files are split into more tables, e.g. PC2018_SL050_001005, PC2018_SL050_002005, ...
+        parts = max(-(-len(data_columns) // max_table_width), 1)
+        modify_date = str(datetime.datetime.fromtimestamp(os.path.getmtime(csv_path)))
+        for part in range(1, parts + 1):
+            if parts > 1:
+                code_name = get_table_suffix(part) + table_suffix
+                table_names.append([file_name + '_' + get_table_suffix(part), code_name, project_year])
+            else:
+                code_name = table_suffix
+                table_names.append([file_name, code_name, project_year])
+
+            part_columns = system_columns + data_columns[(part - 1) * max_table_width:part * max_table_width]
+            for sumlev in sumlevs_by_dataset[dataset_id]:
+                table_name = project_id + '_' + sumlev + '_' + code_name
+                columns[table_name] = part_columns
+                modify_dates[table_name] = modify_date
+
+    # same as get_geo_id_suffixes, first table of every sumlev is used for geography ids
+    geo_id_suffixes = {}
+    for level in geo_hierarchy:
+        sumlev_tables = [table for table in columns if table.startswith(project_id + '_' + level.sumlev + '_')]
+        geo_id_suffixes[level.sumlev] = \
+            min(sumlev_tables)[len(project_id + '_' + level.sumlev):] if sumlev_tables else '_001'
+
+    catalog = {
+        'version': 1,
+        'projectId': project_id,
+        'projectYear': project_year,
+        'dbName': dbname,
+        'table_names': table_names,
+        # tables in the order they would be loaded into database
+        'columns': collections.OrderedDict(
+            (table, [list(column) for column in table_columns]) for table, table_columns in columns.items()
+        ),
+        'geo_id_suffixes': geo_id_suffixes,
+        'modify_dates': modify_dates,
+    }
+    if profile_columns:
+        catalog['profiles'] = profiles
+    return catalog
 
 
-def get_variables(variables, variable_description, meta_table_name):
+def get_variable_format(profile):
+    """
+    Get data type, its length and formatting of variable from profile of its values
+    :param profile: Profile of the column, see new_column_profile
+    :return: Tuple with dataType, dataTypeLength and formatting or None if column has no values
+    """
+    if profile is None or profile['count'] == 0:
+        return None
+    if profile['kind'] == 'text':
+        return '2', str(profile['max_length']), '0'  # none
+    # float columns with whole numbers are integers unless they don't fit 32-bit integer
+    if profile['decimals'] == 0 and -2147483648 <= profile['min'] and profile['max'] <= 2147483647:
+        return '4', '0', '9'  # 1,234
+    if profile['decimals'] == 1:
+        return '7', '0', '10'  # 1,234.5
+    if profile['decimals'] == 2:
+        return '7', '0', '11'  # 1,234.56
+    return '7', '0', '9'  # 1,234
+
+
+def get_variables(variables, variable_description, meta_table_name, run_state, column_profiles=None):
     """
     Get variables for original tables
     :param variables: List of variables
     :param variable_description: List of variable descriptions
     :param meta_table_name: Table name for metadata file, extracted from data file name
+    :param run_state: Counters of the current run, see new_run_state
+    :param column_profiles: Profiles of column values from catalog, if column is profiled its data type and formatting
+    come from its values instead of database type
     :return:
     """
     result = []
     e = ElementMaker()
     # remove unwanted variables
-    removal_vars = [
-        'NAME', 'SUMLEV', 'v1', 'Geo_level',
-        'QName', 'TYPE', 'Geo', 'FIPS', 'Geo_orig',
-    ]
-    variables = [i for i in variables if i[0] not in removal_vars]
-    variables = [i for i in variables if '_NAME' not in i[0]
-                 and 'FIPS' not in i[0] and 'V1' != i[0]]
+    variables = [i for i in variables if is_data_column(i[0])]
 
     for i in variables:
-        # create variable Id's for metadata as meta_table_name + variable order
-        global variableCounter
-        variableCounter += 1
-        # meta_variable_name = meta_table_name + str(100000 + variableCounter)[-5:]
-
-        # position after project name, sumlev, and order number, needed for variable description
-        if len([index for index, chr in enumerate(i[0]) if chr == '_']) == 0:
+        # part after project name and order number, needed for variable description
+        var_suffix = parse_variable_name(i[0]).var_suffix
+        if var_suffix is None:
             continue
-        pos = [index for index, chr in enumerate(i[0]) if chr == '_'][1] + 1
 
         # create variable type
         if i[1] == 3:  # integer
@@ -454,18 +1550,26 @@ def get_variables(variables, variable_description, meta_table_name):
         else:
             var_type = '0'
             formatting_value = '0'
+        var_type_length = '0'  # default to zero
+
+        variable_format = get_variable_format((column_profiles or {}).get(i[0]))
+        if variable_format is not None:
+            var_type, var_type_length, formatting_value = variable_format
 
         # in case unexpected variable name appear in table, print warning and skip it
         # check if range exists because it searches for the variables that doesn't exists
-        if i[0][pos:] not in variable_description.keys():
-            print("Warning: Undefined variable found:", i[0], i[0][pos:])
+        if var_suffix not in variable_description:
+            print("Warning: Undefined variable found:", i[0], var_suffix)
             continue
 
-        variable_desc_for_retrieve = variable_description[i[0][pos:]]
+        variable_desc_for_retrieve = variable_description[var_suffix]
+        # only variables written to metadata file are counted, same as in update_metadata_file
+        run_state['variableCounter'] += 1
+        # meta_variable_name = meta_table_name + str(100000 + run_state['variableCounter'])[-5:]
 
         result.append(
             e.variable(  # repeated for as many times as there are variables
-                GUID=str(uuid.uuid4()),
+                GUID=new_guid(('SurveyDataset', 'ORG'), ('table', meta_table_name), ('variable', i[0])),
                 UVID='',
                 BracketSourceVarGUID='',
                 BracketFromVal='0',
@@ -484,7 +1588,7 @@ def get_variables(variables, variable_description, meta_table_name):
                 ) == 2 else '0',
                 # TODO add indent info from variable desc. file
                 dataType=var_type,
-                dataTypeLength='0',  # default to zero
+                dataTypeLength=var_type_length,
                 formatting=formatting_value,
                 customFormatStr='',  # only for SE tables
                 FormulaFunctionBodyCSharp='',  # only for SE tables
@@ -499,99 +1603,112 @@ def get_variables(variables, variable_description, meta_table_name):
     return result
 
 
-def get_tables(server, dbname, variable_description, user, password, project_year, trusted_connection, file_names_list_path):
+def get_tables(catalog, variable_description, file_names_list_path, run_state):
     """
-    Get list of original tables from db
-    :param server: Server name
-    :param dbname: Database name
+    Get list of original tables from catalog
+    :param catalog: Database catalog, see get_catalog_from_db
     :param variable_description: List to decode variable names into descriptions (from variable_descriptions file)
-    :param user: Username for server
-    :param password: Password for server
-    :param project_year: Project year
+    :param file_names_list_path: Full path to the files list with descriptive table names
+    :param run_state: Counters of the current run, see new_run_state
     :return: list with constructed tables tags
     """
-    table_list = get_tables_from_db(
-        server, dbname, project_year, user, password, trusted_connection,
-    )
-    table_list = collections.OrderedDict(sorted(table_list.items()))
-    table_meta_dictionary = get_table_metadata_from_db(
-        server, dbname, user, password, project_year, trusted_connection, file_names_list_path,
-    )
-    E = ElementMaker()
-    result = []
-    duplication_check_list = []
+    return list(iter_tables(catalog, variable_description, file_names_list_path, run_state))
 
-    for k, v in table_list.items():
 
-        cut_pos = [i for i, el in enumerate(k) if el == '_']
+def get_table_registry(catalog, file_names_list_path):
+    """
+    Register all tables from catalog, tables are sorted by database name
+    :param catalog: Database catalog, see get_catalog_from_db
+    :param file_names_list_path: Full path to the files list with descriptive table names
+    :return: TableRegistry
+    """
+    table_registry = TableRegistry(get_table_metadata(catalog['table_names'], file_names_list_path))
+    for k in sorted(catalog['columns']):
+        table_registry.add(k)
+    return table_registry
 
-        # if table is already added, skipp it
-        if (k[:cut_pos[0]] + k[cut_pos[-1] + 1:]) in duplication_check_list:
-            continue
 
-        duplication_check_list.append(
-            k[:cut_pos[0]] + k[cut_pos[-1] + 1:],
-        )
+def iter_tables(catalog, variable_description, file_names_list_path, run_state, table_registry=None):
+    """
+    Same as get_tables but tables are constructed one by one, used by streaming writer to keep only one table in memory
+    :param catalog: Database catalog, see get_catalog_from_db
+    :param variable_description: List to decode variable names into descriptions (from variable_descriptions file)
+    :param file_names_list_path: Full path to the files list with descriptive table names
+    :param run_state: Counters of the current run, see new_run_state
+    :param table_registry: TableRegistry for the catalog if it was already created, see get_table_registry
+    :return: generator of constructed tables tags
+    """
+    if table_registry is None:
+        table_registry = get_table_registry(catalog, file_names_list_path)
+
+    for table_name in table_registry:
         # create table ID's for metadata
-        global tableCounter
-        tableCounter += 1
-        meta_table_name = k[:cut_pos[0]] + '_' + k[
-                                                 cut_pos[
-                                                     -1
-                                                 ] + 1:
-                                                 ]  # this defines how table Id will be presented in metadata
-        # get last element of string after _ to be table suffix
-        table_suffix = k.split('_')[-1]
-        if table_suffix not in table_meta_dictionary.keys():
+        run_state['tableCounter'] += 1
+        table_title = table_registry.get_title(table_name)
+        if table_title is None:
             print(
                 # skip unexpected table suffixes
                 "Some table suffixes doesn't exist in table_names, probably autogenerated!?",
             )
             continue
-        result.append(
-            E.tables(
-                E.table(  # get tables
-                    E.OutputFormat(
-                        E.Columns(
-
-                        ),
-                        TableTitle="",
-                        TableUniverse="",
-                    ),
-                    *get_variables(
-                        table_list[k],
-                        variable_description, meta_table_name,
-                    ),
-                    GUID=str(uuid.uuid4()),
-                    VariablesAreExclusive='false',
-                    DollarYear='0',
-                    PercentBaseMin='1',
-                    name=meta_table_name,
-                    displayName=meta_table_name,
-                    title=table_meta_dictionary[table_suffix],
-                    titleWrapped=table_meta_dictionary[table_suffix],
-                    universe='none',
-                    Visible='true',
-                    TreeNodeCollapsed='true',
-                    CategoryPriorityOrder='0',
-                    ShowOnFirstPageOfCategoryListing='false',
-                    DbTableSuffix=table_suffix,
-                    uniqueTableId=meta_table_name
+
+        yield get_table(catalog, table_name, table_title, variable_description, run_state)
+
+
+def get_table(catalog, table_name, table_title, variable_description, run_state):
+    """
+    Construct one original table with its variables
+    :param catalog: Database catalog, see get_catalog_from_db
+    :param table_name: DbName of the table, see TableRegistry
+    :param table_title: Title of the table
+    :param variable_description: List to decode variable names into descriptions (from variable_descriptions file)
+    :param run_state: Counters of the current run, see new_run_state
+    :return: tables element with the table
+    """
+    E = ElementMaker()
+    meta_table_name = table_name.meta_table_name  # this defines how table Id will be presented in metadata
+    # get last element of string after _ to be table suffix
+    table_suffix = table_name.table_seq
+
+    return E.tables(
+        E.table(  # get tables
+            E.OutputFormat(
+                E.Columns(
+
                 ),
+                TableTitle="",
+                TableUniverse="",
             ),
-        )
-
-    return result
+            *get_variables(
+                catalog['columns'][table_name.name],
+                variable_description, meta_table_name, run_state, catalog.get('profiles'),
+            ),
+            GUID=new_guid(('SurveyDataset', 'ORG'), ('table', meta_table_name)),
+            VariablesAreExclusive='false',
+            DollarYear='0',
+            PercentBaseMin='1',
+            name=meta_table_name,
+            displayName=meta_table_name,
+            title=table_title,
+            titleWrapped=table_title,
+            universe='none',
+            Visible='true',
+            TreeNodeCollapsed='true',
+            CategoryPriorityOrder='0',
+            ShowOnFirstPageOfCategoryListing='false',
+            DbTableSuffix=table_suffix,
+            uniqueTableId=meta_table_name
+        ),
+    )
 
 
-def get_geo_id_variables(geoLevelInfo):
+def get_geo_id_variables(geo_hierarchy):
     """
     Get variables (geography identifiers) from "Geography Summary File"
-    :param geoLevelInfo: List from config file
+    :param geo_hierarchy: GeoHierarchy of the project
     :return:
     """
 
-    nesting_information = geoLevelInfo
     geo_table_field_list = [
         ['QName', 'Qualifying Name', '2'], [
             'Name', 'Name of Area', '2',
@@ -599,8 +1716,8 @@ def get_geo_id_variables(geoLevelInfo):
     ]
     # create additional variables
     [
-        geo_table_field_list.append([i[1].upper(), i[1], '2']) for i in
-        nesting_information
+        geo_table_field_list.append([level.name.upper(), level.name, '2']) for level in
+        geo_hierarchy
     ]  # '2' means data type is string
 
     result = []
@@ -608,7 +1725,7 @@ def get_geo_id_variables(geoLevelInfo):
     for i in geo_table_field_list:
         result.append(
             E.variable(
-                GUID=str(uuid.uuid4()),
+                GUID=new_guid(('SurveyDataset', 'Geo'), ('table', 'G001'), ('variable', create_acronym(i[0]))),
                 UVID='',
                 BracketSourceVarGUID='',
                 BracketFromVal='0',
@@ -637,13 +1754,12 @@ def get_geo_id_variables(geoLevelInfo):
     return result
 
 
-def get_geo_id_tables(geo_level_info):
+def get_geo_id_tables(geo_hierarchy):
     """
     Get table "Geography Identifiers" for "Geography Summary File"
-    :param geo_level_info: List from config file
+    :param geo_hierarchy: GeoHierarchy of the project
     :return:
     """
-    # get_nesting_information = geo_level_info
     e = ElementMaker()
     result = [e.tables(
         e.table(
@@ -652,8 +1768,8 @@ def get_geo_id_tables(geo_level_info):
                 TableTitle='',
                 TableUniverse='',
             ),
-            *get_geo_id_variables(geo_level_info),
-            GUID=str(uuid.uuid4()),
+            *get_geo_id_variables(geo_hierarchy),
+            GUID=new_guid(('SurveyDataset', 'Geo'), ('table', 'G001')),
             VariablesAreExclusive="false",
             notes="",
             PrivateNotes="",
@@ -683,15 +1799,13 @@ def get_geo_id_tables(geo_level_info):
     return result
 
 
-# @profile
-def create_metadata_xml(
-        connection_string, server, dbname, project_name, project_year, metadata_file_name,
-        geo_level_info, project_id, variable_description, output_directory, user, password,
-        trusted_connection, file_names_list_path,
-):
+def get_survey_header():
+    """
+    Get elements at the beginning of the survey, before geoTypes
+    :return: List of elements
+    """
     e = ElementMaker()
-
-    page = e.survey(
+    return [
         e.Description(
             et.CDATA(''),
         ),
@@ -706,140 +1820,432 @@ def create_metadata_xml(
             ),
             Label='Documentation',
         ),
-        e.geoTypes(
-            *get_geotype(geo_level_info)
-        ),
-        e.GeoSurveyDataset(
-            e.DataBibliographicInfo(
+    ]
 
-            ),
-            e.notes(
 
-            ),
-            e.PrivateNotes(
-                et.CDATA(''),
+def get_survey_dataset_header(dataset_descriptors, abbreviation):
+    """
+    Get elements at the beginning of every SurveyDataset, before its tables
+    :param dataset_descriptors: List from get_dataset_descriptors
+    :param abbreviation: SurveyDataset abbreviation e.g. ORG
+    :return: List of elements
+    """
+    e = ElementMaker()
+    return [
+        e.DataBibliographicInfo(
 
-            ),
-            e.Description(
-                et.CDATA(''),
+        ),
+        e.notes(
 
-            ),
-            e.datasets(
-                *get_datasets(
-                    connection_string, dbname, geo_level_info, project_id, user, password, server,
-                    trusted_connection,
-                )
-            ),
-            e.iterations(
+        ),
+        e.PrivateNotes(
+            et.CDATA(''),
+        ),
+        e.Description(
+            et.CDATA(''),
+        ),
+        e.datasets(
+            *get_datasets(dataset_descriptors, abbreviation)
+        ),
+        e.iterations(
 
-            ),
-            *get_geo_id_tables(geo_level_info),
-            GUID=str(uuid.uuid4()),
-            SurveyDatasetTreeNodeExpanded='true',
-            TablesTreeNodeExpanded='true',
-            IterationsTreeNodeExpanded='false',
-            DatasetsTreeNodeExpanded='true',
-            Description='Geographic Summary Count',
-            Visible='false',
-            abbreviation='Geo',
-            name='Geography Summary File',
-            DisplayName='Geography Summary File'
         ),
-        e.SurveyDatasets(
-            e.SurveyDataset(  # repeated for as many times as there are datasets
-                e.DataBibliographicInfo(
+    ]
 
-                ),
-                e.notes(
 
-                ),
-                e.PrivateNotes(
-                    et.CDATA(''),
-                ),
-                e.Description(
-                    et.CDATA(''),
-                ),
-                e.datasets(
-                    *get_datasets(
-                        connection_string, dbname, geo_level_info, project_id, user, password, server,
-                        trusted_connection,
-                    )
-                ),
-                e.iterations(
+def get_survey_dataset_attributes(abbreviation, name, visible):
+    """
+    Get attributes of SurveyDataset, order of keys is order of attributes in metadata file
+    :param abbreviation: SurveyDataset abbreviation e.g. ORG
+    :param name: SurveyDataset name, also used as display name
+    :param visible: 'true' or 'false'
+    :return: Dictionary with attributes
+    """
+    return collections.OrderedDict([
+        ('GUID', new_guid(('SurveyDataset', abbreviation))),
+        ('SurveyDatasetTreeNodeExpanded', 'true'),
+        ('TablesTreeNodeExpanded', 'true'),
+        ('IterationsTreeNodeExpanded', 'false'),
+        ('DatasetsTreeNodeExpanded', 'true'),
+        ('Description', ''),
+        ('Visible', visible),
+        ('abbreviation', abbreviation),
+        ('name', name),
+        ('DisplayName', name),
+    ])
+
+
+def get_geo_survey_dataset(geo_hierarchy, dataset_descriptors):
+    """
+    Get GeoSurveyDataset with "Geography Identifiers" table
+    :param geo_hierarchy: GeoHierarchy of the project
+    :param dataset_descriptors: List from get_dataset_descriptors
+    :return: GeoSurveyDataset element
+    """
+    e = ElementMaker()
+    attributes = get_survey_dataset_attributes('Geo', 'Geography Summary File', 'false')
+    attributes['Description'] = 'Geographic Summary Count'
+    return e.GeoSurveyDataset(
+        *get_survey_dataset_header(dataset_descriptors, 'Geo'),
+        *get_geo_id_tables(geo_hierarchy),
+        **attributes
+    )
 
-                ),
-                e.tables(
-                    et.Comment("Insert SE tables here !!!"),
 
-                ),
-                GUID=str(uuid.uuid4()),
-                SurveyDatasetTreeNodeExpanded='true',
-                TablesTreeNodeExpanded='true',
-                IterationsTreeNodeExpanded='false',
-                DatasetsTreeNodeExpanded='true',
-                Description='',
-                Visible='false',
-                abbreviation='SE',
-                name='CED Tables',
-                DisplayName='CED Tables',
-            ),
-            e.SurveyDataset(  # repeated for as many times as there are datasets
-                e.DataBibliographicInfo(
+def get_se_survey_dataset(dataset_descriptors):
+    """
+    Get empty "CED Tables" SurveyDataset, SE tables are added later (see add_se_tables.py)
+    :param dataset_descriptors: List from get_dataset_descriptors
+    :return: SurveyDataset element
+    """
+    e = ElementMaker()
+    return e.SurveyDataset(
+        *get_survey_dataset_header(dataset_descriptors, 'SE'),
+        e.tables(
+            et.Comment("Insert SE tables here !!!"),
 
-                ),
-                e.notes(
+        ),
+        **get_survey_dataset_attributes('SE', 'CED Tables', 'false')
+    )
 
-                ),
-                e.PrivateNotes(
-                    et.CDATA(''),
-                ),
-                e.Description(
-                    et.CDATA(''),
-                ),
-                e.datasets(
-                    *get_datasets(
-                        connection_string, dbname, geo_level_info, project_id, user, password, server,
-                        trusted_connection,
-                    )
-                ),
-                e.iterations(
 
-                ),
-                *get_tables(
-                    server, dbname, variable_description,
-                    user, password, project_year, trusted_connection, file_names_list_path,
-                ),
-                GUID=str(uuid.uuid4()),
-                SurveyDatasetTreeNodeExpanded='true',
-                TablesTreeNodeExpanded='true',
-                IterationsTreeNodeExpanded='false',
-                DatasetsTreeNodeExpanded='true',
-                Description='',
-                Visible='true',
-                abbreviation='ORG',
-                name='Original Tables',
-                DisplayName='Original Tables'
-            ),
+def get_survey_attributes(project_id, project_name, project_year):
+    """
+    Get attributes of survey element, order of keys is order of attributes in metadata file
+    :param project_id: Project id
+    :param project_name: Project name
+    :param project_year: Project year
+    :return: Dictionary with attributes
+    """
+    return collections.OrderedDict([
+        ('GUID', new_guid()),
+        ('Visible', 'true'),
+        ('GeoTypeTreeNodeExpanded', 'true'),
+        ('GeoCorrespondenceTreeNodeExpanded', 'false'),
+        # metadata_file_name, changed from project_name when meaning of project name changed
+        ('name', project_id),
+        ('DisplayName', project_name),
+        ('year', project_year),
+        ('Categories', ''),
+    ])
+
+
+def get_survey_categories(project_name):
+    """
+    Get Categories element at the end of the survey
+    :param project_name: Project name
+    :return: Categories element
+    """
+    e = ElementMaker()
+    return e.Categories(
+        e.string(
+            project_name,  # change into something more appropriate if possible
+        ),
+    )
+
+
+def write_metadata_tree(output_path, geo_hierarchy, dataset_descriptors, tables, project_id, project_name,
+                        project_year):
+    """
+    Build whole survey in memory and write it to the file
+    :param output_path: Full path to metadata file
+    :param geo_hierarchy: GeoHierarchy of the project
+    :param dataset_descriptors: List from get_dataset_descriptors
+    :param tables: Iterable of original tables, see iter_tables
+    :param project_id: Project id
+    :param project_name: Project name
+    :param project_year: Project year
+    :return:
+    """
+    e = ElementMaker()
+    with profile_stage('geotypes'):
+        geotypes = get_geotype(geo_hierarchy)
+    page = e.survey(
+        *get_survey_header(),
+        e.geoTypes(
+            *geotypes
         ),
-        e.Categories(
-            e.string(
-                project_name,  # change into something more appropriate if possible
+        get_geo_survey_dataset(geo_hierarchy, dataset_descriptors),
+        e.SurveyDatasets(
+            get_se_survey_dataset(dataset_descriptors),
+            e.SurveyDataset(
+                *get_survey_dataset_header(dataset_descriptors, 'ORG'),
+                *tables,
+                **get_survey_dataset_attributes('ORG', 'Original Tables', 'true')
             ),
         ),
-        GUID=str(uuid.uuid4()),
-        Visible='true',
-        GeoTypeTreeNodeExpanded='true',
-        GeoCorrespondenceTreeNodeExpanded='false',
-        # metadata_file_name, changed from project_name when meaning of project name changed
-        name=project_id,
-        DisplayName=project_name,
-        year=project_year,
-        Categories='',
+        get_survey_categories(project_name),
+        **get_survey_attributes(project_id, project_name, project_year)
     )
     tree = et.ElementTree(page)
-    tree.write(output_directory + metadata_file_name)
-    print("Writing to: ", output_directory + metadata_file_name)
+    tree.write(output_path)
+
+
+def write_metadata_stream(output_path, geo_hierarchy, dataset_descriptors, tables, project_id, project_name,
+                          project_year):
+    """
+    Write survey to the file incrementally, tables are written as soon as they are constructed so only one table is
+    kept in memory. Output is the same as from write_metadata_tree.
+    :param output_path: Full path to metadata file
+    :param geo_hierarchy: GeoHierarchy of the project
+    :param dataset_descriptors: List from get_dataset_descriptors
+    :param tables: Iterable of original tables, see iter_tables
+    :param project_id: Project id
+    :param project_name: Project name
+    :param project_year: Project year
+    :return:
+    """
+    e = ElementMaker()
+    with et.xmlfile(output_path, encoding='ASCII') as xf:
+        with xf.element('survey', get_survey_attributes(project_id, project_name, project_year)):
+            for element in get_survey_header():
+                xf.write(element)
+            with profile_stage('geotypes'):
+                geotypes = get_geotype(geo_hierarchy)
+            xf.write(e.geoTypes(*geotypes))
+            xf.write(get_geo_survey_dataset(geo_hierarchy, dataset_descriptors))
+            with xf.element('SurveyDatasets'):
+                xf.write(get_se_survey_dataset(dataset_descriptors))
+                with xf.element('SurveyDataset', get_survey_dataset_attributes('ORG', 'Original Tables', 'true')):
+                    for element in get_survey_dataset_header(dataset_descriptors, 'ORG'):
+                        xf.write(element)
+                    for table in tables:
+                        xf.write(table)
+            xf.write(get_survey_categories(project_name))
+
+
+def get_signature(value):
+    """
+    :param value: Anything that can be saved to json
+    :return: Hash of the value
+    """
+    return hashlib.sha1(json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def get_incremental_state_path(output_path):
+    return output_path + '.state.json'
+
+
+def get_incremental_state(catalog, table_registry, variable_description, geo_level_info, dataset_descriptors,
+                          project_id, project_name, project_year):
+    """
+    Get signatures of everything metadata file is generated from. Table signature changes if its title, columns,
+    variable descriptions or modify date of any of its database tables (one for each sumlev) change.
+    :param catalog: Database catalog, see get_catalog_from_db
+    :param table_registry: TableRegistry for the catalog
+    :param variable_description: Dictionary with variable descriptions
+    :param geo_level_info: List from config file
+    :param dataset_descriptors: List from get_dataset_descriptors
+    :param project_id: Project id
+    :param project_name: Project name
+    :param project_year: Project year
+    :return: Dictionary with signature of the survey and of every table
+    """
+    modify_dates = catalog.get('modify_dates', {})
+    db_tables = collections.defaultdict(list)
+    for k in sorted(catalog['columns']):
+        db_tables[parse_table_name(k).meta_table_name].append(k)
+
+    tables = {}
+    for table_name in table_registry:
+        columns = catalog['columns'][table_name.name]
+        signature = [
+            table_registry.get_title(table_name),
+            columns,
+            [[k, modify_dates.get(k)] for k in db_tables[table_name.meta_table_name]],
+            [variable_description.get(parse_variable_name(column[0]).var_suffix) for column in columns],
+        ]
+        # profiles are part of signature only if columns are profiled, so state from runs without them stays valid
+        if 'profiles' in catalog:
+            signature.append([catalog['profiles'].get(column[0]) for column in columns])
+        tables[table_name.meta_table_name] = get_signature(signature)
+    return {
+        'version': 1,
+        'survey': get_signature([project_id, project_name, project_year, geo_level_info, dataset_descriptors]),
+        'tables': tables,
+    }
+
+
+def load_incremental_state(state_path):
+    """
+    :param state_path: Full path to the state file
+    :return: State saved by previous run or None if it doesn't exist or it can't be used
+    """
+    if not os.path.isfile(state_path):
+        return None
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get('version') == 1 else None
+
+
+def save_incremental_state(state_path, state):
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, separators=(',', ':'))
+
+
+def update_metadata_file(output_path, state, previous_state, catalog, table_registry, variable_description,
+                         run_state):
+    """
+    Update original tables of existing metadata file, only tables whose signature changed (see get_incremental_state)
+    are constructed again, other tables are kept as they are. Everything outside of original tables is kept too.
+    :param output_path: Full path to existing metadata file
+    :param state: State of the current run
+    :param previous_state: State saved when metadata file was written
+    :param catalog: Database catalog, see get_catalog_from_db
+    :param table_registry: TableRegistry for the catalog
+    :param variable_description: Dictionary with variable descriptions
+    :param run_state: Counters of the current run, see new_run_state
+    :return: True if file was updated, False if it has to be generated again
+    """
+    parser = et.XMLParser(strip_cdata=False)
+    survey = et.parse(output_path, parser=parser).getroot()
+    original_dataset = survey.find("SurveyDatasets/SurveyDataset[@abbreviation='ORG']")
+    if original_dataset is None:
+        print("Info: Original tables don't exist in", output_path)
+        return False
+
+    existing_tables = {}
+    for tables_element in original_dataset.findall('tables'):
+        table = tables_element.find('table')
+        if table is not None:
+            existing_tables[table.attrib['name']] = tables_element
+        original_dataset.remove(tables_element)
+
+    rebuilt = 0
+    kept = 0
+    for table_name in table_registry:
+        run_state['tableCounter'] += 1
+        meta_table_name = table_name.meta_table_name
+        table_title = table_registry.get_title(table_name)
+        if table_title is None:
+            print(
+                # skip unexpected table suffixes
+                "Some table suffixes doesn't exist in table_names, probably autogenerated!?",
+            )
+            continue
+
+        if meta_table_name in existing_tables and \
+                previous_state['tables'].get(meta_table_name) == state['tables'][meta_table_name]:
+            tables_element = existing_tables[meta_table_name]
+            run_state['variableCounter'] += len(tables_element.find('table').findall('variable'))
+            kept += 1
+        else:
+            with profile_stage('tables'):
+                tables_element = get_table(catalog, table_name, table_title, variable_description, run_state)
+            rebuilt += 1
+        original_dataset.append(tables_element)
+
+    removed = len(set(existing_tables) - set(state['tables']))
+    print(
+        "Incremental update: {} tables rebuilt, {} kept, {} removed".format(
+            rebuilt, kept, removed,
+        ),
+    )
+    survey.getroottree().write(output_path)
+    return True
+
+
+def new_run_state():
+    """
+    Create state for one metadata file generation, this keeps runs isolated when many projects are generated in one
+    process
+    :return: Dictionary with run counters
+    """
+    # connection statistics are reported per run
+    connection_stats.update({'opened': 0, 'reused': 0, 'setup_seconds': 0.0})
+    return {
+        'tableCounter': 0,  # required for tables in metadata
+        'variableCounter': 0,
+    }
+
+
+def create_metadata_xml(
+        connection_string, server, dbname, project_name, project_year, metadata_file_name,
+        geo_level_info, project_id, variable_description, output_directory, user, password,
+        trusted_connection, file_names_list_path, column_discovery='catalog', conn=None, catalog=None,
+        snapshot_path=None, stream_xml=False, deterministic_guids=False, reuse_guids_from=None, incremental=False,
+        profile_columns=False,
+):
+    run_start = time.perf_counter()
+    run_state = new_run_state()
+    output_path = output_directory + metadata_file_name
+    # tables that are constructed again in incremental mode keep their GUIDs
+    if incremental and not reuse_guids_from and os.path.isfile(output_path):
+        reuse_guids_from = output_path
+    # GUIDs must be configured before existing metadata file is overwritten
+    with profile_stage('guids'):
+        configure_guids(project_id, deterministic=deterministic_guids, existing_xml=reuse_guids_from)
+
+    # everything read from database is in catalog, it can also come from snapshot when working offline
+    with profile_stage('catalog'):
+        if catalog is None:
+            catalog = get_catalog_from_db(
+                server, dbname, user, password, project_year, project_id, geo_level_info, trusted_connection,
+                column_discovery=column_discovery, conn=conn, profile_columns=profile_columns,
+            )
+        elif catalog['projectId'] != project_id:
+            print("Warning: Snapshot was created for project", catalog['projectId'], "and config is for", project_id)
+        if snapshot_path:
+            save_catalog_snapshot(catalog, snapshot_path)
+
+    # same data sets are used in every SurveyDataset, only GUIDs differ
+    with profile_stage('datasets'):
+        geo_hierarchy = GeoHierarchy(geo_level_info)
+        dataset_descriptors = get_dataset_descriptors(
+            connection_string, dbname, geo_hierarchy, project_id, catalog['geo_id_suffixes'],
+        )
+
+    with profile_stage('tables'):
+        table_registry = get_table_registry(catalog, file_names_list_path)
+
+    updated = False
+    if incremental:
+        with profile_stage('incremental state'):
+            state = get_incremental_state(
+                catalog, table_registry, variable_description, geo_level_info, dataset_descriptors, project_id,
+                project_name, project_year,
+            )
+            previous_state = load_incremental_state(get_incremental_state_path(output_path))
+        if previous_state is None or not os.path.isfile(output_path):
+            print("Info: Metadata file or its state from previous run doesn't exist, whole file will be generated.")
+        elif previous_state['survey'] != state['survey']:
+            print("Info: Project or geography info has changed, whole file will be generated.")
+        else:
+            with profile_stage('serialization'):
+                updated = update_metadata_file(
+                    output_path, state, previous_state, catalog, table_registry, variable_description, run_state,
+                )
+
+    if not updated:
+        tables = iter_tables(catalog, variable_description, file_names_list_path, run_state, table_registry)
+        if profile_state['enabled']:
+            # tables are constructed while file is written, their time is not part of serialization
+            tables = profile_iter(tables, 'tables')
+        with profile_stage('serialization'):
+            if stream_xml:
+                write_metadata_stream(
+                    output_path, geo_hierarchy, dataset_descriptors, tables, project_id, project_name, project_year,
+                )
+            else:
+                write_metadata_tree(
+                    output_path, geo_hierarchy, dataset_descriptors, tables, project_id, project_name, project_year,
+                )
+    if incremental:
+        save_incremental_state(get_incremental_state_path(output_path), state)
+    print("Writing to: ", output_path)
+    print_connection_report(time.perf_counter() - run_start)
+    # injected connection is owned by the caller, pooled ones are closed here
+    if conn is None:
+        close_db_connections()
     print("Everything finished successfully!!!")
+    return {
+        'output': output_path,
+        'tables': run_state['tableCounter'],
+        'variables': run_state['variableCounter'],
+    }
 
 
 def prepare_environment(config_file):
@@ -849,14 +2255,9 @@ def prepare_environment(config_file):
     :return:
     """
 
-    # required for tables in metadata
-    global tableCounter
-    global variableCounter
-    tableCounter = 0  # required for tables in metadata
-    variableCounter = 0
-
     # take values from metadata file
-    config = get_config(config_file)
+    with profile_stage('config'):
+        config = get_config(config_file)
     connection_string = f"Server=prime; database=; uid={config['user']};pwd={config['password']};Connect Timeout=1;Pooling=True"
     dbname = config['dbName']
     server = config['server']
@@ -871,32 +2272,20 @@ def prepare_environment(config_file):
     password = config['password']
     trusted_connection = config['trustedConnection']
     file_names_list = config['fileNamesList']
+    # 'catalog' reads all columns in one query, 'query' reads each table separately
+    column_discovery = config.get('columnDiscovery', 'catalog')
+    # parsed variable descriptions are cached next to them unless other location is set, blank disables cache
+    variable_description_cache = config.get(
+        'variableDescriptionCache', get_variable_description_cache_path(variable_description_location),
+    )
 
-    if os.path.isfile(variable_description_location):
-        variable_description = get_variable_descriptions_from_file(
-            variable_description_location,
-        )
-    else:
-        variable_description = get_variable_descriptions_from_directory(
-            variable_description_location,
-        )
-
-    # check if there is proper number of columns in a file, maybe this could be moved to separate function?
-    for v in variable_description.values():
-        col_nr = len(v)
-        if col_nr not in [1, 2]:
-            print('Number of columns in variable description file/s is not ok!')
-            sys.exit()
-
-    col_nr_prev = [i for i in variable_description.values()]
-    for i in variable_description.values():
-        if len(i) != len(max(col_nr_prev, key=len)):
-            print('Number of columns changes in the file!?')
-            sys.exit()
+    with profile_stage('variable descriptions'):
+        variable_description = load_variable_descriptions(variable_description_location, variable_description_cache)
 
     return [
         connection_string, server, dbname, project_name, project_year, metadata_file_name, geo_level_info,
         project_id, variable_description, output_directory, user, password, trusted_connection, file_names_list,
+        column_discovery,
     ]
 
 
@@ -951,6 +2340,60 @@ def verify_config(config_path_value):
         return False
 
 
+def run(config_path, from_snapshot=None, save_snapshot=None, stream_xml=False, deterministic_guids=False,
+        reuse_guids_from=None, incremental=False, profile_report=None, from_csv=False, profile_columns=False):
+    """
+    Verify config file and generate metadata file for it
+    :param config_path: Full path to config file
+    :param from_snapshot: Full path to catalog snapshot to use instead of database
+    :param save_snapshot: Full path where catalog snapshot should be saved
+    :param stream_xml: Write metadata file incrementally instead of building it in memory
+    :param deterministic_guids: Derive GUIDs from project id and element names, see configure_guids
+    :param reuse_guids_from: Full path to metadata file whose GUIDs should be kept for matching elements
+    :param incremental: Update only changed tables of existing metadata file, see update_metadata_file
+    :param profile_report: Full path to json report with time and memory of every stage and database queries, if
+    not set run is not profiled
+    :param from_csv: Read tables and columns from data files in sourceDirectory instead of database
+    :param profile_columns: Set data type and formatting of variables from their values, it reads all rows of every
+    table, not used with snapshot
+    :return: Summary of the run from create_metadata_xml or None if config is not valid
+    """
+    # pooled connections are closed even if run fails, batch runs reuse worker processes and a connection left in
+    # the pool would be picked up by the next project on the same database
+    try:
+        if not verify_config(config_path):
+            return None
+
+        run_start = time.perf_counter()
+        if profile_report:
+            start_profiling()
+
+        catalog_snapshot = None
+        if from_snapshot:
+            with profile_stage('catalog'):
+                catalog_snapshot = load_catalog_snapshot(from_snapshot)
+        elif from_csv:
+            with profile_stage('catalog'):
+                config = get_config(config_path)
+                catalog_snapshot = get_catalog_from_csv(
+                    config['sourceDirectory'], config['configDirectory'], config['fileNamesList'], config['projectId'],
+                    str(config['projectYear']), config['dbName'], config['geoLevelInfo'],
+                    table_numbering_starts_from=config.get('tableNumberingStartsFrom', 1),
+                    max_table_width=config.get('maxTableWidth', 200), profile_columns=profile_columns,
+                )
+        summary = create_metadata_xml(
+            *prepare_environment(config_path), catalog=catalog_snapshot, snapshot_path=save_snapshot,
+            stream_xml=stream_xml, deterministic_guids=deterministic_guids, reuse_guids_from=reuse_guids_from,
+            incremental=incremental, profile_columns=profile_columns,
+        )
+
+        if profile_report:
+            write_profile_report(profile_report, time.perf_counter() - run_start)
+        return summary
+    finally:
+        close_db_connections()
+
+
 def menu():
     """
     Display menu and pass command line parameters.
@@ -962,16 +2405,62 @@ def menu():
         '-c', '--config-file', dest='configFilePath', help='Full path to the config file!',
         metavar='configFilePath',
     )
+    parser.add_option(
+        '-s', '--save-snapshot', dest='saveSnapshot',
+        help='Save everything read from database to this file (use .gz extension to compress it)',
+        metavar='saveSnapshot',
+    )
+    parser.add_option(
+        '-f', '--from-snapshot', dest='fromSnapshot',
+        help='Generate metadata from snapshot file instead of database',
+        metavar='fromSnapshot',
+    )
+    parser.add_option(
+        '-d', '--from-csv', dest='fromCsv', action='store_true', default=False,
+        help='Generate metadata from data files in sourceDirectory instead of database, only header and first rows '
+             'of every file are read',
+    )
+    parser.add_option(
+        '-t', '--profile-columns', dest='profileColumns', action='store_true', default=False,
+        help='Set dataType, dataTypeLength and formatting of variables from their values (integer or decimal, number '
+             'of decimal places, max length of text), all rows of every table are read',
+    )
+    parser.add_option(
+        '-x', '--stream-xml', dest='streamXml', action='store_true', default=False,
+        help='Write metadata file incrementally, use it for projects with thousands of tables',
+    )
+    parser.add_option(
+        '-g', '--deterministic-guids', dest='deterministicGuids', action='store_true', default=False,
+        help='Derive GUIDs from project id and element names so regenerated file has the same GUIDs',
+    )
+    parser.add_option(
+        '-r', '--reuse-guids', dest='reuseGuids',
+        help='Keep GUIDs from this metadata file (usually previous version of output) for matching elements',
+        metavar='reuseGuids',
+    )
+    parser.add_option(
+        '-i', '--incremental', dest='incremental', action='store_true', default=False,
+        help='Rebuild only new and changed tables of existing metadata file, other tables and their GUIDs are kept',
+    )
+    parser.add_option(
+        '-p', '--profile', dest='profile',
+        help='Save time and memory of every stage and number of database queries and rows to this json file, '
+             'memory tracing makes the run slower',
+        metavar='profile',
+    )
     (options, args) = parser.parse_args()
     return options
 
 
 if __name__ == '__main__':
     opt = menu()
-    if len(argv) == 1:
+    if len(argv) == 1 or opt.configFilePath is None:
         config_path = 'config.yml'
     else:
         config_path = opt.configFilePath
 
-    if verify_config(config_path):
-        create_metadata_xml(*prepare_environment(config_path))
+    run(
+        config_path, from_snapshot=opt.fromSnapshot, save_snapshot=opt.saveSnapshot, stream_xml=opt.streamXml,
+        deterministic_guids=opt.deterministicGuids, reuse_guids_from=opt.reuseGuids, incremental=opt.incremental,
+        profile_report=opt.profile, from_csv=opt.fromCsv, profile_columns=opt.profileColumns,
+    )
@@ -0,0 +1,382 @@
+"""
+This script will compute SE variables of a metadata file from ORG data so SE tables of a new year can be checked
+before they are published. FormulaFunctionBodyCSharp of every variable is translated once into an expression over
+arrays and evaluated for all geographies at the same time, variables that a formula refers to are computed first.
+
+Supported formulas assign value once and can set it to null with if statements, e.g.
+    oretval.Value = #ORG:PC2018_001_CED_V1.Value / #ORG:PC2018_001_CED_V2.Value * 100;
+    if (#ORG:PC2018_001_CED_V2.Value == 0 || #ORG:PC2018_001_CED_V1.IsNull) oretval.IsNull = true;
+Null values are NaN so they propagate through arithmetic, division by zero gives null too.
+
+Data columns are named by the order of data files, so with -d config must number the files the same way as when
+the metadata file was created. padron_2018.xml refers to tables of all seven files in raw_data numbered from 001, so
+it needs config with blank fileNamesList ('') and tableNumberingStartsFrom: 1. config.yml in this folder reads only
+CED_Tabla5 and CED_Tabla6 as tables 005 and 006, it matches PC2018_v2.xml.
+
+python evaluate_se_tables.py -c config.yml -m ../padron_2018.xml -d -o se_values.csv
+"""
+import collections
+import csv
+import optparse
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from lxml import etree as et
+
+import create_metadata_file
+
+# #DS:NAME.Value or #DS:NAME.IsNull, DS is abbreviation of dataset
+reference_pattern = re.compile(r'#(\w+):(\w+)\.(Value|IsNull)\b')
+# what is left of translated expression when references are replaced, nothing else can be evaluated
+expression_pattern = re.compile(r'(?:v\[\d+\]|isnan\(|\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+|[-+*/()<>=!|&\s])*')
+# names that can be used in translated expressions
+expression_namespace = {'__builtins__': {}, 'isnan': np.isnan, 'where': np.where, 'nan': np.nan}
+
+
+def get_formula_variables(metadata_path):
+    """
+    Read variables of all survey datasets of metadata file, geography dataset is skipped
+    :param metadata_path: Full path to metadata file
+    :return: Dictionary with (dataset abbreviation, variable name) as a key and FormulaFunctionBodyCSharp as a value
+    """
+    variables = collections.OrderedDict()
+    root = et.parse(metadata_path, et.XMLParser(huge_tree=True)).getroot()
+    for dataset in root.iter('SurveyDataset'):
+        abbreviation = dataset.attrib.get('abbreviation', '')
+        for variable in dataset.iter('variable'):
+            variables[(abbreviation, variable.attrib['name'])] = variable.attrib.get('FormulaFunctionBodyCSharp', '')
+    return variables
+
+
+def translate_expression(text, references):
+    """
+    Replace references in C# expression with v[n], n is position of referenced variable in references
+    :param text: C# expression
+    :param references: List of (dataset abbreviation, variable name), new references are appended to it
+    :return: Python expression
+    """
+    def replace(match):
+        key = (match.group(1), match.group(2))
+        if key not in references:
+            references.append(key)
+        array = 'v[' + str(references.index(key)) + ']'
+        return array if match.group(3) == 'Value' else 'isnan(' + array + ')'
+
+    text = reference_pattern.sub(replace, text)
+    if not expression_pattern.fullmatch(text):
+        raise ValueError('Unsupported expression: ' + ' '.join(text.split()))
+    # || and && bind weaker than comparisons in C#, numpy | and & bind stronger
+    return '(' + text.replace('||', ') | (').replace('&&', ') & (') + ')'
+
+
+def compile_formula(body):
+    """
+    Translate FormulaFunctionBodyCSharp into expression over numpy arrays
+    :param body: FormulaFunctionBodyCSharp of variable
+    :return: Compiled expression and list of (dataset abbreviation, variable name) it refers to, values of referenced
+    variables are passed to expression as v[0], v[1], ...
+    """
+    declaration = re.search(r'#ReturnType\s+(\w+)\s*=\s*new\s+#ReturnType\(\)\s*;', body)
+    if declaration is None:
+        raise ValueError('Return value is not declared')
+    return_value = re.escape(declaration.group(1))
+    statements = body[declaration.end():]
+
+    value_pattern = return_value + r'\.Value\s*=\s*([^;]+);'
+    null_pattern = r'if\s*\((.*?)\)\s*' + return_value + r'\.IsNull\s*=\s*true\s*;'
+    values = re.findall(value_pattern, statements)
+    if len(values) != 1:
+        raise ValueError('Value is assigned {} times'.format(len(values)))
+    conditions = re.findall(null_pattern, statements)
+
+    rest = re.sub(value_pattern + '|' + null_pattern + r'|\belse\b|return\s+' + return_value + r'\s*;', '', statements)
+    if rest.strip():
+        raise ValueError('Unsupported statement: ' + ' '.join(rest.split()))
+
+    references = []
+    expression = translate_expression(values[0], references)
+    if conditions:
+        expression = 'where(' + ' | '.join(translate_expression(i, references) for i in conditions) + ', nan, ' + \
+                     expression + ')'
+    try:
+        return compile(expression, '<formula>', 'eval'), references
+    except SyntaxError:
+        raise ValueError('Unsupported expression: ' + expression)
+
+
+def evaluate_formula(code, arrays, size):
+    """
+    Evaluate compiled formula for all geographies
+    :param code: Compiled expression from compile_formula
+    :param arrays: Values of referenced variables, in the same order as references from compile_formula
+    :param size: Number of geographies
+    :return: Array of floats, nulls and results of division by zero are NaN
+    """
+    with np.errstate(all='ignore'):
+        result = eval(code, expression_namespace, {'v': arrays})
+    # formula without references gives one number
+    result = np.broadcast_to(np.asarray(result, dtype=float), (size,)).copy()
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def evaluate_variables(variables, data, datasets=None):
+    """
+    Compute variables with formula, values of variables without formula are taken from data by their name
+    :param variables: Dictionary with variables and their formulas, see get_formula_variables
+    :param data: DataFrame with ORG values, geographies in rows and variable names as columns
+    :param datasets: Abbreviations of datasets whose variables are computed, all datasets if empty
+    :return: Dictionary with (dataset abbreviation, variable name) of computed variables as a key and array of values
+    as a value and dictionary with variables that couldn't be computed as a key and the reason as a value
+    """
+    values = {}
+    errors = collections.OrderedDict()
+    in_progress = set()
+
+    def compute(key):
+        if key in values or key in errors:
+            return key in values
+        body = variables.get(key, '')
+        if not body.strip():
+            if key[1] in data.columns:
+                values[key] = pd.to_numeric(data[key[1]], errors='coerce').to_numpy(dtype=float)
+            else:
+                errors[key] = 'No formula and no column in data'
+            return key in values
+        if key in in_progress:
+            errors[key] = 'Circular reference'
+            return False
+
+        in_progress.add(key)
+        try:
+            code, references = compile_formula(body)
+            for reference in references:
+                if not compute(reference):
+                    raise ValueError('Refers to {}:{} that can not be computed'.format(*reference))
+            values[key] = evaluate_formula(code, [values[i] for i in references], len(data))
+        except ValueError as ex:
+            errors.setdefault(key, str(ex))
+        in_progress.discard(key)
+        return key in values
+
+    selected = [
+        key for key, body in variables.items() if body.strip() and (not datasets or key[0] in datasets)
+    ]
+    for key in selected:
+        compute(key)
+    return collections.OrderedDict((key, values[key]) for key in selected if key in values), \
+        collections.OrderedDict((key, errors[key]) for key in selected if key in errors)
+
+
+def get_data_columns(variables):
+    """
+    Names of variables that are read from data, variables without formula and variables that formulas refer to
+    but are not in metadata file
+    :param variables: Dictionary with variables and their formulas, see get_formula_variables
+    :return: Set of column names
+    """
+    columns = {key[1] for key, body in variables.items() if not body.strip()}
+    for body in variables.values():
+        columns.update(i[1] for i in reference_pattern.findall(body) if (i[0], i[1]) not in variables)
+    return columns
+
+
+def combine_frames(frames_by_table):
+    """
+    Join data of all tables into one DataFrame
+    :param frames_by_table: Dictionary with table as a key and list of DataFrames (one for every sumlev or one for
+    all of them) indexed by SUMLEV and FIPS as a value
+    :return: DataFrame with geographies in rows and columns of all tables
+    """
+    tables = [pd.concat(frames) for frames in frames_by_table.values()]
+    if not tables:
+        return pd.DataFrame(index=pd.MultiIndex.from_tuples([], names=['SUMLEV', 'FIPS']))
+    return pd.concat(tables, axis=1)
+
+
+def get_org_data_from_csv(source_directory, file_names_list_path, project_id, column_names,
+                          table_numbering_starts_from=1):
+    """
+    Read ORG values from data files, columns are named as process_to_db_new.r names them e.g. CED_V1 from the first
+    file is PC2018_001_CED_V1. Only columns in column_names are read.
+    :param source_directory: Directory with data files (sourceDirectory from config file)
+    :param file_names_list_path: Full path to the files list, if blank all files in source directory are used
+    :param project_id: Project id
+    :param column_names: Set of column names to read
+    :param table_numbering_starts_from: Number of the first table (tableNumberingStartsFrom from config file)
+    :return: DataFrame indexed by SUMLEV and FIPS
+    """
+    frames_by_table = collections.OrderedDict()
+    for counter, file_name in enumerate(
+            create_metadata_file.get_csv_file_names(source_directory, file_names_list_path),
+            table_numbering_starts_from,
+    ):
+        csv_path = source_directory + file_name
+        if not os.path.isfile(csv_path):
+            continue
+        prefix = project_id + '_' + create_metadata_file.get_table_suffix(counter) + '_'
+        with create_metadata_file.open_csv_file(csv_path) as f:
+            header = next(csv.reader(f))
+        used_columns = {i: prefix + i for i in header if prefix + i in column_names}
+        if not used_columns:
+            continue
+
+        frame = pd.read_csv(
+            csv_path, usecols=['SUMLEV', 'Geo'] + list(used_columns), dtype={'SUMLEV': str, 'Geo': str},
+            encoding='utf-8', encoding_errors='replace',
+        )
+        frame = frame.rename(columns=used_columns).rename(columns={'Geo': 'FIPS'}).set_index(['SUMLEV', 'FIPS'])
+        if not frame.index.is_unique:
+            print('Warning: File', file_name, 'has more rows for the same geography, its columns are not used!')
+            continue
+        frames_by_table[file_name] = [frame]
+    return combine_frames(frames_by_table)
+
+
+def get_org_data_from_db(server, dbname, user, password, trusted_connection, project_year, column_names):
+    """
+    Read ORG values from database, every table with at least one of the columns is read once
+    :param server: Server name
+    :param dbname: Database name
+    :param user: Username for server
+    :param password: Password for server
+    :param trusted_connection: flag if server credentials are needed
+    :param project_year: Project year
+    :param column_names: Set of column names to read
+    :return: DataFrame indexed by SUMLEV and FIPS
+    """
+    columns, _ = create_metadata_file.get_tables_from_db(
+        server, dbname, project_year, user, password, trusted_connection,
+    )
+    cursor = create_metadata_file.get_db_connection(server, dbname, user, password, trusted_connection).cursor()
+
+    frames_by_table = collections.OrderedDict()
+    for table_name, table_columns in columns.items():
+        used_columns = [i[0] for i in table_columns if i[0] in column_names]
+        if not used_columns:
+            continue
+        cursor.execute(
+            'SELECT [FIPS], ' + ', '.join('[' + i + ']' for i in used_columns) + ' FROM [' + table_name + ']',
+        )
+        frame = pd.DataFrame.from_records([tuple(row) for row in cursor.fetchall()], columns=['FIPS'] + used_columns)
+        frame.insert(0, 'SUMLEV', create_metadata_file.parse_table_name(table_name).sumlev)
+        # same table from all sumlevs is one table in metadata
+        frames_by_table.setdefault(
+            create_metadata_file.parse_table_name(table_name).table_seq, [],
+        ).append(frame.set_index(['SUMLEV', 'FIPS']))
+    return combine_frames(frames_by_table)
+
+
+def get_results_frame(results, index):
+    """
+    Put computed values into DataFrame, columns are variable names, names that exist in more datasets are prefixed
+    with dataset abbreviation
+    :param results: Computed values from evaluate_variables
+    :param index: Index of data
+    :return: DataFrame
+    """
+    names = collections.Counter(key[1] for key in results)
+    return pd.DataFrame(
+        {(key[1] if names[key[1]] == 1 else key[0] + '_' + key[1]): value for key, value in results.items()},
+        index=index,
+    )
+
+
+def print_summary(results, errors, geographies, seconds):
+    """
+    Print variables that couldn't be computed and variables that are null for every geography
+    :param results: Computed values from evaluate_variables
+    :param errors: Variables that couldn't be computed from evaluate_variables
+    :param geographies: Number of geographies
+    :param seconds: Duration of evaluation
+    :return:
+    """
+    for key, error in errors.items():
+        print('Warning: {}:{} can not be computed: {}'.format(key[0], key[1], error))
+    for key, value in results.items():
+        if geographies and np.isnan(value).all():
+            print('Warning: {}:{} is null for every geography!'.format(*key))
+    print('Computed {} variables for {} geographies in {:.3f}s, failed: {}'.format(
+        len(results), geographies, seconds, len(errors),
+    ))
+
+
+def menu():
+    """
+    Display menu and pass command line parameters.
+    :return: Options object with values from cmd
+    """
+    usage = "%prog -c arg -m arg"
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option(
+        '-c', '--config-file', dest='configFilePath', default='config.yml',
+        help='Full path to the config file!', metavar='configFilePath',
+    )
+    parser.add_option(
+        '-m', '--metadata-file', dest='metadataFile',
+        help='Metadata file with SE variables, it usually has ORG dataset too', metavar='metadataFile',
+    )
+    parser.add_option(
+        '-a', '--dataset', dest='datasets', action='append', default=[],
+        help='Abbreviation of dataset to compute (e.g. SE), can be repeated, all datasets by default',
+        metavar='dataset',
+    )
+    parser.add_option(
+        '-d', '--from-csv', dest='fromCsv', action='store_true', default=False,
+        help='Read ORG values from data files in sourceDirectory instead of database',
+    )
+    parser.add_option(
+        '-o', '--output', dest='output',
+        help='Save computed values to this csv file, one row for every geography', metavar='output',
+    )
+    (options, args) = parser.parse_args()
+    if not options.metadataFile:
+        parser.error('Metadata file is required!')
+    return options
+
+
+if __name__ == '__main__':
+    opt = menu()
+    config = create_metadata_file.get_config(opt.configFilePath)
+
+    formula_variables = get_formula_variables(opt.metadataFile)
+    data_columns = get_data_columns(formula_variables)
+    start = time.perf_counter()
+    if opt.fromCsv:
+        org_data = get_org_data_from_csv(
+            config['sourceDirectory'], config['fileNamesList'], config['projectId'], data_columns,
+            table_numbering_starts_from=config.get('tableNumberingStartsFrom', 1),
+        )
+    else:
+        org_data = get_org_data_from_db(
+            config['server'], config['dbName'], config['user'], config['password'], config['trustedConnection'],
+            str(config['projectYear']), data_columns,
+        )
+        create_metadata_file.close_db_connections()
+    print('Read {} columns for {} geographies in {:.3f}s'.format(
+        len(org_data.columns), len(org_data), time.perf_counter() - start,
+    ))
+    if org_data.empty:
+        examples = ', '.join(sorted(data_columns)[:3])
+        if opt.fromCsv:
+            print(
+                'Error: No column of data files in {} matched variables of the metadata file (e.g. {}), columns are '
+                'named {}_<table number>_<column>, check tableNumberingStartsFrom and fileNamesList in config '
+                'file!'.format(config['sourceDirectory'], examples, config['projectId'])
+            )
+        else:
+            print('Error: No column of {} tables in database matched variables of the metadata file (e.g. {})!'.format(
+                config['projectYear'], examples,
+            ))
+        sys.exit(1)
+
+    start = time.perf_counter()
+    computed, failed = evaluate_variables(formula_variables, org_data, opt.datasets)
+    print_summary(computed, failed, len(org_data), time.perf_counter() - start)
+
+    if opt.output:
+        get_results_frame(computed, org_data.index).to_csv(opt.output)
@@ -0,0 +1,179 @@
+"""
+This script will create geography crosswalk from all_geotypes_and_sumlev.csv and geoLevelInfo. Every geography of
+sumlevs from geoLevelInfo gets FIPS padded with leading zeros to its FIPS length, QName and SLXXX_FIPS (partial
+FIPS), SLXXX_NAME and acronym (e.g. PROVINCIA, partial FIPS too) columns of its own level and of all levels it is
+nested in, the same columns process_to_db_new.r creates with fixLeadingZeros and createNameAndFipsColumns.
+
+Crosswalk is cached next to all_geotypes_and_sumlev.csv, it's built again only if the file or geoLevelInfo change,
+so data files can be joined with it (see add_geo_columns) without building it every time.
+
+python geo_crosswalk.py -c config.yml -o crosswalk.csv
+"""
+import optparse
+import os
+import pickle
+import time
+
+import pandas as pd
+
+import create_metadata_file
+
+
+def get_crosswalk_cache_path(geo_types_path):
+    """
+    Default cache location is next to geography file e.g. configs/all_geotypes_and_sumlev.csv.crosswalk.cache.pickle
+    :param geo_types_path: Full path to all_geotypes_and_sumlev.csv
+    :return: Full path to cache file
+    """
+    return geo_types_path + '.crosswalk.cache.pickle'
+
+
+def pad_fips(fips, sumlevs, geo_hierarchy):
+    """
+    Add leading zeros that are lost when FIPS is read as a number, FIPS is padded to FIPS length of its level and
+    FIPS of levels with FIPS length 0 to at least two characters
+    :param fips: Series of FIPS codes as strings
+    :param sumlevs: Series of sumlevs of the same geographies
+    :param geo_hierarchy: GeoHierarchy of the project
+    :return: Series with padded FIPS
+    """
+    fips = fips.copy()
+    for level in geo_hierarchy:
+        rows = sumlevs == level.sumlev
+        fips[rows] = fips[rows].str.zfill(level.fips_length or 2)
+    return fips
+
+
+def build_crosswalk(geo_types_path, geo_hierarchy):
+    """
+    Create crosswalk from geography file, geographies of sumlevs that are not in geoLevelInfo are skipped
+    :param geo_types_path: Full path to all_geotypes_and_sumlev.csv
+    :param geo_hierarchy: GeoHierarchy of the project
+    :return: DataFrame with one row for every geography, sorted by FIPS
+    """
+    geographies = pd.read_csv(
+        geo_types_path, dtype=str, keep_default_na=False, encoding='utf-8', encoding_errors='replace',
+    )
+    geographies = geographies[geographies['SUMLEV'].isin([level.sumlev for level in geo_hierarchy])]
+    geographies = geographies.assign(FIPS=pad_fips(geographies['FIPS'], geographies['SUMLEV'], geo_hierarchy))
+    geographies = geographies.sort_values(['FIPS', 'SUMLEV'], kind='stable').reset_index(drop=True)
+    sumlevs = geographies['SUMLEV']
+
+    columns = {}
+    for level in geo_hierarchy:
+        # names of geographies of this level by their FIPS, used for geographies nested in them
+        names = geographies[sumlevs == level.sumlev].drop_duplicates('FIPS').set_index('FIPS')['NAME']
+        descendants = [i.sumlev for i in geo_hierarchy if level.sumlev in geo_hierarchy.get_ancestors(i.sumlev)]
+
+        full_fips = geographies['FIPS'].where(sumlevs == level.sumlev)
+        nested = sumlevs.isin(descendants)
+        full_fips[nested] = geographies.loc[nested, 'FIPS'].str[:level.fips_length]
+
+        partial_fips = full_fips.str[-level.partial_fips_length:] if level.partial_fips_length else full_fips
+        columns[level.sumlev + '_FIPS'] = partial_fips
+        columns[level.sumlev + '_NAME'] = geographies['NAME'].where(sumlevs == level.sumlev, full_fips.map(names))
+        columns[level.acronym] = partial_fips
+
+    # qualifying name is name of the geography followed by names of geographies it is nested in, from the nearest one
+    qname = geographies['NAME'].copy()
+    for level in geo_hierarchy:
+        ancestors = geo_hierarchy.get_ancestors(level.sumlev)
+        rows = sumlevs == level.sumlev
+        for ancestor in reversed(ancestors):
+            qname[rows] += (', ' + columns[ancestor + '_NAME'][rows]).fillna('')
+
+    crosswalk = geographies[['SUMLEV', 'FIPS', 'NAME', 'TYPE']].assign(QName=qname)
+    return pd.concat([crosswalk, pd.DataFrame(columns)], axis=1)
+
+
+def load_crosswalk(geo_types_path, geo_level_info, cache_path=None):
+    """
+    Get crosswalk from cache or build it, see build_crosswalk
+    :param geo_types_path: Full path to all_geotypes_and_sumlev.csv
+    :param geo_level_info: GeoInfo from config file
+    :param cache_path: Full path to cache file, if not set cache is not used
+    :return: DataFrame with crosswalk
+    """
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cache = pickle.load(f)
+            mtimes = [i.get('mtime') for i in cache.get('files', [])]
+            # same check as for variable descriptions, content is compared only if modification time changed
+            if cache.get('version') == 1 and cache['geo_level_info'] == geo_level_info and \
+                    create_metadata_file.is_variable_description_cache_valid(cache['files'], [geo_types_path]):
+                if mtimes != [i['mtime'] for i in cache['files']]:
+                    create_metadata_file.save_cache(cache_path, cache, 'Crosswalk')
+                return cache['crosswalk']
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, KeyError):
+            print('Info: Crosswalk cache can not be read, crosswalk will be built again.')
+
+    crosswalk = build_crosswalk(geo_types_path, create_metadata_file.GeoHierarchy(geo_level_info))
+
+    if cache_path:
+        stat = os.stat(geo_types_path)
+        cache = {
+            'version': 1,
+            'files': [{
+                'path': geo_types_path,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'hash': create_metadata_file.get_file_hash(geo_types_path),
+            }],
+            'geo_level_info': geo_level_info,
+            'crosswalk': crosswalk,
+        }
+        create_metadata_file.save_cache(cache_path, cache, 'Crosswalk')
+    return crosswalk
+
+
+def add_geo_columns(data, crosswalk, geo_hierarchy):
+    """
+    Pad Geo column of data file and add geography columns from crosswalk to it
+    :param data: DataFrame with SUMLEV and Geo columns, Geo as string
+    :param crosswalk: DataFrame from load_crosswalk
+    :param geo_hierarchy: GeoHierarchy of the project
+    :return: Data with crosswalk columns, rows that are not in crosswalk have them empty
+    """
+    data = data.assign(Geo=pad_fips(data['Geo'].astype(str), data['SUMLEV'], geo_hierarchy))
+    return data.merge(
+        crosswalk.rename(columns={'FIPS': 'Geo'}), on=['SUMLEV', 'Geo'], how='left', suffixes=('', '_geo'),
+    )
+
+
+def menu():
+    """
+    Display menu and pass command line parameters.
+    :return: Options object with values from cmd
+    """
+    usage = "%prog -c arg [-o arg]"
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option(
+        '-c', '--config-file', dest='configFilePath', default='config.yml',
+        help='Full path to the config file!', metavar='configFilePath',
+    )
+    parser.add_option(
+        '-o', '--output', dest='output',
+        help='Save crosswalk to this csv file', metavar='output',
+    )
+    parser.add_option(
+        '-r', '--rebuild', dest='rebuild', action='store_true', default=False,
+        help="Build crosswalk again even if it's cached",
+    )
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+    opt = menu()
+    config = create_metadata_file.get_config(opt.configFilePath)
+    geo_types_file = config['configDirectory'] + 'all_geotypes_and_sumlev.csv'
+    crosswalk_cache = get_crosswalk_cache_path(geo_types_file)
+    if opt.rebuild and os.path.isfile(crosswalk_cache):
+        os.remove(crosswalk_cache)
+
+    start = time.perf_counter()
+    geo_crosswalk = load_crosswalk(geo_types_file, config['geoLevelInfo'], crosswalk_cache)
+    print('Crosswalk with {} geographies ready in {:.3f}s'.format(len(geo_crosswalk), time.perf_counter() - start))
+    if opt.output:
+        geo_crosswalk.to_csv(opt.output, index=False, encoding='utf-8')
@@ -0,0 +1,338 @@
+"""
+This script will create data of all higher summary levels from the lowest one (e.g. municipalities) so data files
+don't have to be prepared with pre-aggregated rows for every level. Higher levels are taken from geoLevelInfo, FIPS
+of a parent is the beginning of FIPS of its children, e.g. municipality 34195252001 is in province 341952.
+
+Every column is aggregated by AggregationStr of its variable in ORG dataset of the metadata file, sums of all
+columns are computed with one grouped reduction for every level:
+    Add                                 - sum
+    Rate|numerator|denominator|factor   - sum of numerator / sum of denominator * factor
+    Percent|numerator|denominator       - sum of numerator / sum of denominator * 100
+    DivisionOfSums|numerator|denominator - sum of numerator / sum of denominator
+    WeightedAvg|weight                  - sum of value * weight / sum of weight
+Columns without variable in metadata file are added, other kinds (Median, None) can't be aggregated and are empty.
+
+python rollup_geographies.py -c config.yml -m PC2018_v2.xml -o rolled_up_data
+python rollup_geographies.py -c config.yml -m PC2018_v2.xml -k
+"""
+import collections
+import optparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from lxml import etree as et
+
+import create_metadata_file
+
+# AggregationStr is parsed by the same module that remaps it when SE tables are copied
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'generate_xml_and_other_examples'),
+)
+from aggregation_formulas import AggregationFormula  # noqa: E402
+
+# kinds that are aggregated as sum of numerator / sum of denominator, None means that factor is in AggregationStr
+ratio_factors = {'Rate': None, 'Percent': 100.0, 'DivisionOfSums': 1.0}
+
+
+def get_ancestor_levels(base_sumlev, geo_hierarchy):
+    """
+    Get levels that base level is nested in
+    :param base_sumlev: Sumlev of data e.g. SL050
+    :param geo_hierarchy: GeoHierarchy of the project
+    :return: List of (sumlev, FIPS length) tuples from the top level down
+    """
+    return [(i, geo_hierarchy[i].fips_length) for i in geo_hierarchy.get_ancestors(base_sumlev)]
+
+
+def get_aggregations(metadata_path, dataset='ORG'):
+    """
+    Read AggregationStr of variables of one dataset, GUIDs in it are replaced with variable names
+    :param metadata_path: Full path to metadata file
+    :param dataset: Abbreviation of dataset with variables of data files
+    :return: Dictionary with variable name as a key and AggregationFormula as a value
+    """
+    root = et.parse(metadata_path, et.XMLParser(huge_tree=True)).getroot()
+    names = {i.attrib['GUID']: i.attrib['name'] for i in root.iter('variable') if 'GUID' in i.attrib}
+
+    aggregations = {}
+    for survey_dataset in root.iter('SurveyDataset'):
+        if survey_dataset.attrib.get('abbreviation') != dataset:
+            continue
+        for variable in survey_dataset.iter('variable'):
+            formula = AggregationFormula.parse(variable.attrib.get('AggregationStr', 'Add'))
+            aggregations[variable.attrib['name']] = formula.remap(lambda guid: names.get(guid, ''))
+    return aggregations
+
+
+def get_rollup_plan(columns, aggregations):
+    """
+    Decide how every column is aggregated
+    :param columns: Column names of data
+    :param aggregations: Dictionary from get_aggregations, columns that are not in it are added
+    :return: Dictionary with column as a key and (kind, referenced columns, factor) as a value, kind is 'Add',
+    'Ratio' or 'WeightedAvg', and dictionary with columns that can't be aggregated as a key and reason as a value
+    """
+    plan = collections.OrderedDict()
+    errors = collections.OrderedDict()
+    for column in columns:
+        formula = aggregations.get(column, AggregationFormula('Add'))
+        references = [i.value for i in formula.operands if i.type == 'guid']
+        if formula.kind == 'Add':
+            plan[column] = ('Add', [], 1.0)
+        elif formula.kind in ratio_factors:
+            factor = ratio_factors[formula.kind]
+            if factor is None:
+                constants = formula.get_constants()
+                factor = constants[0] if constants and constants[0] is not None else 1.0
+            if len(references) < 2 or not all(i in columns for i in references[:2]):
+                errors[column] = formula.kind + ' numerator or denominator is not in data'
+            else:
+                plan[column] = ('Ratio', references[:2], factor)
+        elif formula.kind == 'WeightedAvg':
+            if not references or references[0] not in columns:
+                errors[column] = 'WeightedAvg weight is not in data'
+            else:
+                plan[column] = ('WeightedAvg', references[:1], 1.0)
+        else:
+            errors[column] = formula.kind + ' can not be aggregated'
+    return plan, errors
+
+
+def rollup(data, levels, plan):
+    """
+    Aggregate data to higher levels
+    :param data: DataFrame with numeric values of base level, indexed by FIPS
+    :param levels: Levels to create, see get_ancestor_levels
+    :param plan: How columns are aggregated, see get_rollup_plan, columns that are not in it are empty
+    :return: DataFrame with the same columns indexed by SUMLEV and FIPS
+    """
+    columns = list(data.columns)
+    position = {column: i for i, column in enumerate(columns)}
+    values = data.to_numpy(dtype=float)
+
+    # positions of columns in values and in sums of groups
+    add = [position[i] for i, p in plan.items() if p[0] == 'Add']
+    ratio = [(position[i], position[p[1][0]], position[p[1][1]], p[2]) for i, p in plan.items() if p[0] == 'Ratio']
+    weighted = [(position[i], position[p[1][0]]) for i, p in plan.items() if p[0] == 'WeightedAvg']
+    ratio = np.array(ratio, dtype=float).reshape(-1, 4)
+    weighted = np.array(weighted, dtype=int).reshape(-1, 2)
+
+    # weighted average needs sum of value * weight and sum of weights of rows where value is not null
+    weighted_values = values[:, weighted[:, 0]]
+    weights = np.where(np.isnan(weighted_values), np.nan, values[:, weighted[:, 1]])
+    summed = pd.DataFrame(np.hstack([values, weighted_values * weights, weights]))
+
+    frames = []
+    for sumlev, fips_length in levels:
+        sums = summed.groupby(data.index.str[:fips_length].to_numpy()).sum(min_count=1)
+        sum_values = sums.to_numpy()
+        result = np.full((len(sums), len(columns)), np.nan)
+        with np.errstate(all='ignore'):
+            result[:, add] = sum_values[:, add]
+            result[:, ratio[:, 0].astype(int)] = sum_values[:, ratio[:, 1].astype(int)] / \
+                sum_values[:, ratio[:, 2].astype(int)] * ratio[:, 3]
+            result[:, weighted[:, 0]] = sum_values[:, len(columns):len(columns) + len(weighted)] / \
+                sum_values[:, len(columns) + len(weighted):]
+        result[~np.isfinite(result)] = np.nan
+        frames.append(pd.DataFrame(
+            result, columns=columns,
+            index=pd.MultiIndex.from_arrays([[sumlev] * len(sums), sums.index], names=['SUMLEV', 'FIPS']),
+        ))
+    return pd.concat(frames)
+
+
+def read_data_file(csv_path, prefix, base_sumlev):
+    """
+    Read data file and take rows of base level, columns are renamed to variable names, geography columns are
+    dropped as in create_metadata_file.get_csv_columns
+    :param csv_path: Full path to data file
+    :param prefix: Prefix of variable names e.g. PC2018_005_
+    :param base_sumlev: Sumlev of rows that are aggregated
+    :return: Whole file and DataFrame of base level indexed by FIPS or None if file can't be aggregated
+    """
+    data = pd.read_csv(
+        csv_path, dtype={'SUMLEV': str, 'Geo': str}, keep_default_na=False, na_values=['', 'NA'],
+        encoding='utf-8', encoding_errors='replace',
+    )
+    value_columns = [
+        i for i in data.columns
+        if i not in ('SUMLEV', 'Geo') and 'FIPS' not in i and 'name' not in i.lower() and 'Geo' not in i
+    ]
+    base = data[data['SUMLEV'] == base_sumlev].set_index('Geo')[value_columns]
+    if base.empty:
+        print('Warning: File', os.path.basename(csv_path), 'has no rows of', base_sumlev + ', skipping it!')
+        return data, None
+    if not base.index.is_unique:
+        print('Warning: File', os.path.basename(csv_path), 'has more rows for the same geography, skipping it!')
+        return data, None
+    base = base.apply(pd.to_numeric, errors='coerce').rename(columns=lambda x: prefix + x)
+    base.index.name = 'FIPS'
+    return data, base
+
+
+def get_file_rows(rolled_up, base, levels):
+    """
+    Get rows of higher levels that have at least one base row of the file
+    :param rolled_up: Result of rollup
+    :param base: DataFrame of base level of one file
+    :param levels: Levels from get_ancestor_levels
+    :return: DataFrame with columns of the file
+    """
+    rows = np.zeros(len(rolled_up), dtype=bool)
+    sumlevs = rolled_up.index.get_level_values('SUMLEV')
+    fipses = rolled_up.index.get_level_values('FIPS')
+    for sumlev, fips_length in levels:
+        rows |= (sumlevs == sumlev) & fipses.isin(base.index.str[:fips_length].unique())
+    return rolled_up.loc[rows, list(base.columns)]
+
+
+def compare_with_file(data, file_rows, prefix, rtol=1e-6):
+    """
+    Compare aggregated values with pre-aggregated rows of the data file
+    :param data: Whole data file
+    :param file_rows: Aggregated rows of the file from get_file_rows
+    :param prefix: Prefix of variable names
+    :param rtol: Relative tolerance of comparison
+    :return: Number of compared values and list of (sumlev, FIPS, column) that are different
+    """
+    expected = data.set_index(['SUMLEV', 'Geo'])
+    expected.index.names = ['SUMLEV', 'FIPS']
+    expected = expected.rename(columns=lambda x: prefix + x)
+    common = file_rows.index.intersection(expected.index)
+    actual = file_rows.loc[common]
+    expected = expected.loc[common, actual.columns].apply(pd.to_numeric, errors='coerce')
+
+    actual_values = actual.to_numpy(dtype=float)
+    expected_values = expected.to_numpy(dtype=float)
+    different = ~np.isclose(actual_values, expected_values, rtol=rtol, equal_nan=True)
+    rows, cols = np.nonzero(different)
+    return different.size, [common[i] + (actual.columns[j],) for i, j in zip(rows, cols)]
+
+
+def write_data_file(output_path, data, file_rows, base_sumlev, prefix):
+    """
+    Write data file with aggregated rows of higher levels followed by rows of base level
+    :param output_path: Full path to new data file
+    :param data: Whole data file, only its columns and base rows are used
+    :param file_rows: Aggregated rows of the file from get_file_rows
+    :param base_sumlev: Sumlev of base level
+    :param prefix: Prefix of variable names
+    :return:
+    """
+    rolled_up = file_rows.rename(columns=lambda x: x[len(prefix):]).reset_index().rename(columns={'FIPS': 'Geo'})
+    output = pd.concat([rolled_up, data[data['SUMLEV'] == base_sumlev]], ignore_index=True)
+    output[list(data.columns)].to_csv(output_path, index=False, float_format='%.15g')
+
+
+def run(config_path, metadata_path=None, output_directory=None, base_sumlev=None, check=False):
+    """
+    Aggregate all data files of the project
+    :param config_path: Full path to config file
+    :param metadata_path: Full path to metadata file with AggregationStr of variables, if not set all columns are
+    added
+    :param output_directory: Directory where data files with all levels are written, nothing is written if not set
+    :param base_sumlev: Sumlev of rows that are aggregated, the last level of geoLevelInfo by default
+    :param check: Compare aggregated values with pre-aggregated rows of data files
+    :return: Number of values that are different from data files
+    """
+    config = create_metadata_file.get_config(config_path)
+    geo_hierarchy = create_metadata_file.GeoHierarchy(config['geoLevelInfo'])
+    source_directory = config['sourceDirectory']
+    base_sumlev = base_sumlev or list(geo_hierarchy)[-1].sumlev
+    levels = get_ancestor_levels(base_sumlev, geo_hierarchy)
+    aggregations = get_aggregations(metadata_path) if metadata_path else {}
+    if not aggregations:
+        print('Warning: No variables with AggregationStr, all columns will be added!')
+
+    start = time.perf_counter()
+    files = collections.OrderedDict()
+    for counter, file_name in enumerate(
+            create_metadata_file.get_csv_file_names(source_directory, config['fileNamesList']),
+            config.get('tableNumberingStartsFrom', 1),
+    ):
+        csv_path = source_directory + file_name
+        if not os.path.isfile(csv_path):
+            continue
+        prefix = config['projectId'] + '_' + create_metadata_file.get_table_suffix(counter) + '_'
+        data, base = read_data_file(csv_path, prefix, base_sumlev)
+        if base is not None:
+            files[file_name] = (prefix, data, base)
+    if not files:
+        print('Error: No data files with rows of', base_sumlev, 'found!')
+        sys.exit(1)
+    # numerators, denominators and weights can be in other files
+    combined = pd.concat([i[2] for i in files.values()], axis=1)
+    print('Read {} files with {} columns and {} geographies in {:.3f}s'.format(
+        len(files), len(combined.columns), len(combined), time.perf_counter() - start,
+    ))
+
+    start = time.perf_counter()
+    plan, errors = get_rollup_plan(list(combined.columns), aggregations)
+    for column, error in errors.items():
+        print('Warning: {} will be empty: {}'.format(column, error))
+    rolled_up = rollup(combined, levels, plan)
+    print('Aggregated to {} in {:.3f}s, rows: {}'.format(
+        ', '.join(i[0] for i in levels), time.perf_counter() - start, len(rolled_up),
+    ))
+
+    different_values = 0
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    for file_name, (prefix, data, base) in files.items():
+        file_rows = get_file_rows(rolled_up, base, levels)
+        if check:
+            compared, different = compare_with_file(data, file_rows, prefix)
+            different_values += len(different)
+            print('{:<30} compared: {:>8} different: {:>6}'.format(file_name, compared, len(different)))
+            for sumlev, fips, column in different[:10]:
+                print('    {} {} {}: {} in file, {} aggregated'.format(
+                    sumlev, fips, column, data.loc[(data['SUMLEV'] == sumlev) & (data['Geo'] == fips),
+                                                   column[len(prefix):]].iloc[0],
+                    file_rows.loc[(sumlev, fips), column],
+                ))
+        if output_directory:
+            write_data_file(os.path.join(output_directory, file_name), data, file_rows, base_sumlev, prefix)
+    return different_values
+
+
+def menu():
+    """
+    Display menu and pass command line parameters.
+    :return: Options object with values from cmd
+    """
+    usage = "%prog -c arg [-m arg] [-o arg] [-k]"
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option(
+        '-c', '--config-file', dest='configFilePath', default='config.yml',
+        help='Full path to the config file!', metavar='configFilePath',
+    )
+    parser.add_option(
+        '-m', '--metadata-file', dest='metadataFile',
+        help='Metadata file with AggregationStr of variables in ORG dataset, all columns are added if not set',
+        metavar='metadataFile',
+    )
+    parser.add_option(
+        '-o', '--output-directory', dest='outputDirectory',
+        help='Write data files with rows of all levels to this directory', metavar='outputDirectory',
+    )
+    parser.add_option(
+        '-l', '--base-sumlev', dest='baseSumlev',
+        help='Sumlev of rows that are aggregated, the last level of geoLevelInfo by default', metavar='baseSumlev',
+    )
+    parser.add_option(
+        '-k', '--check', dest='check', action='store_true', default=False,
+        help='Compare aggregated values with pre-aggregated rows of data files',
+    )
+    (options, args) = parser.parse_args()
+    if not options.outputDirectory and not options.check:
+        parser.error('Output directory or check is required!')
+    return options
+
+
+if __name__ == '__main__':
+    opt = menu()
+    if run(opt.configFilePath, opt.metadataFile, opt.outputDirectory, opt.baseSumlev, opt.check):
+        sys.exit(1)